@@ -1,4 +1,19 @@
 #!/usr/bin/python3
+#
+# Camera calibration: K and D for share/undistort.yml
+#
+#   .calibration/undistort.py
+#   .calibration/undistort.py -i share/undistort.yml -o share/undistort.yml
+#   .calibration/undistort.py -r /tmp/result chessboards.new
+#
+# Chessboard corners are found in a process pool and cached by image
+# content in .calibration/.cache, so only added images are processed
+# on the next run. -i starts from the current calibration.
+#
+# -o is not written when RMS reprojection error is above --max-rms or
+# worse than the RMS of the -i calibration on the same images: check
+# the per image errors and remove the worst images.
+#
 
 import os
 import sys
@@ -7,90 +22,254 @@ root = os.path.dirname(os.path.abspath(__file__))
 lib = os.path.abspath(os.path.join(root, '../lib'))
 sys.path.insert(0, lib)
 
+import multiprocessing
 import numpy as np
-import base64
-import cv2
+import argparse
+import hashlib
+import zipfile
 import glob
-import io
+import cv2
 
 # termination criteria
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
 
-rows = 0
-cols = 0
-imgs = list()
+# corners cache directory
+CACHE = os.path.join(root, '.cache')
+
+
+def cache_path(fname, width, height):
+    ''' cache file of the image content and chessboard size '''
+    with open(fname, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+
+    return os.path.join(CACHE, f'{digest}-{width}x{height}.npz')
+
+
+def find_corners(args):
+    ''' pool worker: (image size, refined corners or None) '''
+    fname, width, height = args
+
+    img = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None, None
+
+    # Find the chess board corners
+    ret, corners = cv2.findChessboardCorners(img, (width, height), None)
+    if not ret:
+        return img.shape[::-1], None
+
+    corners = cv2.cornerSubPix(img, corners, (11, 11), (-1, -1), criteria)
+
+    return img.shape[::-1], corners
+
+
+def detect(images, width, height, jobs):
+    ''' {fname: (image size, corners or None)}, cached '''
+    result = dict()
+    todo = list()
+
+    os.makedirs(CACHE, exist_ok=True)
+
+    for fname in images:
+        path = cache_path(fname, width, height)
+        try:
+            with np.load(path) as npz:
+                corners = npz['corners'] if npz['found'] else None
+                result[fname] = (tuple(npz['size']), corners)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            todo.append((fname, path))
+
+    print(f'{len(images)} images, {len(result)} cached, '
+          f'{len(todo)} to process')
+
+    if len(todo) > 0:
+        with multiprocessing.Pool(jobs) as pool:
+            found = pool.imap(
+                find_corners,
+                [(fname, width, height) for fname, _ in todo]
+            )
+            for (fname, path), (size, corners) in zip(todo, found):
+                if size is None:
+                    print(fname, 'failed to read')
+                    continue
+
+                result[fname] = (size, corners)
 
-def calibrate(dirpath, width=9, height=6):
-    global rows, cols, imgs
+                # never leave a partial cache file
+                with open(path + '.tmp', 'wb') as f:
+                    np.savez(
+                        f,
+                        found=corners is not None,
+                        size=np.array(size),
+                        corners=corners if corners is not None
+                        else np.zeros(0)
+                    )
+                os.replace(path + '.tmp', path)
 
-    """ Apply camera calibration operation for images in the given directory path. """
+    return result
+
+
+def reprojection_rms(objpoints, imgpoints, mtx, dist):
+    ''' RMS error of the calibration, board poses are estimated '''
+    total = 0.0
+    count = 0
+
+    for objp, imgp in zip(objpoints, imgpoints):
+        ok, rvec, tvec = cv2.solvePnP(objp, imgp, mtx, dist)
+        if not ok:
+            return float('inf')
+
+        proj, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+        diff = proj.reshape(-1, 2) - imgp.reshape(-1, 2)
+        total += np.sum(diff ** 2)
+        count += len(diff)
+
+    return np.sqrt(total / count)
+
+
+def calibrate(images, width=9, height=6, jobs=None, guess=None):
+    ''' Apply camera calibration operation for the given images. '''
     # prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(8,6,0)
     objp = np.zeros((height * width, 3), np.float32)
-    objp[:,:2] = np.mgrid[0:width, 0:height].T.reshape(-1, 2)
+    objp[:, :2] = np.mgrid[0:width, 0:height].T.reshape(-1, 2)
 
     # Arrays to store object points and image points from all the images.
     objpoints = []  # 3d point in real world space
     imgpoints = []  # 2d points in image plane.
+    imgs = []
+    size = None
 
-    images = glob.glob(os.path.join(dirpath, '*.jpg'))
+    for fname, (s, corners) in sorted(detect(images, width, height,
+                                             jobs).items()):
+        if corners is None:
+            print(fname, 'chessboard not found')
+            continue
 
-    for fname in sorted(images):
-        img = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+        if size is not None and s != size:
+            print(fname, f'skipped: {s[0]}x{s[1]} image')
+            continue
 
-        # Find the chess board corners
-        ret, corners = cv2.findChessboardCorners(img, (width, height), None)
+        size = s
+        objpoints.append(objp)
+        imgpoints.append(corners)
+        imgs.append(fname)
 
-        # If found, add object points, image points (after refining them)
-        if ret:
-            print(fname, "chessboard found")
-            objpoints.append(objp)
+    if len(imgs) == 0:
+        raise SystemExit('no chessboards found')
 
-            corners2 = cv2.cornerSubPix(img, corners, (11,11), (-1,-1), criteria)
-            imgpoints.append(corners2)
+    # start from the current calibration
+    flags = 0
+    mtx, dist = None, None
+    seed = None
+    if guess is not None:
+        mtx, dist = guess[0].copy(), guess[1].copy()
+        flags = cv2.CALIB_USE_INTRINSIC_GUESS
+        seed = reprojection_rms(objpoints, imgpoints, *guess)
 
-            imgs.append(fname)
-            rows, cols = img.shape[:2]
-        else:
-            print(fname, "chessboard not found")
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(
+        objpoints, imgpoints, size, mtx, dist, flags=flags
+    )
 
-    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, img.shape[::-1], None, None)
+    # per image RMS reprojection error
+    errors = dict()
+    for fname, objp, imgp, rvec, tvec in zip(imgs, objpoints, imgpoints,
+                                             rvecs, tvecs):
+        proj, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+        diff = proj.reshape(-1, 2) - imgp.reshape(-1, 2)
+        errors[fname] = np.sqrt(np.mean(np.sum(diff ** 2, axis=1)))
 
-    return [ret, mtx, dist, rvecs, tvecs]
+    return ret, mtx, dist, errors, size, seed
 
 
-if __name__ == '__main__':
-    image_dir = os.path.join(root, 'chessboards')
-    ret, mtx, dist, rvecs, tvecs = calibrate(image_dir, 9, 6)
+def main():
+    parser = argparse.ArgumentParser(
+        description='camera calibration'
+    )
+    parser.add_argument('dirs', nargs='*',
+                        default=['chessboards'],
+                        help='directories with chessboard *.jpg files, '
+                             'relative to .calibration '
+                             '(default: chessboards)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='corner detection processes '
+                             '(default: cpu count)')
+    parser.add_argument('-i', '--initial',
+                        help='start from K and D of this undistort.yml')
+    parser.add_argument('-o', '--output',
+                        help='write K and D to this file')
+    parser.add_argument('--max-rms', type=float, default=1.5,
+                        help='do not write -o above this RMS error, '
+                             'pixels (default: 1.5)')
+    parser.add_argument('-r', '--result',
+                        help='write undistorted images to this directory')
+    parser.add_argument('--width', type=int, default=9,
+                        help='chessboard inner corners per row (default: 9)')
+    parser.add_argument('--height', type=int, default=6,
+                        help='chessboard inner corners per column '
+                             '(default: 6)')
+    args = parser.parse_args()
+
+    images = list()
+    for d in args.dirs:
+        images += glob.glob(os.path.join(root, d, '*.jpg'))
+
+    guess = None
+    if args.initial is not None:
+        fs = cv2.FileStorage(args.initial, cv2.FILE_STORAGE_READ)
+        guess = (fs.getNode('K').mat(), fs.getNode('D').mat())
+        fs.release()
+
+    ret, mtx, dist, errors, (cols, rows), seed = calibrate(
+        images, args.width, args.height, args.jobs, guess
+    )
     print("Calibration is finished\n")
-    print("RMS:", ret)
 
-    newcammtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (cols, rows), 0, (cols, rows))
-    _, _, w, h = roi
-    print("ROI: 1920x1080 -> {}x{}".format(w, h))
+    # the worst images first: candidates to remove
+    for fname, err in sorted(errors.items(), key=lambda e: -e[1]):
+        print('{:8.3f} {}'.format(err, os.path.relpath(fname, root)))
+
+    print("\nRMS:", ret)
+    if seed is not None:
+        print("RMS of the initial calibration:", seed)
 
-    mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcammtx, (cols, rows), 5)
+    # never replace a calibration with a worse one
+    rejected = None
+    if ret > args.max_rms:
+        rejected = f'RMS is above {args.max_rms}'
+    elif seed is not None and ret > seed:
+        rejected = 'RMS is worse than the initial calibration'
 
-    for fname in imgs:
-        img = cv2.imread(fname)
-        dst = cv2.remap(img, mapx, mapy, cv2.INTER_LINEAR)
-        dstpath = os.path.join(root, 'result', os.path.basename(fname))
-        cv2.imwrite(dstpath, dst)
+    newcammtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (cols, rows),
+                                                   0, (cols, rows))
+    _, _, w, h = roi
+    print("ROI: {}x{} -> {}x{}".format(cols, rows, w, h))
+
+    if args.result is not None:
+        os.makedirs(args.result, exist_ok=True)
+        mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcammtx,
+                                                 (cols, rows), 5)
+        for fname in errors:
+            img = cv2.imread(fname)
+            dst = cv2.remap(img, mapx, mapy, cv2.INTER_LINEAR)
+            dstpath = os.path.join(args.result, os.path.basename(fname))
+            cv2.imwrite(dstpath, dst)
 
-    #print("\nCompressed KD.npz:")
-    #npz = io.BytesIO()
-    #np.savez_compressed(npz, K=mtx, D=dist)
-    #npz.seek(0)
-    #base64.encode(npz, sys.stdout.buffer)
+    if args.output is not None and rejected is not None:
+        raise SystemExit(f'\n{rejected}, {args.output} is not written')
 
-    cv_file = cv2.FileStorage('/dev/shm/kd.yml', cv2.FILE_STORAGE_WRITE)
+    path = args.output or '/dev/shm/kd.yml'
+    cv_file = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
     cv_file.write("K", mtx)
     cv_file.write("D", dist)
     cv_file.release()
 
-    with open('/dev/shm/kd.yml', 'r') as f:
+    with open(path, 'r') as f:
         print('\nUndistortion matrix:\n')
         sys.stdout.write(f.read())
 
-    print(cols, rows)
+    if args.output is None:
+        os.unlink(path)
 
-    os.unlink('/dev/shm/kd.yml')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+#
+# Compare full entropy-coded data scan with header-only jpeg check
+# used by v4l2mjpg on every dequeued frame
+#
+#   bench/jpegcheck.py recording.mjpeg
+#   bench/jpegcheck.py -n 100 -p 4096 .calibration/chessboards.new
+#
+
+import ctypes as ct
+import argparse
+import time
+import sys
+import os
+import os.path
+
+
+ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..'
+))
+
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'python'))
+
+from mjpgreplay import MJpgReplay  # noqa: E402
+
+
+def load_check():
+    lib = ct.CDLL(os.path.join(ROOT, 'lib', 'libv4l2mjpg.so'))
+    check = lib.v4l2_jpeg_check
+    check.argtypes = [
+        ct.c_void_p,
+        ct.c_uint,
+        ct.c_int,
+        ct.POINTER(ct.c_ushort),
+        ct.POINTER(ct.c_ushort)
+    ]
+    check.restype = ct.c_int
+    return check
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='jpeg check benchmark'
+    )
+    parser.add_argument('path',
+                        help='directory with *.jpg files, mjpeg or mpjpeg')
+    parser.add_argument('-n', '--iterations', type=int, default=20,
+                        help='passes over all frames (default: 20)')
+    parser.add_argument('-p', '--padding', type=int, default=0,
+                        help='zero bytes after EOI, like v4l2 bytesused '
+                             'of some cameras (default: 0)')
+    args = parser.parse_args()
+
+    check = load_check()
+    w = ct.c_ushort(0)
+    h = ct.c_ushort(0)
+
+    replay = MJpgReplay(args.path)
+    buffers = list()
+    for offset, size, fw, fh, ts in replay.frames:
+        data = replay.mm[offset:offset + size] + b'\0' * args.padding
+        buffers.append((ct.create_string_buffer(data, len(data)), size))
+
+    # both modes must agree on valid and truncated frames
+    for buf, size in buffers:
+        for full in (1, 0):
+            r = check(buf, len(buf), full, w, h)
+            if r != size:
+                print(f'frame check failed: full={full} {r} != {size}')
+                return 1
+        truncated = tuple(check(buf, size // 2, full, w, h)
+                          for full in (0, 1))
+        if truncated != (-1, -1):
+            print(f'truncated frame passed: {truncated}')
+            return 1
+
+    total = sum(len(buf) for buf, _ in buffers)
+    print('{} frames, {:.1f} KiB average'
+          .format(len(buffers), total / len(buffers) / 1024))
+
+    results = dict()
+    for name, full in (('full scan', 1), ('headers only', 0)):
+        t = time.perf_counter()
+        for _ in range(args.iterations):
+            for buf, _ in buffers:
+                check(buf, len(buf), full, w, h)
+        t = (time.perf_counter() - t) / args.iterations / len(buffers)
+        results[name] = t
+        print('{:<14} {:>9.2f} us/frame {:>9.1f} MiB/s'
+              .format(name, t * 1e6, total / len(buffers) / t / 2**20))
+
+    print('speedup {:.1f}x'.format(
+        results['full scan'] / results['headers only']
+    ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+#
+# Compare motion kernels of every instruction set supported by this cpu
+#
+#   bench/motion.py
+#   bench/motion.py -n 2000 -s 240x135,1920x1080
+#
+
+import ctypes as ct
+import argparse
+import random
+import time
+import sys
+import os
+import os.path
+
+
+ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..'
+))
+
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'python'))
+
+from motion import Motion  # noqa: E402
+
+
+def frames(w, h):
+    ''' two noisy frames with a moving square and a full mask '''
+    size = w * h
+    rnd = random.Random(w * h)
+    f0 = bytes(rnd.randrange(256) for _ in range(size))
+    f1 = bytearray(min(255, max(0, b + rnd.randint(-20, 20))) for b in f0)
+
+    for y in range(h // 4, h // 2):
+        f1[y * w + w // 4:y * w + w // 2] = b'\xff' * (w // 2 - w // 4)
+
+    return (
+        (ct.c_ubyte * size).from_buffer_copy(f0),
+        (ct.c_ubyte * size).from_buffer_copy(bytes(f1)),
+        (ct.c_ubyte * size).from_buffer_copy(b'\xff' * size),
+    )
+
+
+def timeit(fn, n):
+    fn()
+    t = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='motion kernels benchmark'
+    )
+    parser.add_argument('-n', '--iterations', type=int, default=500,
+                        help='calls per kernel (default: 500)')
+    parser.add_argument('-s', '--sizes', default='240x135,720x405,1920x1080',
+                        help='comma separated map sizes '
+                             '(default: 240x135,720x405,1920x1080)')
+    args = parser.parse_args()
+
+    md = Motion()
+    best = md.isa
+
+    isas = list()
+    for isa in Motion.ISAS:
+        try:
+            md.isa = isa
+        except ValueError:
+            continue
+        isas.append(isa)
+
+    print(f'load time choice: {best}')
+    print()
+    print('{:<10} {:<20} '.format('size', 'kernel')
+          + ''.join('{:>12}'.format(isa) for isa in isas))
+
+    for size in args.sizes.split(','):
+        w, h = (int(v) for v in size.split('x'))
+        f0, f1, mask = frames(w, h)
+
+        tile_w = 16 * max(1, w // 240)
+        tile_h = 8 * max(1, h // 135)
+        tiles = ((w + tile_w - 1) // tile_w) * ((h + tile_h - 1) // tile_h)
+        counts = (ct.c_ulong * tiles)()
+        mean = (ct.c_short * (w * h))()
+        dev = (ct.c_short * (w * h))()
+
+        kernels = {
+            'count_different_bytes': lambda: md.count_different_bytes(
+                f0, f1, w * h, 28
+            ),
+            'count_different_tiles': lambda: md.count_different_tiles(
+                f0, f1, mask, w, h, tile_w, tile_h, 28, counts
+            ),
+            'background_update': lambda: md.background_update(
+                f1, mean, dev, mask, w, h, tile_w, tile_h, 12, 5, counts
+            ),
+        }
+
+        for name, fn in kernels.items():
+            line = '{:<10} {:<20} '.format(size, name[:20])
+            for isa in isas:
+                md.isa = isa
+                md.background_reset(f0, mean, w * h)
+                line += '{:>9.1f} us'.format(
+                    timeit(fn, args.iterations) * 1e6
+                )
+            print(line)
+
+    md.isa = best
+
+
+if __name__ == '__main__':
+    main()
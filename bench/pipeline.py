@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+#
+# Run doorcam loop on recorded frames and report per-stage latency
+#
+#   bench/pipeline.py -n 3000 -f 0 -p raw,scale .calibration/chessboards.new
+#   bench/pipeline.py -o new.json --compare old.json recording.mpjpeg
+#   bench/pipeline.py -t memfd -p qrscan recording.mpjpeg
+#
+
+import subprocess
+import argparse
+import tempfile
+import json
+import yaml
+import sys
+import os
+import os.path
+
+
+ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..'
+))
+
+
+def table(result, base=None):
+    print('{} frames in {:.2f}s: {:.1f} fps ({} transport)'.format(
+        result['frames'], result['seconds'], result['fps'],
+        result['transport']
+    ))
+    if base is not None:
+        print('    baseline: {:.1f} fps ({:+.1f}%)'.format(
+            base['fps'], 100.0 * (result['fps'] / base['fps'] - 1)
+            if base['fps'] > 0 else 0.0
+        ))
+
+    print()
+    print('{:<24} {:>8} {:>10} {:>10} {:>10}'.format(
+        'stage', 'count', 'p50 ms', 'p99 ms', 'max ms'
+    ))
+
+    for name, s in sorted(result['stages'].items()):
+        line = '{:<24} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            name, s['count'], s['p50'] * 1e3, s['p99'] * 1e3, s['max'] * 1e3
+        )
+        if base is not None and name in base['stages']:
+            b = base['stages'][name]
+            if b['p50'] > 0:
+                line += '  p50 {:+.1f}%'.format(
+                    100.0 * (s['p50'] / b['p50'] - 1)
+                )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='doorcam pipeline benchmark'
+    )
+    parser.add_argument('source',
+                        help='jpeg directory, mjpeg or mpjpeg file')
+    parser.add_argument('-n', '--frames', type=int, default=1000,
+                        help='number of frames (default: 1000)')
+    parser.add_argument('-f', '--fps', type=float, default=0,
+                        help='replay fps, 0 - as fast as possible')
+    parser.add_argument('-t', '--transport', default='pipe',
+                        choices=('pipe', 'ring', 'memfd'))
+    parser.add_argument('-p', '--plugins', default=None,
+                        help='comma separated plugins (default: all)')
+    parser.add_argument('-o', '--output', default='bench_output.json',
+                        help='result file (default: bench_output.json)')
+    parser.add_argument('--compare', default=None,
+                        help='previous result file')
+    args = parser.parse_args()
+
+    cfg = {
+        'source': {
+            'replay': os.path.abspath(args.source),
+            'fps': args.fps,
+            'loop': True,
+            'limit': args.frames,
+        },
+        'transport': args.transport,
+        'bench': os.path.abspath(args.output),
+    }
+
+    if args.plugins is not None:
+        cfg['plugins'] = [p for p in args.plugins.split(',') if p]
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            tempfile.NamedTemporaryFile('w', suffix='.yml') as f:
+        # own frame server socket, a running doorcam keeps its one
+        if args.transport == 'memfd':
+            cfg['memfd'] = {'socket': os.path.join(tmp, 'doorcam.sock')}
+
+        yaml.safe_dump(cfg, f)
+        f.flush()
+
+        env = os.environ.copy()
+        env['DOORCAM_CFG'] = f.name
+
+        rc = subprocess.call([os.path.join(ROOT, 'doorcam')], env=env)
+        if rc != 0:
+            sys.exit(rc)
+
+    with open(args.output, 'r') as f:
+        result = json.load(f)
+
+    base = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)
+
+    table(result, base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+#
+# Compare turbojpeg binding modes: header peek, scaled and planar
+# decode, compression and lossless crop into a fresh buffer per call
+# and into a reused one
+#
+#   bench/turbojpeg.py
+#   bench/turbojpeg.py -n 500 .calibration/chessboards/01.jpg
+#
+
+import ctypes as ct
+import argparse
+import time
+import sys
+import os
+import os.path
+
+
+ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..'
+))
+
+sys.path.insert(0, os.path.join(ROOT, 'lib', 'python'))
+
+from turbojpeg import TJCompress, TJDecompress, TJTransform  # noqa: E402
+
+
+def run(name, iterations, func):
+    ''' prints and returns seconds per call '''
+    func()
+
+    t = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    t = (time.perf_counter() - t) / iterations
+
+    print('{:<22} {:>10.1f} us'.format(name, t * 1e6))
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='turbojpeg bindings benchmark'
+    )
+    parser.add_argument('path', nargs='?',
+                        default=os.path.join(ROOT, 'share', '289.jpg'),
+                        help='jpeg file (default: share/289.jpg)')
+    parser.add_argument('-n', '--iterations', type=int, default=100,
+                        help='calls per mode (default: 100)')
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as f:
+        data = f.read()
+
+    jpeg = ct.create_string_buffer(data, len(data))
+    size = len(data)
+
+    tjd = TJDecompress()
+    tjc = TJCompress()
+    tjt = TJTransform()
+
+    w, h, subsamp, _ = tjd.header(jpeg, size)
+    print('{}x{}, subsampling {}, {:.1f} KiB'
+          .format(w, h, subsamp, size / 1024))
+
+    n = args.iterations
+    run('header', n, lambda: tjd.header(jpeg, size))
+
+    # luminance only, every scaling factor down to 1/8
+    gray = dict()
+    for factor in ((1, 1), (1, 2), (1, 4), (1, 8)):
+        sw, sh = tjd.scaled(w, factor), tjd.scaled(h, factor)
+        buf = ct.create_string_buffer(sw * sh)
+        gray[factor] = buf
+        run('gray {}/{} {}x{}'.format(*factor, sw, sh), n,
+            lambda: tjd.decompress(jpeg, size, buf, sw, sh,
+                                   tjd.TJPF_GRAY))
+
+    bgr = ct.create_string_buffer(w * h * 3)
+    run('bgr', n, lambda: tjd.decompress(jpeg, size, bgr, w, h))
+
+    # Y plane is the same luminance, chroma planes are not converted
+    if subsamp == tjd.TJSAMP_GRAY:
+        components = (0,)
+    else:
+        components = (0, 1, 2)
+    planes = list()
+    for c in components:
+        pw, ph = tjd.plane_size(c, w, h, subsamp)
+        planes.append(ct.create_string_buffer(pw * ph))
+    run('yuv planes', n,
+        lambda: tjd.decompress_to_yuv(jpeg, size, planes, w, h))
+
+    if planes[0].raw != gray[(1, 1)].raw:
+        print('Y plane differs from gray decode')
+        return 1
+
+    # compress the decoded image back: without dst the output is copied
+    # out of the reused buffer, fresh dst is the cost of no reuse at all
+    size_max = tjc.buffer_size(w, h, subsamp)
+    dst = bytearray(size_max)
+    encoded = tjc.compress(bgr, len(bgr), w, h, jpeg_subsample=subsamp)
+    if tjc.compress(bgr, len(bgr), w, h, jpeg_subsample=subsamp,
+                    dst=dst) != encoded:
+        print('compress to dst differs')
+        return 1
+
+    t = run('compress fresh dst', n,
+            lambda: tjc.compress(bgr, len(bgr), w, h,
+                                 jpeg_subsample=subsamp,
+                                 dst=bytearray(size_max)))
+    run('compress bytes', n,
+        lambda: tjc.compress(bgr, len(bgr), w, h, jpeg_subsample=subsamp))
+    t_dst = run('compress dst', n,
+                lambda: tjc.compress(bgr, len(bgr), w, h,
+                                     jpeg_subsample=subsamp, dst=dst))
+    print('reuse speedup {:.2f}x'.format(t / t_dst))
+
+    # lossless crop of the central quarter
+    crop = tjt.crop_region(w // 4, h // 4, w // 2, h // 2, subsamp)
+    cropped = tjt.transform(jpeg, size, crop=crop)
+    cw, ch, _, _ = tjd.header(cropped, len(cropped))
+    if (cw, ch) != crop[2:]:
+        print(f'crop size {cw}x{ch} != {crop[2]}x{crop[3]}')
+        return 1
+
+    size_max = tjc.buffer_size(crop[2], crop[3], subsamp)
+    dst = bytearray(size_max)
+    t = run('crop fresh dst', n,
+            lambda: tjt.transform(jpeg, size, crop=crop,
+                                  dst=bytearray(size_max)))
+    run('crop bytes', n, lambda: tjt.transform(jpeg, size, crop=crop))
+    t_dst = run('crop dst', n,
+                lambda: tjt.transform(jpeg, size, crop=crop, dst=dst))
+    print('reuse speedup {:.2f}x'.format(t / t_dst))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+__version__ = '0.0.0'
+
+from .catalog import Catalog
+from .webm import webm_cues
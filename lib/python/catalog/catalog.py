@@ -0,0 +1,177 @@
+import threading
+import sqlite3
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    peak REAL NOT NULL DEFAULT 0.0
+);
+CREATE INDEX IF NOT EXISTS events_started ON events (started);
+
+CREATE TABLE IF NOT EXISTS motion (
+    event INTEGER NOT NULL REFERENCES events (id),
+    second INTEGER NOT NULL,
+    intensity REAL NOT NULL,
+    PRIMARY KEY (event, second)
+);
+CREATE INDEX IF NOT EXISTS motion_second ON motion (second);
+
+CREATE TABLE IF NOT EXISTS keyframes (
+    event INTEGER NOT NULL REFERENCES events (id),
+    ts REAL NOT NULL,
+    pos INTEGER NOT NULL,
+    PRIMARY KEY (event, ts)
+);
+
+CREATE TABLE IF NOT EXISTS codes (
+    ts REAL NOT NULL,
+    text TEXT NOT NULL,
+    valid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS codes_ts ON codes (ts);
+'''
+
+# event is running or overlaps [t0, t1]
+OVERLAPS = '''
+    started <= :t1 AND COALESCE(finished, started) >= :t0
+'''
+
+
+class Catalog():
+    '''
+    sqlite index of recorded events
+
+    events    - recording file, start and end capture time, peak motion
+    motion    - per second motion intensity (max of the second)
+    keyframes - capture time and byte offset of webm key frames
+    codes     - QR codes seen by qrscan
+
+    Times are unix timestamps. The database is in WAL mode: rec and
+    qrscan write to it while the CLI reads, every method may be
+    called from any thread.
+    '''
+
+    def __init__(self, path, readonly=False):
+        if readonly:
+            self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True,
+                                      timeout=10.0,
+                                      check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(path, timeout=10.0,
+                                      check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = NORMAL')
+            self.db.executescript(SCHEMA)
+
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __write(self, sql, *args):
+        with self.lock, self.db:
+            return self.db.execute(sql, args)
+
+    def __read(self, sql, **args):
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    #
+    # recorder side
+    #
+    def event_start(self, file, ts):
+        ''' returns event id '''
+        return self.__write(
+            'INSERT INTO events (file, started) VALUES (?, ?)', file, ts
+        ).lastrowid
+
+    def motion(self, event, second, intensity):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO motion VALUES (?, ?, ?)',
+                (event, second, intensity)
+            )
+            self.db.execute(
+                'UPDATE events SET peak = MAX(peak, ?) WHERE id = ?',
+                (intensity, event)
+            )
+
+    def event_end(self, event, ts, keyframes=()):
+        ''' keyframes - [(ts, offset), ...] '''
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE events SET finished = ? WHERE id = ?', (ts, event)
+            )
+            self.db.executemany(
+                'INSERT OR REPLACE INTO keyframes VALUES (?, ?, ?)',
+                ((event, t, pos) for t, pos in keyframes)
+            )
+
+    def code(self, ts, text, valid):
+        self.__write('INSERT INTO codes VALUES (?, ?, ?)',
+                     ts, text, int(valid))
+
+    #
+    # queries
+    #
+    def events(self, t0=0.0, t1=float('inf')):
+        ''' events overlapping [t0, t1] with number of QR codes seen '''
+        return self.__read(f'''
+            SELECT e.*, (
+                SELECT COUNT(*) FROM codes c
+                WHERE c.ts BETWEEN e.started
+                    AND COALESCE(e.finished, e.started)
+            ) AS codes
+            FROM events e
+            WHERE {OVERLAPS}
+            ORDER BY started
+        ''', t0=t0, t1=t1)
+
+    def top(self, limit=10, t0=0.0, t1=float('inf')):
+        ''' seconds of [t0, t1] with the highest motion intensity '''
+        return self.__read('''
+            SELECT e.id AS event, e.file, m.second, m.intensity
+            FROM motion m JOIN events e ON e.id = m.event
+            WHERE m.second BETWEEN :t0 AND :t1
+            ORDER BY m.intensity DESC, m.second
+            LIMIT :limit
+        ''', t0=t0, t1=t1, limit=limit)
+
+    def seek(self, ts):
+        '''
+        file, byte offset and capture time of the key frame at or
+        before ts (the first one of the event if ts is before it),
+        None if no event covers ts
+        '''
+        rows = self.__read('''
+            SELECT e.id, e.file FROM events e
+            WHERE started <= :ts AND COALESCE(finished, started) >= :ts
+            ORDER BY started DESC
+            LIMIT 1
+        ''', ts=ts)
+        if len(rows) == 0:
+            return None
+
+        event, file = rows[0]
+        rows = self.__read('''
+            SELECT ts, pos FROM keyframes
+            WHERE event = :event
+            ORDER BY ts <= :ts DESC,
+                     CASE WHEN ts <= :ts THEN -ts ELSE ts END
+            LIMIT 1
+        ''', event=event, ts=ts)
+        if len(rows) == 0:
+            return None
+
+        return file, rows[0]['pos'], rows[0]['ts']
+
+    def codes(self, t0=0.0, t1=float('inf')):
+        return self.__read('''
+            SELECT * FROM codes WHERE ts BETWEEN :t0 AND :t1 ORDER BY ts
+        ''', t0=t0, t1=t1)
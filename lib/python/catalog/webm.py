@@ -0,0 +1,132 @@
+import os
+
+
+# EBML element ids
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMESCALE = 0x2AD7B1
+CUES = 0x1C53BB6B
+CUEPOINT = 0xBB
+CUETIME = 0xB3
+CUETRACKPOSITIONS = 0xB7
+CUECLUSTERPOSITION = 0xF1
+
+
+def vint(data, i, marker=False):
+    ''' EBML variable size integer at data[i], returns value, next index '''
+    b = data[i]
+    if b == 0:
+        raise ValueError('invalid EBML integer')
+
+    n = 9 - b.bit_length()
+    value = b if marker else b & (0xFF >> n)
+    for k in range(1, n):
+        value = (value << 8) | data[i + k]
+
+    # all value bits set: unknown size
+    if not marker and value == (1 << (7 * n)) - 1:
+        value = None
+
+    return value, i + n
+
+
+def header(f, pos):
+    ''' returns element id, data size (None - unknown) and data offset '''
+    f.seek(pos)
+    data = f.read(12)
+    if len(data) < 2:
+        raise EOFError
+
+    eid, i = vint(data, 0, True)
+    size, i = vint(data, i)
+
+    return eid, size, pos + i
+
+
+def children(data):
+    ''' yields (id, data) of elements in master element data '''
+    i = 0
+    while i < len(data):
+        eid, i = vint(data, i, True)
+        size, i = vint(data, i)
+        if size is None:
+            raise ValueError('unknown size element')
+        yield eid, data[i:i + size]
+        i += size
+
+
+def uint(data):
+    return int.from_bytes(data, 'big')
+
+
+def webm_cues(path):
+    '''
+    Seek points of a webm file: [(time, offset), ...]
+
+    time - seconds from the first frame, offset - byte offset of the
+    cluster starting with the key frame. Only headers, Info and Cues
+    are read, cluster data is skipped.
+    '''
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+
+        eid, size, pos = header(f, 0)
+        if eid != EBML or size is None:
+            raise ValueError(f'{path}: not a webm file')
+
+        eid, size, segment = header(f, pos + size)
+        if eid != SEGMENT:
+            raise ValueError(f'{path}: no segment')
+        if size is not None:
+            end = min(end, segment + size)
+
+        # nanoseconds per timestamp unit
+        scale = 1000000
+        cues = None
+        pos = segment
+
+        # level 1 elements, Cues are written at the end by ffmpeg
+        while pos < end:
+            try:
+                eid, size, data = header(f, pos)
+            except EOFError:
+                break
+
+            if size is None:
+                # live stream, no cues
+                break
+
+            if eid == INFO:
+                f.seek(data)
+                for cid, value in children(f.read(size)):
+                    if cid == TIMESCALE:
+                        scale = uint(value)
+            elif eid == CUES:
+                f.seek(data)
+                cues = f.read(size)
+
+            pos = data + size
+
+    if cues is None:
+        return list()
+
+    points = list()
+    for cid, cuepoint in children(cues):
+        if cid != CUEPOINT:
+            continue
+
+        t = None
+        cluster = None
+        for eid, value in children(cuepoint):
+            if eid == CUETIME:
+                t = uint(value)
+            elif eid == CUETRACKPOSITIONS:
+                for pid, position in children(value):
+                    if pid == CUECLUSTERPOSITION:
+                        cluster = uint(position)
+
+        if t is not None and cluster is not None:
+            points.append((t * scale / 1e9, segment + cluster))
+
+    return points
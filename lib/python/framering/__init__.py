@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+__version__ = '0.0.0'
+
+from .framering import FrameRing
@@ -0,0 +1,268 @@
+from ctypes.util import find_library
+import ctypes as ct
+import struct
+import mmap
+
+
+PAGE = mmap.PAGESIZE
+
+# atomic builtins of gcc runtime, readers and the writer share no lock
+if find_library('atomic') is None:
+    raise ImportError('libatomic of gcc runtime is not found, '
+                      'install it for the ring transport')
+libatomic = ct.cdll.LoadLibrary(find_library('atomic'))
+
+SEQ_CST = 5
+
+atomic_exchange_4 = libatomic.__atomic_exchange_4
+atomic_exchange_4.argtypes = [ct.c_void_p, ct.c_int32, ct.c_int]
+atomic_exchange_4.restype = ct.c_int32
+
+atomic_load_8 = libatomic.__atomic_load_8
+atomic_load_8.argtypes = [ct.c_void_p, ct.c_int]
+atomic_load_8.restype = ct.c_uint64
+
+atomic_store_8 = libatomic.__atomic_store_8
+atomic_store_8.argtypes = [ct.c_void_p, ct.c_uint64, ct.c_int]
+atomic_store_8.restype = None
+
+atomic_exchange_8 = libatomic.__atomic_exchange_8
+atomic_exchange_8.argtypes = [ct.c_void_p, ct.c_uint64, ct.c_int]
+atomic_exchange_8.restype = ct.c_uint64
+
+atomic_thread_fence = libatomic.atomic_thread_fence
+atomic_thread_fence.argtypes = [ct.c_int]
+atomic_thread_fence.restype = None
+
+# ring header: sequence number of the last published frame
+HEAD = struct.Struct('@Q')
+
+# reader entry: index of the slot held by reader (-1 - none)
+HOLD = struct.Struct('@i')
+
+# slot header: seq, ts, capture sequence, size, width, height, motion zones,
+# motion intensity; seq is 0 while the slot is written
+SLOT = struct.Struct('@QdIIHHIf')
+
+
+def align(n, a=PAGE):
+    return (n + a - 1) // a * a
+
+
+class FrameRing():
+    '''
+    Multi-slot shared memory frame ring.
+
+    The capture process copies every frame to the next free slot
+    and requeues v4l2 buffer at once. Forked plugins read the ring
+    at their own pace, every reader has its own cursor and holds
+    at most one slot at a time. The writer never blocks: it skips
+    the held slots and overwrites the oldest free one.
+
+    There is no lock: a reader killed at any point must not stop
+    the capture. A reader publishes the slot it is going to hold,
+    then checks the slot seq is unchanged. The writer invalidates
+    the slot seq, then checks the slot is still not held. Both are
+    sequentially consistent atomics, so either the reader sees the
+    invalidated seq and retries, or the writer sees the hold and
+    takes another slot.
+    '''
+
+    def __init__(self, slots=16, slot_size=1 << 20, readers=32):
+        if slots < 2:
+            raise ValueError('frame ring needs at least 2 slots')
+
+        self.slots = slots
+        self.slot_size = align(slot_size)
+        self.readers = readers
+
+        # atomics need naturally aligned seq and holds
+        self.slot_stride = align(SLOT.size, 8)
+        self.holds_offset = HEAD.size
+        self.slots_offset = align(self.holds_offset + HOLD.size * readers, 8)
+        self.data_offset = align(self.slots_offset +
+                                 self.slot_stride * slots)
+
+        self.mm = mmap.mmap(
+            -1, self.data_offset + self.slot_size * slots,
+            mmap.MAP_SHARED | mmap.MAP_ANONYMOUS,
+            mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.addr = ct.addressof(ct.c_char.from_buffer(self.mm))
+
+        # all holds and slot seqs at once, plain reads
+        self.holds = memoryview(self.mm)[
+            self.holds_offset:self.holds_offset + HOLD.size * readers
+        ].cast('i')
+        self.seqs = memoryview(self.mm)[
+            self.slots_offset:self.data_offset
+        ].cast('Q')[:self.slot_stride // 8 * slots:self.slot_stride // 8]
+
+        HEAD.pack_into(self.mm, 0, 0)
+        for i in range(readers):
+            HOLD.pack_into(self.mm, self.holds_offset + HOLD.size * i, -1)
+        for i in range(slots):
+            self.__set_slot(i, 0, 0.0, 0, 0, 0, 0, 0, 0.0)
+
+        # writer state
+        self.seq = 0
+        self.last = -1
+        self.dropped = 0
+
+    def __slot(self, i):
+        return SLOT.unpack_from(self.mm,
+                                self.slots_offset + self.slot_stride * i)
+
+    def __set_slot(self, i, *args):
+        SLOT.pack_into(self.mm, self.slots_offset + self.slot_stride * i,
+                       *args)
+
+    def __seq(self, i):
+        return atomic_load_8(
+            self.addr + self.slots_offset + self.slot_stride * i, SEQ_CST
+        )
+
+    def __set_hold(self, reader, slot):
+        atomic_exchange_4(
+            self.addr + self.holds_offset + HOLD.size * reader, slot, SEQ_CST
+        )
+
+    def __held(self):
+        ''' held slots, ordered after the preceding atomics '''
+        atomic_thread_fence(SEQ_CST)
+        return set(self.holds)
+
+    def put(self, addr, size, ts, sequence, width, height, motion,
+            intensity=0.0):
+        ''' copy frame to the ring, returns frame seq or 0 if dropped '''
+
+        if size > self.slot_size:
+            self.dropped += 1
+            return 0
+
+        held = self.__held()
+
+        slot = -1
+        for i in range(1, self.slots + 1):
+            candidate = (self.last + i) % self.slots
+            if candidate in held:
+                continue
+
+            # invalidate slot before overwriting, then check
+            # a reader did not take it in the meantime
+            atomic_exchange_8(
+                self.addr + self.slots_offset + self.slot_stride * candidate,
+                0, SEQ_CST
+            )
+            if candidate not in self.__held():
+                slot = candidate
+                break
+
+        if slot == -1:
+            # every slot is held by readers
+            self.dropped += 1
+            return 0
+
+        offset = self.data_offset + self.slot_size * slot
+        ct.memmove(self.addr + offset, addr, size)
+
+        # metadata first, publish seq and head last
+        self.seq += 1
+        self.last = slot
+        self.__set_slot(slot, 0, ts, sequence, size,
+                        width, height, motion, intensity)
+        atomic_store_8(
+            self.addr + self.slots_offset + self.slot_stride * slot,
+            self.seq, SEQ_CST
+        )
+        atomic_store_8(self.addr, self.seq, SEQ_CST)
+
+        return self.seq
+
+    def reset(self, reader):
+        ''' drop the slot held by died reader '''
+        self.__set_hold(reader, -1)
+
+    def reader(self, index, backlog=0):
+        return FrameRingReader(self, index, backlog)
+
+    def _acquire(self, index, cursor, backlog):
+        while True:
+            head = atomic_load_8(self.addr, SEQ_CST)
+            if head <= cursor:
+                return None
+
+            if backlog > 0:
+                target = max(cursor + 1, head - backlog + 1)
+            else:
+                target = head
+
+            # find the oldest available frame not older than target,
+            # a torn seq is caught by the check below
+            found = None
+            for i, seq in enumerate(self.seqs):
+                if seq < target:
+                    continue
+                if found is None or seq < found[1]:
+                    found = (i, seq)
+
+            if found is None:
+                return None
+
+            # hold the slot, retry if it was overwritten meanwhile
+            i, seq = found
+            self.__set_hold(index, i)
+            if self.__seq(i) == seq:
+                break
+            self.__set_hold(index, -1)
+
+        # the writer does not touch a held slot
+        (_, ts, sequence, size, width, height, motion,
+         intensity) = self.__slot(i)
+        offset = self.data_offset + self.slot_size * i
+        jpeg = memoryview(self.mm)[offset:offset + size]
+
+        return seq, ts, sequence, jpeg, width, height, motion, intensity
+
+    def _release(self, index):
+        self.__set_hold(index, -1)
+
+
+class FrameRingReader():
+    '''
+    Frame ring cursor
+
+    backlog - drop policy:
+        0 - latest frame only
+        N - process frames in order, lag behind up to N frames
+    '''
+
+    def __init__(self, ring, index, backlog=0):
+        if index >= ring.readers:
+            raise ValueError('frame ring reader index out of range')
+
+        self.ring = ring
+        self.index = index
+        self.backlog = min(backlog, ring.slots - 1)
+        self.cursor = 0
+        self.dropped = 0
+
+    def acquire(self):
+        '''
+        returns (ts, sequence, jpeg, width, height, motion, intensity)
+        or None
+        '''
+        frame = self.ring._acquire(self.index, self.cursor, self.backlog)
+        if frame is None:
+            return None
+
+        seq, ts, sequence, jpeg, width, height, motion, intensity = frame
+
+        if self.cursor > 0:
+            self.dropped += seq - self.cursor - 1
+        self.cursor = seq
+
+        return ts, sequence, jpeg, width, height, motion, intensity
+
+    def release(self):
+        self.ring._release(self.index)
@@ -0,0 +1,287 @@
+import ctypes as ct
+import socket
+import struct
+import fcntl
+import errno
+import mmap
+import time
+import os
+
+
+# client hello: plugin name, backlog
+HELLO = struct.Struct('@32sI')
+
+# server reply: initial width, height, fps numerator, denominator
+INFO = struct.Struct('@HHII')
+
+# frame: ts, capture sequence, size, width, height, motion zones,
+# motion intensity, frames dropped for the plugin so far
+FRAME = struct.Struct('@dIIHHIfI')
+
+# memfd is immutable once sent
+SEALS = (fcntl.F_SEAL_SEAL | fcntl.F_SEAL_SHRINK |
+         fcntl.F_SEAL_GROW | fcntl.F_SEAL_WRITE)
+
+# all motion zones
+ALL_ZONES = 0xFFFFFFFF
+
+# seconds for a connected plugin to send hello
+HELLO_TIMEOUT = 5.0
+
+
+class FrameServer():
+    '''
+    Unix socket frame server
+
+    Every frame is copied to a new sealed memfd, its descriptor is
+    passed to connected plugins with SCM_RIGHTS. Plugins map the
+    memfd read-only, the frame lives until the last mapping is gone,
+    so plugins attach, detach and restart independently of the
+    capture process.
+
+    Every plugin acknowledges released frames with one byte. The
+    server never blocks: a frame is dropped for a plugin which holds
+    more than backlog + 1 frames or whose socket is full. Hello of a
+    new plugin is read when it arrives, the server does not wait.
+
+    zones - function returning motion zones bitmask of the plugin
+            (all zones by default)
+    '''
+
+    def __init__(self, path, width, height, fps, zones=None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.zones = zones
+        self.clients = list()
+        self.pending = list()
+        self.dropped = 0
+
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.sock.bind(path)
+        self.sock.listen(32)
+        self.sock.setblocking(False)
+
+    def __accept(self):
+        now = time.monotonic()
+
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except BlockingIOError:
+                break
+
+            conn.setblocking(False)
+            self.pending.append((conn, now + HELLO_TIMEOUT))
+
+        for conn, deadline in list(self.pending):
+            try:
+                name, backlog = HELLO.unpack(conn.recv(HELLO.size))
+                conn.send(INFO.pack(self.width, self.height, *self.fps))
+            except BlockingIOError:
+                if now < deadline:
+                    continue
+                conn.close()
+            except (OSError, struct.error):
+                conn.close()
+            else:
+                name = name.rstrip(b'\0').decode('utf-8', 'replace')
+                zones = (ALL_ZONES if self.zones is None
+                         else self.zones(name))
+                self.clients.append(
+                    FrameServerClient(conn, name, backlog, zones)
+                )
+
+            self.pending.remove((conn, deadline))
+
+    def put(self, addr, size, ts, sequence, width, height, motion,
+            intensity=0.0):
+        ''' send frame to every plugin, returns number of receivers '''
+        self.__accept()
+
+        self.width = width
+        self.height = height
+
+        for client in list(self.clients):
+            if not client.poll():
+                client.close()
+                self.clients.remove(client)
+
+        if len(self.clients) == 0:
+            return 0
+
+        fd = os.memfd_create('doorcam-frame',
+                             os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+        try:
+            mv = memoryview((ct.c_char * size).from_address(addr)).cast('B')
+            written = 0
+            while written < size:
+                written += os.write(fd, mv[written:])
+            mv.release()
+            fcntl.fcntl(fd, fcntl.F_ADD_SEALS, SEALS)
+
+            sent = 0
+            for client in list(self.clients):
+                data = FRAME.pack(ts, sequence, size, width, height,
+                                  motion & client.zones, intensity,
+                                  client.dropped)
+                r = client.send(data, fd)
+                if r is None:
+                    client.close()
+                    self.clients.remove(client)
+                elif r:
+                    sent += 1
+                else:
+                    self.dropped += 1
+        finally:
+            os.close(fd)
+
+        return sent
+
+    def close(self, unlink=True):
+        ''' unlink=False: close inherited sockets in a forked child '''
+        for client in self.clients:
+            client.close()
+        self.clients = list()
+
+        for conn, _ in self.pending:
+            conn.close()
+        self.pending = list()
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if unlink:
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+
+
+class FrameServerClient():
+    def __init__(self, conn, name, backlog, zones):
+        self.conn = conn
+        self.name = name
+        self.backlog = backlog
+        self.zones = zones
+        self.inflight = 0
+        self.dropped = 0
+
+    def poll(self):
+        ''' collect acknowledgements, False if plugin is gone '''
+        while True:
+            try:
+                data = self.conn.recv(4096)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+
+            if len(data) == 0:
+                return False
+
+            self.inflight = max(self.inflight - len(data), 0)
+
+    def send(self, data, fd):
+        ''' True if sent, False if dropped, None if plugin is gone '''
+        if self.inflight > self.backlog:
+            self.dropped += 1
+            return False
+
+        try:
+            socket.send_fds(self.conn, [data], [fd])
+        except BlockingIOError:
+            self.dropped += 1
+            return False
+        except OSError as e:
+            if e.errno in (errno.ENOBUFS, errno.ETOOMANYREFS):
+                self.dropped += 1
+                return False
+            return None
+
+        self.inflight += 1
+        return True
+
+    def close(self):
+        self.conn.close()
+
+
+class FrameClient():
+    '''
+    Plugin side of FrameServer
+
+    backlog - frames to hold in addition to the one being processed
+              (see Plugin.backlog in plugins/README.txt)
+    '''
+
+    def __init__(self, path, name, backlog=0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.sock.connect(path)
+            self.sock.send(HELLO.pack(name.encode('utf-8'), backlog))
+            w, h, num, den = INFO.unpack(self.sock.recv(INFO.size))
+        except Exception:
+            self.sock.close()
+            raise
+
+        self.width = w
+        self.height = h
+        self.fps = (num, den)
+        self.mm = None
+
+        # frames the server dropped for this plugin
+        self.dropped = 0
+
+    def acquire(self):
+        '''
+        wait for the next frame, returns
+        (ts, sequence, jpeg, width, height, motion, intensity) or None
+        at the end of stream
+        '''
+        try:
+            data, fds, _, _ = socket.recv_fds(self.sock, FRAME.size, 1)
+        except ConnectionResetError:
+            # server closed with unread frames
+            return None
+
+        if len(data) == 0:
+            return None
+
+        if len(fds) != 1 or len(data) != FRAME.size:
+            for fd in fds:
+                os.close(fd)
+            raise IOError('malformed frame message')
+
+        ts, sequence, size, width, height, motion, intensity, dropped = \
+            FRAME.unpack(data)
+        self.dropped = dropped
+
+        try:
+            if fcntl.fcntl(fds[0], fcntl.F_GET_SEALS) & SEALS != SEALS:
+                raise IOError('frame memfd is not sealed')
+            self.mm = mmap.mmap(fds[0], size, mmap.MAP_SHARED,
+                                mmap.PROT_READ)
+        finally:
+            os.close(fds[0])
+
+        jpeg = memoryview(self.mm)
+
+        return ts, sequence, jpeg, width, height, motion, intensity
+
+    def release(self):
+        # unmapped as soon as the last view of the frame is released
+        self.mm = None
+        try:
+            self.sock.send(b'\1')
+        except OSError:
+            pass
+
+    def close(self):
+        self.mm = None
+        self.sock.close()
@@ -0,0 +1,309 @@
+from datetime import datetime
+from fractions import Fraction
+import ctypes as ct
+import statistics
+import struct
+import errno
+import mmap
+import time
+import os
+import os.path
+
+
+# SOFn markers with frame dimensions
+SOF = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+       0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+
+def jpeg_scan(buf, offset, end):
+    ''' returns (jpeg end, width, height) or None '''
+    b = offset
+    w = h = 0
+
+    if buf[b:b + 2] != b'\xff\xd8':
+        return None
+
+    b += 2
+
+    while b + 4 <= end:
+        if buf[b] != 0xFF:
+            return None
+
+        while b < end and buf[b] == 0xFF:
+            b += 1
+
+        marker = buf[b]
+        b += 1
+
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+
+        if marker == 0xD9:
+            return None
+
+        length = (buf[b] << 8) + buf[b + 1]
+
+        if marker in SOF:
+            h = (buf[b + 3] << 8) + buf[b + 4]
+            w = (buf[b + 5] << 8) + buf[b + 6]
+
+        if marker == 0xDA:
+            # entropy-coded data never contains FFD9
+            eoi = buf.find(b'\xff\xd9', b + length, end)
+            if eoi == -1 or w == 0 or h == 0:
+                return None
+            return eoi + 2, w, h
+
+        b += length
+
+    return None
+
+
+def exif_time(buf, offset, end):
+    ''' DateTimeOriginal.SubSecTimeOriginal from APP1 or None '''
+    b = offset + 2
+
+    while b + 4 <= end and buf[b] == 0xFF:
+        marker = buf[b + 1]
+        length = (buf[b + 2] << 8) + buf[b + 3]
+
+        if marker == 0xDA:
+            return None
+
+        if marker == 0xE1 and buf[b + 4:b + 10] == b'Exif\0\0':
+            return tiff_time(bytes(buf[b + 10:b + 2 + length]))
+
+        b += 2 + length
+
+    return None
+
+
+def tiff_time(tiff):
+    try:
+        bo = {b'MM': '>', b'II': '<'}[tiff[:2]]
+    except KeyError:
+        return None
+
+    def ifd(offset):
+        tags = dict()
+        count, = struct.unpack_from(bo + 'H', tiff, offset)
+        for i in range(count):
+            tag, typ, n, value = struct.unpack_from(
+                bo + 'HHI4s', tiff, offset + 2 + i * 12
+            )
+            if typ == 2 and n > 4:
+                o, = struct.unpack(bo + 'I', value)
+                value = tiff[o:o + n]
+            tags[tag] = (typ, value)
+        return tags
+
+    try:
+        ifd0 = ifd(struct.unpack_from(bo + 'I', tiff, 4)[0])
+        exif = ifd(struct.unpack(bo + 'I', ifd0[0x8769][1])[0])
+        dt = exif[0x9003][1].split(b'\0')[0].decode()
+        ss = exif.get(0x9291, (2, b''))[1].split(b'\0')[0].decode()
+    except (KeyError, IndexError, UnicodeError, struct.error):
+        return None
+
+    # rec and scale plugins write dashes in the date
+    try:
+        ts = datetime.strptime(dt.replace('-', ':'),
+                               '%Y:%m:%d %H:%M:%S').timestamp()
+    except ValueError:
+        return None
+
+    if ss.isdigit():
+        ts += int(ss) / 10 ** len(ss)
+
+    return ts
+
+
+class MJpgReplay():
+    '''
+    Replay recorded frames with V4L2MJpg interface
+
+    path - directory with *.jpg files, concatenated mjpeg file
+           or mpjpeg (multipart) stream
+    fps  - None: original timing (EXIF DateTimeOriginal or default_fps)
+           0: as fast as possible
+           N: fixed frame rate
+    loop - start over at the end of stream
+    limit - stop after N frames (0 - no limit)
+    '''
+
+    def __init__(self, path, fps=None, loop=False, limit=0,
+                 default_fps=(30, 1)):
+        if os.path.isdir(path):
+            self.__load_dir(path)
+        else:
+            self.__load_file(path)
+
+        if len(self.frames) == 0:
+            raise Exception(f'No jpeg frames found in {path}')
+
+        self.__cbuf = ct.c_char.from_buffer(self.mm)
+        self.addr = ct.addressof(self.__cbuf)
+
+        # original timing
+        stamps = [f[4] for f in self.frames]
+        interval = Fraction(default_fps[1], default_fps[0])
+
+        if None not in stamps and len(stamps) > 1:
+            deltas = [b - a for a, b in zip(stamps, stamps[1:])]
+            median = statistics.median(deltas)
+            if median > 0:
+                interval = Fraction(median).limit_denominator(1001)
+                interval = 1 / (1 / interval).limit_denominator(1001)
+            self.offsets = [max(t - stamps[0], 0.0) for t in stamps]
+        else:
+            self.offsets = [i * float(interval)
+                            for i in range(len(self.frames))]
+
+        if fps:
+            interval = 1 / Fraction(fps).limit_denominator(1001)
+            self.offsets = [i * float(interval)
+                            for i in range(len(self.frames))]
+
+        self.pace = fps != 0
+        self.duration = self.offsets[-1] + float(interval)
+        self.fps = (interval.denominator, interval.numerator)
+
+        self.loop = loop
+        self.limit = limit
+        self.count = 0
+        self.skipped = 0
+        self.dropped = 0
+
+        self.__index = 0
+        self.__base = 0.0
+        self.__t0 = None
+        self.__pending = False
+
+    def __load_dir(self, path):
+        names = sorted(n for n in os.listdir(path)
+                       if n.lower().endswith(('.jpg', '.jpeg')))
+
+        data = bytearray()
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as f:
+                data += f.read()
+
+        self.mm = mmap.mmap(
+            -1, max(len(data), 1),
+            mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS,
+            mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.mm[:len(data)] = data
+        self.frames = self.__split_mjpeg(0, len(data))
+
+    def __load_file(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        if self.mm[:2] == b'--':
+            self.frames = self.__split_mpjpeg(len(self.mm))
+        else:
+            self.frames = self.__split_mjpeg(0, len(self.mm))
+
+    def __frame(self, offset, end):
+        info = jpeg_scan(self.mm, offset, end)
+        if info is None:
+            return None, offset + 2
+        stop, w, h = info
+        ts = exif_time(self.mm, offset, stop)
+        return (offset, stop - offset, w, h, ts), stop
+
+    def __split_mjpeg(self, offset, end):
+        frames = list()
+
+        while True:
+            offset = self.mm.find(b'\xff\xd8', offset, end)
+            if offset == -1:
+                return frames
+
+            frame, offset = self.__frame(offset, end)
+            if frame is not None:
+                frames.append(frame)
+
+    def __split_mpjpeg(self, end):
+        frames = list()
+        offset = 0
+
+        while True:
+            offset = self.mm.find(b'--', offset, end)
+            if offset == -1:
+                return frames
+
+            body = self.mm.find(b'\r\n\r\n', offset, end)
+            if body == -1:
+                return frames
+
+            length = None
+            for line in self.mm[offset:body].split(b'\r\n')[1:]:
+                key, _, value = line.partition(b':')
+                if key.strip().lower() == b'content-length':
+                    length = int(value)
+
+            body += 4
+            if length is None:
+                frame, offset = self.__frame(body, end)
+            else:
+                frame, _ = self.__frame(body, min(body + length, end))
+                offset = body + length
+
+            if frame is not None:
+                frames.append(frame)
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        self.__t0 = time.monotonic()
+
+    def dqbuf(self):
+        if self.__pending:
+            raise Exception('Failed DQBUF: [Errno {}] {}'
+                            .format(errno.EBUSY, os.strerror(errno.EBUSY)))
+
+        if self.limit > 0 and self.count >= self.limit:
+            raise EOFError('End of stream')
+
+        if self.__index == len(self.frames):
+            if not self.loop:
+                raise EOFError('End of stream')
+            self.__index = 0
+            self.__base += self.duration
+
+        if self.pace:
+            delay = (self.__t0 + self.__base + self.offsets[self.__index]
+                     - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+
+        offset, size, w, h, _ = self.frames[self.__index]
+        self.__index += 1
+        self.__pending = True
+        self.count += 1
+
+        return self.addr + offset, size, w, h, time.time(), self.count - 1
+
+    def qbuf(self):
+        if not self.__pending:
+            raise Exception('Failed QBUF: [Errno {}] {}'
+                            .format(errno.ENOENT, os.strerror(errno.ENOENT)))
+        self.__pending = False
+
+    def stop(self):
+        pass
+
+    def close(self):
+        if getattr(self, 'mm', None) is not None:
+            self.__cbuf = None
+            self.mm.close()
+            self.mm = None
@@ -3,3 +3,5 @@
 __version__ = '0.0.0'
 
 from .motion import Motion
+from .detection import MotionDetection, ENGINES, MODELS, MAX_ZONES
+from .pipeline import MotionPipeline
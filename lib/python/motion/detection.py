@@ -0,0 +1,325 @@
+from turbojpeg import TJDecompress
+import ctypes as ct
+import logging
+import mmap
+import time
+
+from .motion import Motion
+import perf
+
+
+# motion engines
+ENGINES = ('decode', 'dc')
+
+# compare frame with: running average background, previous analyzed frame
+MODELS = ('background', 'frames')
+
+# max number of zones (bits of zones mask)
+MAX_ZONES = 32
+
+
+def rects(area):
+    ''' [x0, y0, x1, y1] or list of them, normalized coordinates '''
+    if len(area) == 4 and all(isinstance(v, (int, float)) for v in area):
+        area = [area]
+
+    for r in area:
+        if len(r) != 4 or not (0 <= r[0] < r[2] <= 1 and
+                               0 <= r[1] < r[3] <= 1):
+            raise ValueError(f'Bad zone rectangle: {r}')
+
+    return [tuple(r) for r in area]
+
+
+def inside(x, y, area):
+    return any(x0 <= x < x1 and y0 <= y < y1 for x0, y0, x1, y1 in area)
+
+
+class MotionDetection():
+    '''
+    Compare grayscale maps of frames with background model
+
+    engine - 'decode': decompress frame to w x h grayscale image
+             'dc': 8x8 luma block means taken from jpeg DC coefficients
+                   (240x135 for 1920x1080, no IDCT and color conversion)
+    threshold - number of changed pixels of w x h image that triggers
+                motion (scaled to the block map for 'dc' engine)
+    noise_level - noise threshold for the motion detection (grayscale),
+                  default: 12 for 'background' model (added to per pixel
+                  noise estimate), 28 for 'frames'
+    skip - analyze every frame while there is motion, back off up to
+           every (skip + 1) frame when the scene is idle
+    model - 'background': running average background with per pixel
+                          noise estimate
+            'frames': diff with the previous analyzed frame
+    learning - background learning rate: 1 / 2^learning per analyzed frame
+    lighting - fraction of changed pixels treated as lighting change or
+               exposure step: no motion, background starts over
+    zones - {name: {'area': [x0, y0, x1, y1] or list of them,
+                    'threshold': n}}, normalized coordinates, areas are
+            rounded to tiles (128x64 pixels of 1920x1080 frame),
+            whole frame with default threshold if not set
+    exclude - never count changes in these areas (normalized [x0, y0,
+              x1, y1] list)
+
+    process() returns bitmask of zones with motion (bit i - zones[i]),
+    intensity is the fraction of changed pixels of the last analyzed
+    frame (0.0 - 1.0, 0.0 on lighting change)
+    '''
+
+    def __init__(self, w, h, threshold=200, noise_level=None, skip=3,
+                 engine='decode', zones=None, exclude=(),
+                 model='background', learning=5, lighting=0.8):
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown motion engine: {engine}')
+
+        if model not in MODELS:
+            raise ValueError(f'Unknown motion model: {model}')
+
+        if noise_level is None:
+            noise_level = 12 if model == 'background' else 28
+
+        if not zones:
+            zones = {'frame': {'area': [0, 0, 1, 1]}}
+
+        if len(zones) > MAX_ZONES:
+            raise ValueError(f'Too many motion zones (max {MAX_ZONES})')
+
+        # (name, area, threshold)
+        self.zones = [
+            (name, rects(zone['area']), zone.get('threshold', threshold))
+            for name, zone in zones.items()
+        ]
+        self.exclude = rects(exclude) if exclude else []
+
+        self.md = Motion()
+        self.tjd = TJDecompress() if engine == 'decode' else None
+
+        self.engine = engine
+        self.model = model
+        self.skip = skip
+        self.counter = 0
+        self.idle = 0
+        self.primed = False
+        self.noise_level = noise_level
+        self.learning = learning
+        self.lighting = lighting
+
+        self.w = w
+        self.h = h
+
+        # map size, allocated on first frame for 'dc' engine
+        self.mw = 0
+        self.mh = 0
+        self.size = 0
+        self.addr0 = None
+        self.addr1 = None
+        self.addr = None
+
+        if engine == 'decode':
+            self.__alloc(w, h)
+
+        self.motion = 0
+        self.intensity = 0.0
+
+        self.decode_time = perf.metrics.histogram(
+            'doorcam_motion_decode_seconds'
+        )
+        self.interval = perf.metrics.gauge('doorcam_motion_skip_frames')
+        self.lighting_changes = perf.metrics.counter(
+            'doorcam_motion_lighting_changes_total'
+        )
+        self.broken = perf.metrics.counter(
+            'doorcam_motion_broken_frames_total'
+        )
+        self.changed = [
+            perf.metrics.histogram(
+                f'doorcam_motion_changed_pixels{{zone="{name}"}}',
+                (10, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+            ) for name, _, _ in self.zones
+        ]
+
+    def __alloc(self, mw, mh):
+        self.mw = mw
+        self.mh = mh
+
+        # 16 bytes aligned size, padding stays zero
+        self.size = (mw * mh + 15) & ~15
+
+        self.frame0 = mmap.mmap(
+            -1, self.size,
+            mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS,
+            mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.frame1 = mmap.mmap(
+            -1, self.size,
+            mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS,
+            mmap.PROT_READ | mmap.PROT_WRITE
+        )
+
+        self.addr0 = ct.addressof(ct.c_char.from_buffer(self.frame0))
+        self.addr1 = ct.addressof(ct.c_char.from_buffer(self.frame1))
+        self.addr = self.addr0
+
+        # background mean and noise estimate, 8.7 fixed point
+        self.mean = (ct.c_short * self.size)()
+        self.dev = (ct.c_short * self.size)()
+        self.primed = False
+
+        # tiles: 16x8 blocks of dc map, 48x24 pixels of 720x405 image
+        self.tile_w = 16 * max(1, mw // 240)
+        self.tile_h = 8 * max(1, mh // 135)
+        tiles_x = (mw + self.tile_w - 1) // self.tile_w
+        tiles_y = (mh + self.tile_h - 1) // self.tile_h
+        self.counts = (ct.c_ulong * (tiles_x * tiles_y))()
+
+        # zone tiles: tile center inside zone area
+        self.tiles = list()
+        for _, area, _ in self.zones:
+            self.tiles.append([
+                ty * tiles_x + tx
+                for ty in range(tiles_y)
+                for tx in range(tiles_x)
+                if inside(
+                    (tx * self.tile_w + min(self.tile_w,
+                                            mw - tx * self.tile_w) / 2) / mw,
+                    (ty * self.tile_h + min(self.tile_h,
+                                            mh - ty * self.tile_h) / 2) / mh,
+                    area
+                )
+            ])
+
+        # mask: tiles of all zones without excluded areas
+        used = set(t for tiles in self.tiles for t in tiles)
+        self.mask = (ct.c_ubyte * self.size)()
+        for y in range(mh):
+            ty = y // self.tile_h
+            row = bytearray(mw)
+
+            for tx in range(tiles_x):
+                if ty * tiles_x + tx in used:
+                    x0 = tx * self.tile_w
+                    x1 = min(x0 + self.tile_w, mw)
+                    row[x0:x1] = b'\xff' * (x1 - x0)
+
+            for x0, y0, x1, y1 in self.exclude:
+                if y0 <= (y + 0.5) / mh < y1:
+                    x0 = round(x0 * mw)
+                    x1 = round(x1 * mw)
+                    row[x0:x1] = bytes(x1 - x0)
+
+            ct.memmove(ct.addressof(self.mask) + y * mw, bytes(row), mw)
+
+        self.masked = bytes(self.mask).count(0xFF)
+
+        # same fraction of the frame area
+        self.limits = [
+            t * mw * mh / (self.w * self.h) for _, _, t in self.zones
+        ]
+
+    def __fallback(self):
+        # progressive or arithmetic coded jpeg
+        logging.warning('jpeg DC decoding is not supported, '
+                        'switching to decode motion engine')
+        self.engine = 'decode'
+        self.tjd = TJDecompress()
+        self.__alloc(self.w, self.h)
+
+    def __decode(self, addr, size):
+        ''' returns False if frame can't be decoded '''
+        try:
+            if self.engine == 'decode':
+                self.tjd.decompress(
+                    addr, size,
+                    self.addr,
+                    self.w, self.h,
+                    self.tjd.TJPF_GRAY
+                )
+                return True
+
+            if self.size == 0:
+                self.__alloc(*self.md.jpeg_dc_luma(addr, size))
+            self.md.jpeg_dc_luma(addr, size, self.addr, self.mw, self.mh)
+        except NotImplementedError:
+            self.__fallback()
+            return False
+        except IOError:
+            # corrupt frame, the next one is likely fine
+            self.broken.inc()
+            return False
+
+        return True
+
+    def process(self, addr, size, w, h):
+        if self.counter > 0:
+            self.counter -= 1
+            return self.motion
+
+        if self.model == 'frames':
+            if self.addr == self.addr0:
+                self.addr = self.addr1
+            else:
+                self.addr = self.addr0
+
+        t = time.monotonic()
+        if not self.__decode(addr, size):
+            return self.motion
+        self.decode_time.observe(time.monotonic() - t)
+
+        if not self.primed:
+            self.primed = True
+            if self.model == 'background':
+                self.md.background_reset(self.addr, self.mean, self.size)
+            return 0
+
+        # sse4.2
+        if self.model == 'background':
+            total = self.md.background_update(
+                self.addr,
+                self.mean,
+                self.dev,
+                self.mask,
+                self.mw, self.mh,
+                self.tile_w, self.tile_h,
+                self.noise_level,
+                self.learning,
+                self.counts
+            )
+        else:
+            total = self.md.count_different_tiles(
+                self.addr0,
+                self.addr1,
+                self.mask,
+                self.mw, self.mh,
+                self.tile_w, self.tile_h,
+                self.noise_level,
+                self.counts
+            )
+
+        self.motion = 0
+        self.intensity = 0.0
+
+        if total > self.lighting * self.masked:
+            # lighting change or auto exposure step
+            self.lighting_changes.inc()
+            if self.model == 'background':
+                self.md.background_reset(self.addr, self.mean, self.size)
+        else:
+            self.intensity = total / max(self.masked, 1)
+            counts = self.counts[:]
+            for i, tiles in enumerate(self.tiles):
+                cnt = sum(counts[t] for t in tiles)
+                self.changed[i].observe(cnt)
+                if cnt > self.limits[i]:
+                    self.motion |= 1 << i
+
+        # adaptive sampling: every frame while motion is active,
+        # exponential back off to every (skip + 1) frame when idle
+        if self.motion:
+            self.idle = 0
+        else:
+            self.idle = min(self.idle * 2 + 1, self.skip)
+        self.counter = self.idle
+        self.interval.set(self.idle)
+
+        return self.motion
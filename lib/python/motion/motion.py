@@ -9,11 +9,21 @@ ROOT = os.path.normpath(os.path.join(
 
 
 class Motion:
+    # kernel instruction sets, picked at load time
+    ISAS = ('scalar', 'sse4.2', 'avx2', 'avx512bw')
 
     def __init__(self):
         libpath = os.path.join(ROOT, 'lib', 'libmotion.so')
         libmotion = ct.cdll.LoadLibrary(libpath)
 
+        self.__isa = libmotion.motion_isa
+        self.__isa.argtypes = []
+        self.__isa.restype = ct.c_char_p
+
+        self.__set_isa = libmotion.motion_set_isa
+        self.__set_isa.argtypes = [ct.c_char_p]
+        self.__set_isa.restype = ct.c_int
+
         self.__cdb = libmotion.count_different_bytes
         self.__cdb.argtypes = [
             ct.POINTER(ct.c_ubyte), ct.POINTER(ct.c_ubyte),
@@ -21,6 +31,52 @@ class Motion:
         ]
         self.__cdb.restype = ct.c_long
 
+        self.__cdt = libmotion.count_different_tiles
+        self.__cdt.argtypes = [
+            ct.POINTER(ct.c_ubyte), ct.POINTER(ct.c_ubyte),
+            ct.POINTER(ct.c_ubyte), ct.c_ulong, ct.c_ulong,
+            ct.c_ulong, ct.c_ulong, ct.c_ubyte, ct.POINTER(ct.c_ulong)
+        ]
+        self.__cdt.restype = ct.c_long
+
+        self.__bgu = libmotion.background_update
+        self.__bgu.argtypes = [
+            ct.POINTER(ct.c_ubyte), ct.POINTER(ct.c_short),
+            ct.POINTER(ct.c_short), ct.POINTER(ct.c_ubyte),
+            ct.c_ulong, ct.c_ulong, ct.c_ulong, ct.c_ulong,
+            ct.c_ubyte, ct.c_ubyte, ct.POINTER(ct.c_ulong)
+        ]
+        self.__bgu.restype = ct.c_long
+
+        self.__bgr = libmotion.background_reset
+        self.__bgr.argtypes = [
+            ct.POINTER(ct.c_ubyte), ct.POINTER(ct.c_short), ct.c_ulong
+        ]
+        self.__bgr.restype = None
+
+        self.__dc = libmotion.jpeg_dc_luma
+        self.__dc.argtypes = [
+            ct.POINTER(ct.c_ubyte), ct.c_ulong,
+            ct.POINTER(ct.c_ubyte), ct.c_uint, ct.c_uint,
+            ct.POINTER(ct.c_uint), ct.POINTER(ct.c_uint)
+        ]
+        self.__dc.restype = ct.c_int
+
+        self.__sharpness = libmotion.sharpness
+        self.__sharpness.argtypes = [
+            ct.POINTER(ct.c_ubyte), ct.c_ulong, ct.c_ulong
+        ]
+        self.__sharpness.restype = ct.c_double
+
+    @property
+    def isa(self):
+        return self.__isa().decode()
+
+    @isa.setter
+    def isa(self, name):
+        if self.__set_isa(name.encode()) == -1:
+            raise ValueError(f'Instruction set not supported: {name}')
+
     def count_different_bytes(self, a1, a2, size, threshold):
         res = self.__cdb(
             ct.cast(a1, ct.POINTER(ct.c_ubyte)),
@@ -30,6 +86,97 @@ class Motion:
         )
 
         if res == -1:
-            Exception('a1/a2 or size not alligned to 16 bytes')
+            raise Exception('a1/a2 is NULL')
+
+        return res
+
+    def count_different_tiles(self, a1, a2, mask, width, height,
+                              tile_w, tile_h, threshold, counts):
+        res = self.__cdt(
+            ct.cast(a1, ct.POINTER(ct.c_ubyte)),
+            ct.cast(a2, ct.POINTER(ct.c_ubyte)),
+            ct.cast(mask, ct.POINTER(ct.c_ubyte)),
+            width,
+            height,
+            tile_w,
+            tile_h,
+            threshold,
+            ct.cast(counts, ct.POINTER(ct.c_ulong))
+        )
+
+        if res == -1:
+            raise Exception('tile width not multiple of 16 bytes')
+
+        return res
+
+    def background_update(self, frame, mean, dev, mask, width, height,
+                          tile_w, tile_h, noise_level, shift, counts):
+        res = self.__bgu(
+            ct.cast(frame, ct.POINTER(ct.c_ubyte)),
+            ct.cast(mean, ct.POINTER(ct.c_short)),
+            ct.cast(dev, ct.POINTER(ct.c_short)),
+            ct.cast(mask, ct.POINTER(ct.c_ubyte)),
+            width,
+            height,
+            tile_w,
+            tile_h,
+            noise_level,
+            shift,
+            ct.cast(counts, ct.POINTER(ct.c_ulong))
+        )
+
+        if res == -1:
+            raise Exception('tile width not multiple of 16 bytes '
+                            'or shift too big')
+
+        return res
+
+    def background_reset(self, frame, mean, size):
+        self.__bgr(
+            ct.cast(frame, ct.POINTER(ct.c_ubyte)),
+            ct.cast(mean, ct.POINTER(ct.c_short)),
+            size
+        )
+
+    def jpeg_dc_luma(self, src, size, dst=None, width=0, height=0):
+        '''
+        Decode luma DC coefficients (8x8 block means) of baseline jpeg
+        to width x height map at dst, returns luma map size in blocks.
+        Only image size is parsed if dst is None.
+
+        Raises IOError for a broken jpeg, NotImplementedError for
+        progressive, lossless, arithmetic coded or 12-bit jpeg.
+        '''
+        bw = ct.c_uint()
+        bh = ct.c_uint()
+
+        res = self.__dc(
+            ct.cast(src, ct.POINTER(ct.c_ubyte)),
+            size,
+            ct.cast(dst, ct.POINTER(ct.c_ubyte)),
+            width,
+            height,
+            ct.byref(bw),
+            ct.byref(bh)
+        )
+
+        if res == -2:
+            raise NotImplementedError('Unsupported jpeg coding')
+
+        if res != 0:
+            raise IOError('Broken jpeg')
+
+        return bw.value, bh.value
+
+    def sharpness(self, img, width, height):
+        ''' focus measure of width x height grayscale image '''
+        res = self.__sharpness(
+            ct.cast(img, ct.POINTER(ct.c_ubyte)),
+            width,
+            height
+        )
+
+        if res < 0:
+            raise ValueError('image too small')
 
         return res
@@ -0,0 +1,63 @@
+import threading
+
+
+class MotionPipeline():
+    '''
+    Run MotionDetection in a thread in parallel with frame delivery
+
+    submit() hands a frame over to the motion thread, the frame buffer
+    must stay valid until wait() returns. motion and intensity are the
+    results of the last analyzed frame: frames are delivered with one
+    frame motion lag.
+    Kernels and jpeg decoding release the GIL, so the analysis runs on
+    another core.
+    '''
+
+    def __init__(self, md):
+        self.md = md
+        self.motion = 0
+        self.intensity = 0.0
+
+        self.__frame = None
+        self.__error = None
+        self.__pending = False
+        self.__ready = threading.Semaphore(0)
+        self.__done = threading.Semaphore(0)
+
+        self.__thread = threading.Thread(
+            target=self.__run,
+            name='motion',
+            daemon=True
+        )
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            self.__ready.acquire()
+
+            try:
+                self.motion = self.md.process(*self.__frame)
+                self.intensity = self.md.intensity
+            except Exception as e:
+                self.__error = e
+
+            self.__frame = None
+            self.__done.release()
+
+    def submit(self, addr, size, w, h):
+        self.wait()
+        self.__frame = (addr, size, w, h)
+        self.__pending = True
+        self.__ready.release()
+
+    def wait(self):
+        ''' wait for the frame in flight, returns motion '''
+        if self.__pending:
+            self.__done.acquire()
+            self.__pending = False
+
+            if self.__error is not None:
+                e, self.__error = self.__error, None
+                raise e
+
+        return self.motion
@@ -0,0 +1,170 @@
+import time
+
+
+# SOI + APP1 with DateTimeOriginal
+EXIF = bytes.fromhex(
+    'FF D8'                                # SOI marker
+    'FF E1'                                # APP1 marker
+    '00 48'                                # APP1 size
+    '45 78 69 66 00 00'                    # Exif header
+    '4D 4D 00 2A 00 00 00 08'              # TIFF header
+    '00 01'                                # IFD0 (1 element)
+    '87 69 00 04 00 00 00 01 00 00 00 1A'  # ExifOffset
+    '00 00 00 00'                          # End of Link
+    '00 01'                                # Exif SubIFD (1 element)
+    '90 03 00 02 00 00 00 14 00 00 00 2C'  # DateTimeOriginal
+    '00 00 00 00'
+    '00 00 00 00 00 00 00 00 00 00'        # DateTimeOriginal value
+    '00 00 00 00 00 00 00 00 00 00'
+)
+
+# SOI + APP1 with DateTimeOriginal and SubSecTimeOriginal
+EXIF_SUBSEC = bytes.fromhex(
+    'FF D8'                                # SOI marker
+    'FF E1'                                # APP1 marker
+    '00 54'                                # APP1 size
+    '45 78 69 66 00 00'                    # Exif header
+    '4D 4D 00 2A 00 00 00 08'              # TIFF header
+    '00 01'                                # IFD0 (1 element)
+    '87 69 00 04 00 00 00 01 00 00 00 1A'  # ExifOffset
+    '00 00 00 00'                          # End of Link
+    '00 02'                                # Exif SubIFD (2 elements)
+    '90 03 00 02 00 00 00 14 00 00 00 38'  # DateTimeOriginal
+    '92 91 00 02 00 00 00 04 00 00 00 00'  # SubSecTimeOriginal
+    '00 00 00 00'
+    '00 00 00 00 00 00 00 00 00 00'        # DateTimeOriginal value
+    '00 00 00 00 00 00 00 00 00 00'
+)
+
+# DateTimeOriginal and SubSecTimeOriginal value offsets
+DATETIME = {EXIF: 56, EXIF_SUBSEC: 68}
+SUBSEC = 60
+
+
+class Frame():
+    '''
+    mpjpeg part in a pooled buffer
+
+    The buffer returns to the pool with the last reference to the
+    frame, views of data must not outlive the frame.
+    '''
+
+    __slots__ = ('ts', 'size', 'buf', 'pool')
+
+    def __init__(self, pool, buf, size, ts):
+        self.pool = pool
+        self.buf = buf
+        self.size = size
+        self.ts = ts
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def data(self):
+        return memoryview(self.buf)[:self.size]
+
+    def __del__(self):
+        self.pool.put(self.buf)
+
+
+class FramePool():
+    '''
+    Frame buffers for reuse, up to limit free buffers are kept
+
+    Buffers are allocated with 25% headroom, so frames of a stream
+    fit into buffers of the previous ones.
+    '''
+
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.free = list()
+
+    def get(self, size):
+        try:
+            buf = self.free.pop()
+        except IndexError:
+            buf = None
+
+        if buf is None or len(buf) < size:
+            buf = bytearray(size + size // 4)
+
+        return buf
+
+    def put(self, buf):
+        if len(self.free) < self.limit:
+            self.free.append(buf)
+
+
+class MPJpgFramer():
+    '''
+    mpjpeg parts of jpeg frames with EXIF capture time
+
+    SOI of the jpeg is replaced with SOI + APP1 (Exif) with
+    DateTimeOriginal and, if subsec, SubSecTimeOriginal, which
+    ffmpeg exports as frame metadata. The jpeg must have no APP1.
+    Headers are preallocated and patched in place.
+
+    iov(ts, jpeg)  - buffers for os.writev, nothing is copied,
+                     valid until the next call
+    copy(ts, jpeg) - Frame in a pooled buffer, the only copy of
+                     jpeg data, jpeg may be released afterwards
+    '''
+
+    def __init__(self, boundary, subsec=False, pool=None):
+        prefix = (
+            f'--{boundary}\r\n'
+            'Content-Type: image/jpeg\r\n'
+            'Content-Length: '
+        ).encode()
+
+        # room for Content-Length value and the empty line
+        self.prefix = len(prefix)
+        self.header = bytearray(prefix + bytes(16))
+
+        template = EXIF_SUBSEC if subsec else EXIF
+        self.exif = bytearray(template)
+        self.datetime = DATETIME[template]
+        self.subsec = subsec
+        self.second = None
+
+        self.pool = FramePool() if pool is None else pool
+
+    def __format(self, ts, size):
+        ''' patch headers for jpeg of size, returns header length '''
+        second = int(ts)
+
+        # DateTimeOriginal changes once a second
+        if second != self.second:
+            t = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+            self.exif[self.datetime:self.datetime + 19] = t.encode()
+            self.second = second
+
+        if self.subsec:
+            ms = min(int((ts - second) * 1000), 999)
+            self.exif[SUBSEC:SUBSEC + 3] = b'%03d' % ms
+
+        tail = b'%d\r\n\r\n' % (len(self.exif) + size - 2)
+        n = self.prefix + len(tail)
+        self.header[self.prefix:n] = tail
+
+        return n
+
+    def iov(self, ts, jpeg):
+        n = self.__format(ts, len(jpeg))
+        return [memoryview(self.header)[:n], self.exif, jpeg[2:]]
+
+    def copy(self, ts, jpeg):
+        n = self.__format(ts, len(jpeg))
+        e = n + len(self.exif)
+        size = e + len(jpeg) - 2
+
+        # bytearray slice assignment copies other buffers twice
+        buf = self.pool.get(size)
+        mv = memoryview(buf)
+        mv[:n] = memoryview(self.header)[:n]
+        mv[n:e] = self.exif
+        mv[e:size] = jpeg[2:]
+        mv.release()
+
+        return Frame(self.pool, buf, size, ts)
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+__version__ = '0.0.0'
+
+from .samples import Samples
+from .metrics import Metrics, NullMetrics, LATENCY
+from .httpd import serve
+
+# process-wide metrics, replaced by doorcam before plugins are forked
+metrics = NullMetrics()
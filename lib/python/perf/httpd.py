@@ -0,0 +1,24 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+def serve(metrics, address='127.0.0.1', port=9100):
+    ''' serve metrics in prometheus text format, never returns '''
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+
+            body = metrics.text().encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    HTTPServer((address, port), Handler).serve_forever()
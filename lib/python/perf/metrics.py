@@ -0,0 +1,196 @@
+import multiprocessing
+import struct
+import mmap
+
+
+COUNTER = 0
+GAUGE = 1
+HISTOGRAM = 2
+
+TYPES = ('counter', 'gauge', 'histogram')
+
+# max number of histogram buckets
+BUCKETS = 16
+
+# metric header: name (with labels), type, number of buckets
+HEADER = struct.Struct('@96sBB6x')
+BOUNDS = struct.Struct(f'@{BUCKETS}d')
+COUNTS = struct.Struct(f'@{BUCKETS}Q')
+VALUE = struct.Struct('@d')
+COUNT = struct.Struct('@Q')
+
+STRIDE = HEADER.size + BOUNDS.size + COUNTS.size + VALUE.size + COUNT.size
+
+# default histogram buckets: seconds
+LATENCY = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Counter():
+    def __init__(self, mm, offset):
+        self.mm = mm
+        self.offset = offset + HEADER.size + BOUNDS.size + COUNTS.size
+
+    def inc(self, n=1):
+        v, = VALUE.unpack_from(self.mm, self.offset)
+        VALUE.pack_into(self.mm, self.offset, v + n)
+
+    def set(self, v):
+        VALUE.pack_into(self.mm, self.offset, v)
+
+
+class Gauge(Counter):
+    pass
+
+
+class Histogram():
+    def __init__(self, mm, offset, buckets):
+        self.mm = mm
+        self.buckets = buckets
+        self.counts = offset + HEADER.size + BOUNDS.size
+        self.sum = self.counts + COUNTS.size
+        self.count = self.sum + VALUE.size
+
+    def observe(self, v):
+        for i, le in enumerate(self.buckets):
+            if v <= le:
+                o = self.counts + COUNT.size * i
+                n, = COUNT.unpack_from(self.mm, o)
+                COUNT.pack_into(self.mm, o, n + 1)
+                break
+
+        s, = VALUE.unpack_from(self.mm, self.sum)
+        VALUE.pack_into(self.mm, self.sum, s + v)
+        n, = COUNT.unpack_from(self.mm, self.count)
+        COUNT.pack_into(self.mm, self.count, n + 1)
+
+
+class Null():
+    def inc(self, n=1):
+        pass
+
+    def set(self, v):
+        pass
+
+    def observe(self, v):
+        pass
+
+
+class NullMetrics():
+    ''' metrics are disabled '''
+
+    def counter(self, name):
+        return Null()
+
+    def gauge(self, name):
+        return Null()
+
+    def histogram(self, name, buckets=LATENCY):
+        return Null()
+
+
+class Metrics():
+    '''
+    Shared memory counters, gauges and histograms
+
+    Created before fork, metrics are registered by name (labels are
+    part of the name: 'doorcam_plugin_restarts_total{plugin="rec"}')
+    from any process. Every metric must be updated by one process only.
+    '''
+
+    def __init__(self, size=256):
+        self.size = size
+        self.mm = mmap.mmap(
+            -1, STRIDE * size,
+            mmap.MAP_SHARED | mmap.MAP_ANONYMOUS,
+            mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.lock = multiprocessing.Lock()
+
+    def __register(self, name, kind, buckets=()):
+        key = name.encode('utf-8')
+        if len(key) > HEADER.size - 8:
+            raise ValueError(f'metric name too long: {name}')
+        if len(buckets) > BUCKETS:
+            raise ValueError(f'too many buckets: {name}')
+
+        with self.lock:
+            for i in range(self.size):
+                offset = STRIDE * i
+                n, k, _ = HEADER.unpack_from(self.mm, offset)
+                n = n.rstrip(b'\0')
+
+                if n == key:
+                    if k != kind:
+                        raise ValueError(f'metric type mismatch: {name}')
+                    return offset
+
+                if n == b'':
+                    HEADER.pack_into(self.mm, offset, key, kind, len(buckets))
+                    bounds = tuple(buckets) + (0.0,) * (BUCKETS - len(buckets))
+                    BOUNDS.pack_into(self.mm, offset + HEADER.size, *bounds)
+                    return offset
+
+        raise Exception('Too many metrics')
+
+    def counter(self, name):
+        return Counter(self.mm, self.__register(name, COUNTER))
+
+    def gauge(self, name):
+        return Gauge(self.mm, self.__register(name, GAUGE))
+
+    def histogram(self, name, buckets=LATENCY):
+        buckets = tuple(sorted(buckets))
+        return Histogram(self.mm, self.__register(name, HISTOGRAM, buckets),
+                         buckets)
+
+    def text(self):
+        ''' prometheus text exposition format '''
+        lines = list()
+        types = set()
+        metrics = list()
+
+        for i in range(self.size):
+            offset = STRIDE * i
+            name, kind, nb = HEADER.unpack_from(self.mm, offset)
+            name = name.rstrip(b'\0').decode('utf-8')
+            if name == '':
+                break
+            metrics.append((name.partition('{')[0], name, kind, nb, offset))
+
+        # samples of one metric family must be grouped together
+        metrics.sort(key=lambda m: m[0])
+
+        for base, name, kind, nb, offset in metrics:
+            labels = name.partition('{')[2].rstrip('}')
+
+            if base not in types:
+                types.add(base)
+                lines.append(f'# TYPE {base} {TYPES[kind]}')
+
+            o = offset + HEADER.size + BOUNDS.size + COUNTS.size
+            value, = VALUE.unpack_from(self.mm, o)
+
+            if kind != HISTOGRAM:
+                lines.append(f'{name} {value:.15g}')
+                continue
+
+            bounds = BOUNDS.unpack_from(self.mm, offset + HEADER.size)[:nb]
+            counts = COUNTS.unpack_from(
+                self.mm, offset + HEADER.size + BOUNDS.size
+            )[:nb]
+            count, = COUNT.unpack_from(self.mm, o + VALUE.size)
+            sep = ',' if labels else ''
+
+            total = 0
+            for le, n in zip(bounds, counts):
+                total += n
+                lines.append(f'{base}_bucket{{{labels}{sep}le="{le:g}"}} '
+                             f'{total}')
+            lines.append(f'{base}_bucket{{{labels}{sep}le="+Inf"}} {count}')
+
+            labels = f'{{{labels}}}' if labels else ''
+            lines.append(f'{base}_sum{labels} {value:.15g}')
+            lines.append(f'{base}_count{labels} {count}')
+
+        return '\n'.join(lines) + '\n'
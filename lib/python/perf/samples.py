@@ -0,0 +1,106 @@
+import multiprocessing
+import struct
+import mmap
+
+
+# series header: name, number of recorded samples
+SERIES = struct.Struct('@48sQ')
+SAMPLE = struct.Struct('@d')
+
+
+class Samples():
+    '''
+    Shared memory latency samples
+
+    Created before fork, written by the capture process and plugins.
+    Every series keeps the last `capacity` samples, each series must
+    be written by one process only.
+    '''
+
+    def __init__(self, series=64, capacity=1 << 16):
+        self.series = series
+        self.capacity = capacity
+        self.stride = SERIES.size + SAMPLE.size * capacity
+
+        self.mm = mmap.mmap(
+            -1, self.stride * series,
+            mmap.MAP_SHARED | mmap.MAP_ANONYMOUS,
+            mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.lock = multiprocessing.Lock()
+        self.index = dict()
+
+    @staticmethod
+    def __key(name):
+        ''' series name as stored, never truncated '''
+        key = name.encode('utf-8')
+        if len(key) > SERIES.size - 8:
+            raise ValueError(f'sample series name is too long: {name}')
+        return key
+
+    def __lookup(self, name):
+        key = self.__key(name)
+
+        with self.lock:
+            for i in range(self.series):
+                n, _ = SERIES.unpack_from(self.mm, self.stride * i)
+                n = n.rstrip(b'\0')
+                if n == key:
+                    return i
+                if n == b'':
+                    SERIES.pack_into(self.mm, self.stride * i, key, 0)
+                    return i
+
+        raise Exception('Too many sample series')
+
+    def record(self, name, value):
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = self.__lookup(name)
+
+        offset = self.stride * i
+        key, count = SERIES.unpack_from(self.mm, offset)
+        SAMPLE.pack_into(self.mm,
+                         offset + SERIES.size
+                         + SAMPLE.size * (count % self.capacity),
+                         value)
+        SERIES.pack_into(self.mm, offset, key, count + 1)
+
+    def values(self, name):
+        key = self.__key(name)
+        for i in range(self.series):
+            n, count = SERIES.unpack_from(self.mm, self.stride * i)
+            if n.rstrip(b'\0') != key:
+                continue
+            n = min(count, self.capacity)
+            offset = self.stride * i + SERIES.size
+            return list(struct.unpack_from(f'@{n}d', self.mm, offset))
+        return []
+
+    def names(self):
+        names = list()
+        for i in range(self.series):
+            n, _ = SERIES.unpack_from(self.mm, self.stride * i)
+            n = n.rstrip(b'\0')
+            if n == b'':
+                break
+            names.append(n.decode('utf-8'))
+        return names
+
+    def summary(self):
+        ''' {series: {count, mean, p50, p99, max}} in seconds '''
+        result = dict()
+
+        for name in self.names():
+            v = sorted(self.values(name))
+            if len(v) == 0:
+                continue
+            result[name] = {
+                'count': len(v),
+                'mean': sum(v) / len(v),
+                'p50': v[int(0.50 * (len(v) - 1))],
+                'p99': v[int(0.99 * (len(v) - 1))],
+                'max': v[-1],
+            }
+
+        return result
@@ -4,3 +4,4 @@ __version__ = '0.0.0'
 
 from .compress import TJCompress
 from .decompress import TJDecompress
+from .transform import TJTransform
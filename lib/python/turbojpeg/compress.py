@@ -27,6 +27,12 @@ class TJCompress():
     # pixel size [pixel format]
     PIXEL_SIZE = (3, 3, 4, 4, 4, 4, 1, 4, 4, 4, 4)
 
+    # flags
+    TJFLAG_BOTTOMUP = 2
+    TJFLAG_NOREALLOC = 1024
+    TJFLAG_FASTDCT = 2048
+    TJFLAG_ACCURATEDCT = 4096
+
     def __init__(self):
         lib = ct.cdll.LoadLibrary(find_library('turbojpeg'))
 
@@ -45,35 +51,65 @@ class TJCompress():
         ]
         self.__compress.restype = ct.c_int
 
-        self.__free = lib.tjFree
-        self.__free.argtypes = [ct.c_void_p]
-        self.__free.restype = None
+        self.__buf_size = lib.tjBufSize
+        self.__buf_size.argtypes = [ct.c_int, ct.c_int, ct.c_int]
+        self.__buf_size.restype = ct.c_ulong
 
         self.handle = self.__init_compress()
 
+        # output buffer of compress() without dst, grows as needed
+        self.buf = None
+
     def __del__(self):
         self.__destroy(self.handle)
 
+    def buffer_size(self, w, h, jpeg_subsample=TJSAMP_422):
+        ''' the worst case jpeg size of w x h image '''
+        size = self.__buf_size(w, h, jpeg_subsample)
+
+        if size == ct.c_ulong(-1).value:
+            raise ValueError('Invalid image size')
+
+        return size
+
     def compress(self, src, src_size, w, h,
                  quality=85, pixel_format=TJPF_BGR,
-                 jpeg_subsample=TJSAMP_422, flags=0):
+                 jpeg_subsample=TJSAMP_422, flags=0, dst=None):
+        '''
+        returns jpeg bytes
+
+        dst - writable buffer of at least buffer_size() bytes to
+              compress into, returns memoryview of the jpeg in dst then
+        '''
         src_addr = ct.cast(src, ct.POINTER(ct.c_ubyte))
 
-        jpeg_buf = ct.c_void_p()
-        jpeg_size = ct.c_ulong()
+        size = self.buffer_size(w, h, jpeg_subsample)
+        if dst is None:
+            if self.buf is None or len(self.buf) < size:
+                self.buf = (ct.c_ubyte * size)()
+            buf = self.buf
+        else:
+            buf = (ct.c_ubyte * len(dst)).from_buffer(dst)
+            if len(buf) < size:
+                raise ValueError(f'dst is smaller than {size} bytes')
+
+        # libturbojpeg assumes buffer_size() bytes with NOREALLOC
+        jpeg_buf = ct.c_void_p(ct.addressof(buf))
+        jpeg_size = ct.c_ulong(len(buf))
 
         status = self.__compress(
             self.handle,
-            src_addr, w, PIXEL_SIZE[pixel_format] * w, h, pixel_format,
+            src_addr, w, self.PIXEL_SIZE[pixel_format] * w, h, pixel_format,
             ct.byref(jpeg_buf), ct.byref(jpeg_size),
-            jpeg_subsample, quality, flags
+            jpeg_subsample, quality, flags | self.TJFLAG_NOREALLOC
         )
 
         if status != 0:
             raise IOError('Failed to compress')
 
-        dst = ct.string_at(jpeg_buf.value, jpeg_size.value)
+        jpeg = memoryview(buf).cast('B')[:jpeg_size.value]
 
-        self.__free(jpeg_buf)
+        if dst is None:
+            return jpeg.tobytes()
 
-        return dst
+        return jpeg
@@ -3,6 +3,13 @@ import ctypes as ct
 import os
 
 
+class TJScalingFactor(ct.Structure):
+    _fields_ = [
+        ('num', ct.c_int),
+        ('denom', ct.c_int),
+    ]
+
+
 class TJDecompress():
     # pixel formats
     TJPF_RGB = 0
@@ -27,6 +34,12 @@ class TJDecompress():
     # pixel size [pixel format]
     PIXEL_SIZE = (3, 3, 4, 4, 4, 4, 1, 4, 4, 4, 4)
 
+    # flags
+    TJFLAG_BOTTOMUP = 2
+    TJFLAG_FASTUPSAMPLE = 256
+    TJFLAG_FASTDCT = 2048
+    TJFLAG_ACCURATEDCT = 4096
+
     def __init__(self):
         turbo_jpeg = ct.cdll.LoadLibrary(find_library('turbojpeg'))
 
@@ -45,6 +58,41 @@ class TJDecompress():
         ]
         self.__decompress.restype = ct.c_int
 
+        self.__header = turbo_jpeg.tjDecompressHeader3
+        self.__header.argtypes = [
+            ct.c_void_p, ct.POINTER(ct.c_ubyte), ct.c_ulong,
+            ct.POINTER(ct.c_int), ct.POINTER(ct.c_int),
+            ct.POINTER(ct.c_int), ct.POINTER(ct.c_int)
+        ]
+        self.__header.restype = ct.c_int
+
+        self.__decompress_yuv = turbo_jpeg.tjDecompressToYUVPlanes
+        self.__decompress_yuv.argtypes = [
+            ct.c_void_p, ct.POINTER(ct.c_ubyte), ct.c_ulong,
+            ct.POINTER(ct.POINTER(ct.c_ubyte)), ct.c_int,
+            ct.POINTER(ct.c_int), ct.c_int, ct.c_int
+        ]
+        self.__decompress_yuv.restype = ct.c_int
+
+        self.__plane_width = turbo_jpeg.tjPlaneWidth
+        self.__plane_width.argtypes = [ct.c_int, ct.c_int, ct.c_int]
+        self.__plane_width.restype = ct.c_int
+
+        self.__plane_height = turbo_jpeg.tjPlaneHeight
+        self.__plane_height.argtypes = [ct.c_int, ct.c_int, ct.c_int]
+        self.__plane_height.restype = ct.c_int
+
+        # supported scaling factors, (num, denom) tuples
+        get_scaling_factors = turbo_jpeg.tjGetScalingFactors
+        get_scaling_factors.argtypes = [ct.POINTER(ct.c_int)]
+        get_scaling_factors.restype = ct.POINTER(TJScalingFactor)
+
+        n = ct.c_int()
+        factors = get_scaling_factors(ct.byref(n))
+        self.scaling_factors = tuple(
+            (factors[i].num, factors[i].denom) for i in range(n.value)
+        )
+
         self.handle = self.__init_decompress()
 
     def __del__(self):
@@ -64,3 +112,81 @@ class TJDecompress():
 
         if status != 0:
             raise IOError('Failed to decompress')
+
+    def header(self, src, src_size):
+        ''' returns (width, height, subsampling, colorspace) '''
+        src_addr = ct.cast(src, ct.POINTER(ct.c_ubyte))
+        w, h, subsamp, colorspace = (ct.c_int(), ct.c_int(),
+                                     ct.c_int(), ct.c_int())
+
+        status = self.__header(
+            self.handle,
+            src_addr, src_size,
+            ct.byref(w), ct.byref(h),
+            ct.byref(subsamp), ct.byref(colorspace)
+        )
+
+        if status != 0:
+            raise IOError('Failed to read header')
+
+        return w.value, h.value, subsamp.value, colorspace.value
+
+    @staticmethod
+    def scaled(dimension, factor):
+        ''' dimension scaled by (num, denom) factor, rounded up '''
+        num, denom = factor
+        return (dimension * num + denom - 1) // denom
+
+    def scaled_size(self, width, height, min_width, min_height):
+        '''
+        the smallest scaled size of width x height image covering
+        min_width x min_height, decompress() picks the same factor
+        when asked for it
+        '''
+        size = (width, height)
+
+        for factor in self.scaling_factors:
+            w = self.scaled(width, factor)
+            h = self.scaled(height, factor)
+            if w >= min_width and h >= min_height and w < size[0]:
+                size = (w, h)
+
+        return size
+
+    def plane_size(self, component, width, height, subsamp):
+        ''' (width, height) of the YUV plane of width x height image '''
+        w = self.__plane_width(component, width, subsamp)
+        h = self.__plane_height(component, height, subsamp)
+
+        if w < 0 or h < 0:
+            raise ValueError('Invalid plane')
+
+        return w, h
+
+    def decompress_to_yuv(self, src, src_size, planes,
+                          width, height, strides=None, flags=0):
+        '''
+        decode to Y, U and V planes without color conversion: the Y
+        plane is the grayscale image. width x height selects scaling
+        like in decompress(), plane_size() gives the plane sizes.
+
+        planes - Y, U, V buffers (Y only for grayscale jpeg)
+        strides - row sizes of the planes (default: plane widths)
+        '''
+        src_addr = ct.cast(src, ct.POINTER(ct.c_ubyte))
+
+        dst = (ct.POINTER(ct.c_ubyte) * 3)()
+        for i, plane in enumerate(planes):
+            dst[i] = ct.cast(plane, ct.POINTER(ct.c_ubyte))
+
+        if strides is not None:
+            strides = (ct.c_int * 3)(*strides)
+
+        status = self.__decompress_yuv(
+            self.handle,
+            src_addr, src_size, dst,
+            width, strides, height, flags
+        )
+
+        if status != 0:
+            raise IOError('Failed to decompress')
@@ -0,0 +1,179 @@
+from ctypes.util import find_library
+import ctypes as ct
+
+
+class TJRegion(ct.Structure):
+    _fields_ = [
+        ('x', ct.c_int),
+        ('y', ct.c_int),
+        ('w', ct.c_int),
+        ('h', ct.c_int),
+    ]
+
+
+class TJTransformOp(ct.Structure):
+    _fields_ = [
+        ('r', TJRegion),
+        ('op', ct.c_int),
+        ('options', ct.c_int),
+        ('data', ct.c_void_p),
+        ('customFilter', ct.c_void_p),
+    ]
+
+
+class TJTransform():
+    '''
+    Lossless jpeg transforms: crop, flip, rotate without decoding
+    '''
+
+    # transform operations
+    TJXOP_NONE = 0
+    TJXOP_HFLIP = 1
+    TJXOP_VFLIP = 2
+    TJXOP_TRANSPOSE = 3
+    TJXOP_TRANSVERSE = 4
+    TJXOP_ROT90 = 5
+    TJXOP_ROT180 = 6
+    TJXOP_ROT270 = 7
+
+    # transform options
+    TJXOPT_PERFECT = 1
+    TJXOPT_TRIM = 2
+    TJXOPT_CROP = 4
+    TJXOPT_GRAY = 8
+    TJXOPT_PROGRESSIVE = 32
+    TJXOPT_COPYNONE = 64
+
+    # chrominance subsampling options
+    TJSAMP_444 = 0
+    TJSAMP_422 = 1
+    TJSAMP_420 = 2
+    TJSAMP_GRAY = 3
+    TJSAMP_440 = 4
+
+    # MCU block size [subsampling]
+    MCU_WIDTH = (8, 16, 16, 8, 8)
+    MCU_HEIGHT = (8, 8, 16, 8, 16)
+
+    # flags
+    TJFLAG_NOREALLOC = 1024
+
+    def __init__(self):
+        lib = ct.cdll.LoadLibrary(find_library('turbojpeg'))
+
+        self.__init_transform = lib.tjInitTransform
+        self.__init_transform.restype = ct.c_void_p
+
+        self.__destroy = lib.tjDestroy
+        self.__destroy.argtypes = [ct.c_void_p]
+        self.__destroy.restype = ct.c_int
+
+        self.__transform = lib.tjTransform
+        self.__transform.argtypes = [
+            ct.c_void_p, ct.POINTER(ct.c_ubyte), ct.c_ulong, ct.c_int,
+            ct.POINTER(ct.c_void_p), ct.POINTER(ct.c_ulong),
+            ct.POINTER(TJTransformOp), ct.c_int
+        ]
+        self.__transform.restype = ct.c_int
+
+        self.__header = lib.tjDecompressHeader3
+        self.__header.argtypes = [
+            ct.c_void_p, ct.POINTER(ct.c_ubyte), ct.c_ulong,
+            ct.POINTER(ct.c_int), ct.POINTER(ct.c_int),
+            ct.POINTER(ct.c_int), ct.POINTER(ct.c_int)
+        ]
+        self.__header.restype = ct.c_int
+
+        self.__buf_size = lib.tjBufSize
+        self.__buf_size.argtypes = [ct.c_int, ct.c_int, ct.c_int]
+        self.__buf_size.restype = ct.c_ulong
+
+        self.handle = self.__init_transform()
+
+        # output buffer of transform() without dst, grows as needed
+        self.buf = None
+
+    def __del__(self):
+        self.__destroy(self.handle)
+
+    def crop_region(self, x, y, w, h, subsamp):
+        ''' crop region with x and y aligned down to the MCU block '''
+        ax = x - x % self.MCU_WIDTH[subsamp]
+        ay = y - y % self.MCU_HEIGHT[subsamp]
+
+        return ax, ay, w + x - ax, h + y - ay
+
+    def transform(self, src, src_size, op=TJXOP_NONE, crop=None,
+                  options=0, flags=0, dst=None):
+        '''
+        returns transformed jpeg bytes
+
+        crop - (x, y, w, h) of the transformed image, x and y must be
+               multiples of the MCU block size (see crop_region())
+        dst - writable buffer to transform into, returns memoryview
+              of the jpeg in dst then
+        '''
+        src_addr = ct.cast(src, ct.POINTER(ct.c_ubyte))
+
+        w, h, subsamp, colorspace = (ct.c_int(), ct.c_int(),
+                                     ct.c_int(), ct.c_int())
+        status = self.__header(
+            self.handle,
+            src_addr, src_size,
+            ct.byref(w), ct.byref(h),
+            ct.byref(subsamp), ct.byref(colorspace)
+        )
+
+        if status != 0:
+            raise IOError('Failed to read header')
+
+        xform = TJTransformOp()
+        xform.op = op
+        xform.options = options
+
+        out_w, out_h = w.value, h.value
+        if op in (self.TJXOP_TRANSPOSE, self.TJXOP_TRANSVERSE,
+                  self.TJXOP_ROT90, self.TJXOP_ROT270):
+            out_w, out_h = out_h, out_w
+
+        # crop region of the transformed image, 0 - up to the edge
+        if crop is not None:
+            x, y, cw, ch = crop
+            xform.r.x, xform.r.y, xform.r.w, xform.r.h = crop
+            xform.options |= self.TJXOPT_CROP
+            out_w = cw or out_w - x
+            out_h = ch or out_h - y
+
+        # libturbojpeg assumes this size with NOREALLOC
+        size = self.__buf_size(out_w, out_h, subsamp.value)
+        if size == ct.c_ulong(-1).value:
+            raise ValueError('Invalid image size')
+
+        if dst is None:
+            if self.buf is None or len(self.buf) < size:
+                self.buf = (ct.c_ubyte * size)()
+            buf = self.buf
+        else:
+            buf = (ct.c_ubyte * len(dst)).from_buffer(dst)
+            if len(buf) < size:
+                raise ValueError(f'dst is smaller than {size} bytes')
+
+        jpeg_buf = ct.c_void_p(ct.addressof(buf))
+        jpeg_size = ct.c_ulong(len(buf))
+
+        status = self.__transform(
+            self.handle,
+            src_addr, src_size, 1,
+            ct.byref(jpeg_buf), ct.byref(jpeg_size),
+            ct.byref(xform), flags | self.TJFLAG_NOREALLOC
+        )
+
+        if status != 0:
+            raise IOError('Failed to transform')
+
+        jpeg = memoryview(buf).cast('B')[:jpeg_size.value]
+
+        if dst is None:
+            return jpeg.tobytes()
+
+        return jpeg
@@ -9,7 +9,7 @@ ROOT = os.path.normpath(os.path.join(
 
 
 class V4L2MJpg():
-    def __init__(self, device, w=1920, h=1080):
+    def __init__(self, device, w=1920, h=1080, check=None):
         # init v4l2mjpg library
         libpath = os.path.join(ROOT, 'lib', 'libv4l2mjpg.so')
         lib = ct.CDLL(libpath, use_errno=True)
@@ -36,7 +36,9 @@ class V4L2MJpg():
             ct.c_uint,
             ct.POINTER(ct.c_size_t),
             ct.POINTER(ct.c_uint),
-            ct.POINTER(ct.c_uint)
+            ct.POINTER(ct.c_uint),
+            ct.POINTER(ct.c_double),
+            ct.POINTER(ct.c_uint32)
          ]
         self.__dqbuf.restype = ct.c_void_p
 
@@ -52,12 +54,33 @@ class V4L2MJpg():
         ]
         self.__stop.restype = ct.c_int
 
+        self.__skipped = lib.v4l2_skipped
+        self.__skipped.argtypes = [
+            ct.c_void_p
+        ]
+        self.__skipped.restype = ct.c_ulong
+
+        self.__dropped = lib.v4l2_dropped
+        self.__dropped.argtypes = [
+            ct.c_void_p
+        ]
+        self.__dropped.restype = ct.c_ulong
+
+        self.__set_check_interval = lib.v4l2_set_check_interval
+        self.__set_check_interval.argtypes = [
+            ct.c_void_p,
+            ct.c_uint
+        ]
+        self.__set_check_interval.restype = None
+
         self.__close = lib.v4l2_close
         self.__close.argtypes = [
             ct.c_void_p
         ]
         self.__close.restype = None
 
+        self.__check = 300
+
         num = ct.c_uint(0)
         den = ct.c_uint(0)
 
@@ -70,6 +93,9 @@ class V4L2MJpg():
 
         self.fps = (num.value, den.value)
 
+        if check is not None:
+            self.check = check
+
     def __del__(self):
         self.close()
 
@@ -87,17 +113,20 @@ class V4L2MJpg():
             raise Exception(error)
 
     def dqbuf(self):
+        ''' returns addr, size, width, height, capture time, sequence '''
         w = ct.c_uint(0)
         h = ct.c_uint(0)
         size = ct.c_size_t(0)
-        addr = self.__dqbuf(self.__handle, 5000, size, w, h)
+        ts = ct.c_double(0.0)
+        seq = ct.c_uint32(0)
+        addr = self.__dqbuf(self.__handle, 5000, size, w, h, ts, seq)
         if addr is None:
             errno = ct.get_errno()
             error = ('Failed DQBUF: [Errno {}] {}'
                      .format(errno, os.strerror(errno)))
             raise Exception(error)
 
-        return addr, size.value, w.value, h.value
+        return addr, size.value, w.value, h.value, ts.value, seq.value
 
     def qbuf(self):
         if self.__qbuf(self.__handle) == -1:
@@ -106,6 +135,27 @@ class V4L2MJpg():
                      .format(errno, os.strerror(errno)))
             raise Exception(error)
 
+    @property
+    def skipped(self):
+        # number of broken frames skipped by jpeg check
+        return self.__skipped(self.__handle)
+
+    @property
+    def dropped(self):
+        # number of frames lost by driver (sequence number gaps)
+        return self.__dropped(self.__handle)
+
+    @property
+    def check(self):
+        return self.__check
+
+    @check.setter
+    def check(self, interval):
+        # scan whole frame every N frames (0 - every frame),
+        # only headers are parsed otherwise
+        self.__set_check_interval(self.__handle, interval)
+        self.__check = interval
+
     def stop(self):
         if self.__stop(self.__handle) == -1:
             errno = ct.get_errno()
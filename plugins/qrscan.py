@@ -1,21 +1,31 @@
 import ctypes as ct
+import collections
 import threading
 import requests
 import queue
 import time
 import os
 import os.path
-import signal
 import yaml
 import hmac
 import hashlib
 import base64
+import sqlite3
+import perf
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from catalog import Catalog
+from motion import Motion
+from turbojpeg import TJDecompress
 
 
 # debug:
 #  - motion always detected
 DEBUG = False
 
+# the sharpest frame of the last WINDOW seconds goes to the scanner
+WINDOW = 0.2
+
 #
 # Get app root directory
 #
@@ -32,11 +42,26 @@ if os.getenv('QRSCAN_CFG') is not None:
 else:
     CFG = os.path.join(ROOT, 'etc', 'qrscan.yml')
 
+#
+# qrscan_init() image pipeline backends
+#
+BACKENDS = {
+    'vaapi': 0,
+    'cpu': 1,
+}
+
 #
 # Parse config file
 #
 SECRETS = None
 ACTION = None
+CATALOG = None
+READERS = 2
+TRACK = 4
+DEDUP = 10
+BACKEND = 'vaapi'
+DEVICE = '/dev/dri/renderD128'
+THREADS = 0
 DIR = None
 
 with open(CFG, 'r') as f:
@@ -58,6 +83,35 @@ with open(CFG, 'r') as f:
         assert isinstance(ACTION['payload'], str)
     if 'headers' in ACTION:
         assert isinstance(ACTION['headers'], dict)
+    if 'retries' in ACTION:
+        assert isinstance(ACTION['retries'], int)
+
+    # seconds a decoded token is not verified and acted on again
+    DEDUP = cfg.get('dedup', DEDUP)
+    assert isinstance(DEDUP, (int, float)) and DEDUP >= 0
+
+    # image pipeline: vaapi (VAAPI + OpenCL) or cpu
+    BACKEND = cfg.get('backend', BACKEND)
+    assert BACKEND in BACKENDS
+    DEVICE = cfg.get('device', DEVICE)
+    assert isinstance(DEVICE, str)
+
+    # OpenCV threads (DNN on cpu backend), 0 - OpenCV default
+    THREADS = cfg.get('threads', THREADS)
+    assert isinstance(THREADS, int) and THREADS >= 0
+
+    # barcode reader pool size
+    READERS = cfg.get('readers', READERS)
+    assert isinstance(READERS, int) and READERS > 0
+
+    # frames decoded at the last detected spots without the detector
+    TRACK = cfg.get('track', TRACK)
+    assert isinstance(TRACK, int) and TRACK >= 0
+
+    # rec event catalog to add seen QR codes to
+    CATALOG = cfg.get('catalog')
+    if CATALOG is not None:
+        assert isinstance(CATALOG, str)
 
     del cfg
 
@@ -66,12 +120,72 @@ if DIR is not None:
         raise Exception('Directory {} not found or not a directory'
                         .format(DIR))
 
+#
+# Scanner initialized by warmup()
+#
+SCANNER = None
+
+
+def warmup(logger):
+    ''' load DBR, init the image pipeline and the DNN detector in advance '''
+    global SCANNER
+    SCANNER = QRScan()
+    logger.info('qrcode scanner initialized')
+
+
+#
+# qrscan_get_results() result
+#
+class QRScanResult(ct.Structure):
+    _fields_ = [
+        ('ts', ct.c_double),
+        ('text', ct.c_char_p),
+    ]
+
+
+#
+# Frame sharpness
+#
+class Sharpness:
+    '''
+    Cheap focus measure of a jpeg frame: laplacian energy of the 1/4
+    scale grayscale decode, motion blurred frames score lower
+    '''
+
+    def __init__(self):
+        self.tjd = TJDecompress()
+        self.md = Motion()
+        self.size = None
+        self.buf = None
+        self.time = perf.metrics.histogram('doorcam_qrscan_score_seconds')
+
+    def __call__(self, frame, w, h):
+        sw, sh = (w + 3) // 4, (h + 3) // 4
+        if self.size != (sw, sh):
+            self.size = (sw, sh)
+            self.buf = (ct.c_ubyte * (sw * sh))()
+
+        t = time.monotonic()
+        try:
+            self.tjd.decompress(
+                frame, len(frame),
+                self.buf,
+                sw, sh,
+                self.tjd.TJPF_GRAY
+            )
+            score = self.md.sharpness(self.buf, sw, sh)
+        except (IOError, ValueError):
+            return 0.0
+        self.time.observe(time.monotonic() - t)
+
+        return score
+
 
 #
 # QRScan class
 #
 class QRScan:
-    def __init__(self, result_cb):
+    def __init__(self, result_cb=None):
         path = os.path.join(ROOT, 'lib', 'libDynamsoftBarcodeReader.so')
         libdbr = ct.cdll.LoadLibrary(path)
         path = os.path.join(ROOT, 'lib', 'libqrscan.so')
@@ -84,6 +198,10 @@ class QRScan:
             ct.c_char_p, ct.c_char_p,
             ct.c_ushort, ct.c_ushort,
             ct.c_char_p,
+            ct.c_uint,
+            ct.c_uint,
+            ct.c_int,
+            ct.c_int,
         ]
         self.__qrscan_init.restype = ct.c_void_p
 
@@ -95,14 +213,22 @@ class QRScan:
         # qrscan_process_jpeg()
         self.__qrscan_process_jpeg = libqrscan.qrscan_process_jpeg
         self.__qrscan_process_jpeg.argtypes = [
-            ct.c_void_p, ct.c_void_p, ct.c_size_t
+            ct.c_void_p, ct.c_void_p, ct.c_size_t, ct.c_double
         ]
         self.__qrscan_process_jpeg.restype = ct.c_int
 
-        # qrscan_get_result()
-        self.__qrscan_get_result = libqrscan.qrscan_get_result
-        self.__qrscan_get_result.argtypes = [ct.c_void_p]
-        self.__qrscan_get_result.restype = ct.c_char_p
+        # qrscan_get_results()
+        self.__qrscan_get_results = libqrscan.qrscan_get_results
+        self.__qrscan_get_results.argtypes = [
+            ct.c_void_p, ct.c_int, ct.POINTER(ct.POINTER(QRScanResult))
+        ]
+        self.__qrscan_get_results.restype = ct.c_size_t
+        self.results = ct.POINTER(QRScanResult)()
+
+        # qrscan_detector_runs()
+        self.__qrscan_detector_runs = libqrscan.qrscan_detector_runs
+        self.__qrscan_detector_runs.argtypes = [ct.c_void_p]
+        self.__qrscan_detector_runs.restype = ct.c_ulong
 
         # call qrscan_init()
         self.obj = self.__qrscan_init(
@@ -110,51 +236,103 @@ class QRScan:
             os.path.join(ROOT, 'share', 'detect.prototxt').encode('utf-8'),
             os.path.join(ROOT, 'share', 'detect.caffemodel').encode('utf-8'),
             960, 540,  # best detection success rate @ 960x540
-            '/dev/dri/renderD128'.encode('utf-8')
+            DEVICE.encode('utf-8'),
+            READERS,
+            TRACK,
+            BACKENDS[BACKEND],
+            THREADS
         )
         # start worker thread
         self.cb = result_cb
         self.cv = threading.Condition()
-        self.frame = None
+        self.recent = collections.deque()
         self.skipped = 0
         self.processed = 0
+        self.m_skipped = perf.metrics.counter(
+            'doorcam_qrscan_frames_skipped_total'
+        )
+        self.m_processed = perf.metrics.counter(
+            'doorcam_qrscan_frames_processed_total'
+        )
+        self.m_candidates = perf.metrics.counter(
+            'doorcam_qrscan_candidates_total'
+        )
+        self.m_sharpness = perf.metrics.gauge('doorcam_qrscan_sharpness')
+        self.m_detector = perf.metrics.counter(
+            'doorcam_qrscan_detector_runs_total'
+        )
         threading.Thread(target=self.worker, daemon=True).start()
 
     def __del__(self):
         self.__qrscan_destroy(self.obj)
 
-    def process(self, frame):
+    def process(self, frame, ts=None, score=0.0):
+        ''' queue frame, the sharpest recent one is scanned next '''
+        now = time.monotonic()
+
         with self.cv:
-            if self.frame is None:
-                self.frame = frame
-                self.cv.notify_all()
-                self.processed += 1
-            else:
+            while self.recent and self.recent[0][0] < now - WINDOW:
+                self.recent.popleft()
                 self.skipped += 1
+                self.m_skipped.inc()
+
+            self.recent.append((now, score, frame, ts))
+            self.cv.notify_all()
+
+    def __take(self):
+        ''' the sharpest recent frame or None, caller holds cv '''
+        if not self.recent:
+            return None
+
+        _, score, frame, ts = max(self.recent, key=lambda r: r[1])
+        self.skipped += len(self.recent) - 1
+        self.m_skipped.inc(len(self.recent) - 1)
+        self.recent.clear()
+
+        self.processed += 1
+        self.m_processed.inc()
+        self.m_sharpness.set(score)
+
+        return frame, ts
+
+    def get_results(self, flush):
+        ''' results of decoded frames, flush - the last one too '''
+        n = self.__qrscan_get_results(self.obj, flush, ct.byref(self.results))
+        for i in range(n):
+            self.cb(self.results[i].text, self.results[i].ts)
 
     def worker(self):
+        # candidates of the last frame are being decoded
+        pending = False
+
         while True:
             with self.cv:
-                while self.frame is None:
+                while not self.recent and not pending:
                     self.cv.wait()
-
+                taken = self.__take()
+
+            if taken is None:
+                # no next frame: wait for the last one
+                self.get_results(True)
+                pending = False
+                continue
+
+            # GPU part, candidates are decoded in the reader pool
+            # while the next frame goes through the GPU part,
+            # frames arriving meanwhile compete for the next turn
+            frame, ts = taken
             cnt = self.__qrscan_process_jpeg(
                 self.obj,
-                self.frame,
-                len(self.frame)
+                frame,
+                len(frame),
+                ts or 0.0
             )
+            self.m_candidates.inc(cnt)
+            self.m_detector.set(self.__qrscan_detector_runs(self.obj))
 
-            if cnt > 0:
-                while True:
-                    result = self.__qrscan_get_result(self.obj)
-
-                    if result is None:
-                        break
-
-                    self.cb(result)
-
-            with self.cv:
-                self.frame = None
+            # results of the previous frames
+            self.get_results(False)
+            pending = pending or cnt > 0
 
 
 #
@@ -166,18 +344,29 @@ class Plugin:
         self.log = logger
 
         # load qrscan library and start worker thread
-        self.qrscan = QRScan(self.qrcb)
+        # unless warmed up already
+        if SCANNER is None:
+            self.qrscan = QRScan(self.qrcb)
+        else:
+            self.qrscan = SCANNER
+            self.qrscan.cb = self.qrcb
 
         # motion detection values
         self.motion_counter = 0
         self.motion_gap = 5 * fps[0] // fps[1]
 
-        # remove action zombies automatically
-        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
-
         # prepare qr verifier and action runner
         self.qrv = QRVerifier()
         self.action = Action(logger)
+        self.seen = TokenCache(DEDUP)
+
+        # seen QR codes go to the rec event catalog
+        self.catalog = None
+        if CATALOG is not None:
+            self.catalog = Catalog(CATALOG)
+
+        # frame sharpness
+        self.sharpness = Sharpness()
 
         # first frame flag
         self.ff = True
@@ -217,19 +406,31 @@ class Plugin:
         frame = jpeg.tobytes()
         self.release()
 
-        self.qrscan.process(frame)
+        self.qrscan.process(frame, ts, self.sharpness(frame, w, h))
 
-    def qrcb(self, value):
+    def qrcb(self, value, ts=None):
         try:
             text = value.decode('utf-8')
         except Exception:
             text = value
 
-        if self.qrv.verify(value):
-            self.log.info('found QR Code "{}", valid'.format(text))
-            self.action.run()
-        else:
-            self.log.info('found QR Code "{}", invalid'.format(text))
+        # the same code is decoded from many frames in a row
+        valid = self.seen.get(value)
+        if valid is None:
+            valid = self.qrv.verify(value)
+            self.seen.put(value, valid)
+            if valid:
+                self.log.info('found QR Code "{}", valid'.format(text))
+                self.action.run()
+            else:
+                self.log.info('found QR Code "{}", invalid'.format(text))
+
+            # once per dedup window, not per decoded frame
+            if self.catalog is not None and ts is not None:
+                try:
+                    self.catalog.code(ts, str(text), valid)
+                except sqlite3.Error as e:
+                    self.log.error(f'catalog: {e}')
 
 
 #
@@ -280,10 +481,41 @@ class QRVerifier:
         return False
 
 
+#
+# Recently seen tokens
+#
+class TokenCache:
+    ''' verification results of tokens seen in the last ttl seconds '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.tokens = dict()
+
+    def get(self, token):
+        now = time.monotonic()
+        for t in [t for t, (_, exp) in self.tokens.items() if exp <= now]:
+            del self.tokens[t]
+
+        if token in self.tokens:
+            return self.tokens[token][0]
+
+        return None
+
+    def put(self, token, valid):
+        if self.ttl > 0:
+            self.tokens[token] = (valid, time.monotonic() + self.ttl)
+
+
 #
 # Do action
 #
 class Action:
+    '''
+    Action requests are sent by the dispatcher thread over a pooled
+    keep-alive session: after the first one the door opens with one
+    request on a warm connection
+    '''
+
     def __init__(self, logger):
         self.log = logger
         self.url = ACTION['url']
@@ -291,32 +523,53 @@ class Action:
         self.method = ACTION['method'] if 'method' in ACTION else 'GET'
         self.payload = ACTION['payload'] if 'payload' in ACTION else None
         self.headers = ACTION['headers'] if 'headers' in ACTION else {}
+        self.retries = ACTION['retries'] if 'retries' in ACTION else 2
         self.last_try = 0.0
 
+        # retry connection failures only: the request was not sent
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=0,
+            backoff_factor=0.1,
+            allowed_methods=None
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                              max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if len(self.headers) > 0:
+            self.session.headers.update(self.headers)
+
+        self.kwargs = {'timeout': (10, 10)}
+        if self.payload is not None:
+            self.kwargs['data'] = self.payload.encode('utf-8')
+
+        self.time = perf.metrics.histogram('doorcam_qrscan_action_seconds')
+        self.q = queue.Queue()
+        threading.Thread(target=self.dispatcher, daemon=True).start()
+
     def run(self):
         if self.last_try + self.interval > time.monotonic():
             return
 
         self.last_try = time.monotonic()
+        self.q.put(self.last_try)
 
-        if os.fork() > 0:
-            return
-
-        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
-
-        try:
-            kwargs = {'timeout': (10, 10)}
-            if len(self.headers) > 0:
-                kwargs['headers'] = self.headers
-            if self.payload is not None:
-                kwargs['data'] = self.payload.encode('utf-8')
-
-            r = requests.request(self.method, self.url, **kwargs)
-            r.raise_for_status()
+    def dispatcher(self):
+        while True:
+            t = self.q.get()
 
-            self.log.info('action finished successfully')
+            try:
+                r = self.session.request(self.method, self.url, **self.kwargs)
+                r.raise_for_status()
 
-        except Exception as e:
-            self.log.error(e, exc_info=True)
+                self.time.observe(time.monotonic() - t)
+                self.log.info('action finished successfully in {:.0f} ms'
+                              .format((time.monotonic() - t) * 1000))
 
-        os._exit(0)
+            except Exception as e:
+                self.log.error(e, exc_info=True)
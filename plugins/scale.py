@@ -1,4 +1,4 @@
-from datetime import datetime
+from mpjpeg import MPJpgFramer
 import subprocess
 import os
 import os.path
@@ -21,27 +21,8 @@ class Plugin:
         self.cb = release_cb
         self.log = logger
 
-        self.mpjpeg_header = bytearray(
-            b'--doorcam-scale\r\n'
-            b'Content-Type: image/jpeg\r\n'
-            b'Content-Length: '
-        )
-
-        self.exif = bytearray.fromhex(
-            'FF D8'                                # SOI marker
-            'FF E1'                                # APP1 marker
-            '00 48'                                # APP1 size
-            '45 78 69 66 00 00'                    # Exif header
-            '4D 4D 00 2A 00 00 00 08'              # TIFF header
-            '00 01'                                # IFD0 (1 element)
-            '87 69 00 04 00 00 00 01 00 00 00 1A'  # ExifOffset
-            '00 00 00 00'                          # End of Link
-            '00 01'                                # Exif SubIFD (1 element)
-            '90 03 00 02 00 00 00 14 00 00 00 2C'  # DateTimeOriginal
-            '00 00 00 00'
-            '00 00 00 00 00 00 00 00 00 00'        # DateTimeOriginal value
-            '00 00 00 00 00 00 00 00 00 00'
-        )
+        # mpjpeg parts with capture time (DateTimeOriginal)
+        self.framer = MPJpgFramer('doorcam-scale')
 
         cmd = ['ffmpjpeg-httpd', '-a', '127.0.0.1', '-p', '8081']
         self.stream1 = subprocess.Popen(cmd, stdin=subprocess.PIPE)
@@ -97,14 +78,10 @@ class Plugin:
 
         self.counter = 4
 
-        # assume jpeg has no exif header
-        t = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        content_length = len(self.exif) + len(jpeg) - 2
-        self.exif[56:75] = bytearray(t.encode())
-
-        frame = self.mpjpeg_header + \
-            f'{content_length}\r\n\r\n'.encode() + \
-            self.exif + jpeg[2:]
+        # assume jpeg has no exif header; copy to a pooled buffer and
+        # release the frame before the write: a backpressured ffmpeg
+        # pipe must not hold the camera buffer (pipe transport)
+        frame = self.framer.copy(ts, jpeg)
         self.release()
 
-        os.write(self.scaler.stdin.fileno(), frame)
+        os.write(self.scaler.stdin.fileno(), frame.data)
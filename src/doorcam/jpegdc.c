@@ -0,0 +1,641 @@
+/*
+ * Decode luma DC coefficients of baseline jpeg without IDCT and color
+ * conversion: one byte (8x8 block mean) per luma block, 240x135 map
+ * for 1920x1080 image.
+ *
+ * Part of libmotion.so (see motion.c)
+ */
+
+#include <stdint.h>
+#include <string.h>
+
+#define LOOKAHEAD 10
+
+/* jpeg_dc_luma() errors: corrupt data, valid jpeg of other coding */
+#define JPEG_DC_BROKEN      -1
+#define JPEG_DC_UNSUPPORTED -2
+
+/* ac_skip entry: coefficients to skip << 8 | code and magnitude bits */
+#define AC_EOB 64
+
+
+struct huff {
+    uint8_t  look_len[1 << LOOKAHEAD];  /* 0 - code is longer */
+    uint8_t  look_val[1 << LOOKAHEAD];
+    uint16_t ac_skip[1 << LOOKAHEAD];   /* 0 - use slow path */
+    int32_t  maxcode[18];
+    int32_t  mincode[17];
+    int32_t  valptr[17];
+    uint8_t  vals[256];
+    int      defined;
+};
+
+
+struct component {
+    int id;
+    int h, v;
+    int tq;
+    int td, ta;
+    int pred;
+};
+
+
+struct bits {
+    const uint8_t *p;
+    const uint8_t *end;
+    uint64_t acc;   /* left aligned */
+    int n;          /* number of valid bits */
+    int marker;     /* marker reached, feeding zeros */
+};
+
+
+/* ITU T.81 Annex K default tables (MJPEG streams often omit DHT) */
+static const uint8_t dc_lum_bits[16] = {
+    0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0
+};
+static const uint8_t dc_chr_bits[16] = {
+    0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0
+};
+static const uint8_t dc_vals[12] = {
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11
+};
+static const uint8_t ac_lum_bits[16] = {
+    0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7d
+};
+static const uint8_t ac_lum_vals[162] = {
+    0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12,
+    0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+    0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xa1, 0x08,
+    0x23, 0x42, 0xb1, 0xc1, 0x15, 0x52, 0xd1, 0xf0,
+    0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0a, 0x16,
+    0x17, 0x18, 0x19, 0x1a, 0x25, 0x26, 0x27, 0x28,
+    0x29, 0x2a, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39,
+    0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+    0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59,
+    0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+    0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79,
+    0x7a, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+    0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98,
+    0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5, 0xa6, 0xa7,
+    0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6,
+    0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5,
+    0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4,
+    0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda, 0xe1, 0xe2,
+    0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea,
+    0xf1, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa
+};
+static const uint8_t ac_chr_bits[16] = {
+    0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77
+};
+static const uint8_t ac_chr_vals[162] = {
+    0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21,
+    0x31, 0x06, 0x12, 0x41, 0x51, 0x07, 0x61, 0x71,
+    0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91,
+    0xa1, 0xb1, 0xc1, 0x09, 0x23, 0x33, 0x52, 0xf0,
+    0x15, 0x62, 0x72, 0xd1, 0x0a, 0x16, 0x24, 0x34,
+    0xe1, 0x25, 0xf1, 0x17, 0x18, 0x19, 0x1a, 0x26,
+    0x27, 0x28, 0x29, 0x2a, 0x35, 0x36, 0x37, 0x38,
+    0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48,
+    0x49, 0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58,
+    0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+    0x69, 0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78,
+    0x79, 0x7a, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+    0x88, 0x89, 0x8a, 0x92, 0x93, 0x94, 0x95, 0x96,
+    0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5,
+    0xa6, 0xa7, 0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4,
+    0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3,
+    0xc4, 0xc5, 0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2,
+    0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda,
+    0xe2, 0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9,
+    0xea, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa
+};
+
+
+static int huff_build(struct huff *h, const uint8_t *bits, const uint8_t *vals)
+{
+    int code = 0;
+    int k = 0;
+    int l, i;
+
+    memset(h, 0, sizeof(*h));
+
+    for (l = 1; l <= 16; l++) {
+        h->valptr[l] = k;
+        h->mincode[l] = code;
+
+        for (i = 0; i < bits[l - 1]; i++) {
+            /* over-subscribed code space: corrupt table */
+            if (k >= 256 || code >= (1 << l))
+                return -1;
+
+            h->vals[k] = vals[k];
+
+            /* fill lookahead table */
+            if (l <= LOOKAHEAD) {
+                int shift = LOOKAHEAD - l;
+                int j;
+
+                if (((code + 1) << shift) > (1 << LOOKAHEAD))
+                    return -1;
+
+                for (j = 0; j < (1 << shift); j++) {
+                    h->look_len[(code << shift) | j] = l;
+                    h->look_val[(code << shift) | j] = vals[k];
+                }
+
+                /* code and magnitude fit in lookahead: skip at once */
+                if (vals[k] == 0x00)
+                    for (j = 0; j < (1 << shift); j++)
+                        h->ac_skip[(code << shift) | j] = AC_EOB << 8 | l;
+                else if (l + (vals[k] & 15) <= LOOKAHEAD)
+                    for (j = 0; j < (1 << shift); j++)
+                        h->ac_skip[(code << shift) | j] =
+                            ((vals[k] >> 4) + 1) << 8 | (l + (vals[k] & 15));
+            }
+
+            code++;
+            k++;
+        }
+
+        h->maxcode[l] = bits[l - 1] ? code - 1 : -1;
+        code <<= 1;
+    }
+
+    h->maxcode[17] = 0x7fffffff;
+    h->defined = 1;
+
+    return 0;
+}
+
+
+static inline void bits_fill(struct bits *b)
+{
+    /* fast path: no 0xFF bytes in the next 8 bytes */
+    if (!b->marker && b->p + 8 <= b->end) {
+        uint64_t w;
+
+        memcpy(&w, b->p, 8);
+
+        /* any byte equals 0xFF */
+        if (((~w - 0x0101010101010101ULL) & w & 0x8080808080808080ULL) == 0) {
+            int nbytes = (63 - b->n) >> 3;
+
+            w = __builtin_bswap64(w);
+            b->acc |= (w >> (64 - nbytes * 8)) << (64 - nbytes * 8 - b->n);
+            b->n += nbytes * 8;
+            b->p += nbytes;
+            return;
+        }
+    }
+
+    while (b->n <= 56) {
+        uint64_t c = 0;
+
+        if (!b->marker && b->p < b->end) {
+            c = *b->p++;
+
+            if (c == 0xFF) {
+                if (b->p < b->end && *b->p == 0x00) {
+                    /* stuffed zero byte */
+                    b->p++;
+                } else {
+                    /* marker: stop here, feed zeros */
+                    b->marker = 1;
+                    b->p--;
+                    c = 0;
+                }
+            }
+        }
+
+        b->acc |= c << (56 - b->n);
+        b->n += 8;
+    }
+}
+
+
+static inline void bits_skip(struct bits *b, int n)
+{
+    b->acc <<= n;
+    b->n -= n;
+}
+
+
+static inline int bits_get(struct bits *b, int n)
+{
+    int v;
+
+    if (n == 0)
+        return 0;
+
+    if (b->n < n)
+        bits_fill(b);
+
+    v = (int)(b->acc >> (64 - n));
+    bits_skip(b, n);
+
+    return v;
+}
+
+
+static inline int huff_decode(struct bits *b, const struct huff *h)
+{
+    unsigned int look;
+    int l, code;
+
+    if (b->n < 16)
+        bits_fill(b);
+
+    look = (unsigned int)(b->acc >> (64 - LOOKAHEAD));
+    l = h->look_len[look];
+
+    if (l) {
+        bits_skip(b, l);
+        return h->look_val[look];
+    }
+
+    for (l = LOOKAHEAD + 1; l <= 16; l++) {
+        code = (int)(b->acc >> (64 - l));
+        if (code <= h->maxcode[l]) {
+            bits_skip(b, l);
+            return h->vals[h->valptr[l] + code - h->mincode[l]];
+        }
+    }
+
+    /* broken stream */
+    return -1;
+}
+
+
+static inline int extend(int v, int s)
+{
+    return v < (1 << (s - 1)) ? v - (1 << s) + 1 : v;
+}
+
+
+/* decode one block: returns DC value or INT32_MIN on error */
+static inline int32_t decode_block(struct bits *b,
+                                   struct component *c,
+                                   const struct huff *dc,
+                                   const struct huff *ac)
+{
+    int s, rs, k;
+
+    s = huff_decode(b, dc);
+    if (s < 0 || s > 11)
+        return INT32_MIN;
+
+    if (s != 0)
+        c->pred += extend(bits_get(b, s), s);
+
+    /* skip AC coefficients */
+    for (k = 1; k < 64; k++) {
+        unsigned int e;
+
+        if (b->n < 16)
+            bits_fill(b);
+
+        e = ac->ac_skip[b->acc >> (64 - LOOKAHEAD)];
+
+        if (e) {
+            bits_skip(b, e & 0xFF);
+            k += (e >> 8) - 1;
+            continue;
+        }
+
+        rs = huff_decode(b, ac);
+        if (rs < 0)
+            return INT32_MIN;
+
+        s = rs & 15;
+
+        if (s) {
+            k += rs >> 4;
+            if (b->n < s)
+                bits_fill(b);
+            bits_skip(b, s);
+        } else {
+            if (rs != 0xF0)
+                break;
+            k += 15;
+        }
+    }
+
+    return c->pred;
+}
+
+
+/*
+ * jpeg, size - baseline (SOF0/SOF1) jpeg image
+ * dst - width x height output map, one byte per luma block (or NULL)
+ * bw, bh - returns luma blocks per row / column
+ *
+ * returns 0 on success, JPEG_DC_BROKEN or JPEG_DC_UNSUPPORTED
+ */
+int jpeg_dc_luma(const uint8_t *jpeg,
+                 unsigned long size,
+                 uint8_t *dst,
+                 unsigned int width,
+                 unsigned int height,
+                 unsigned int *bw,
+                 unsigned int *bh)
+{
+    const uint8_t *p = jpeg;
+    const uint8_t *e = jpeg + size;
+    struct huff dc_tables[4], ac_tables[4];
+    struct component comps[4];
+    int qdc[4] = { 1, 1, 1, 1 };
+    struct component *scan[4];
+    int nf = 0, ns = 0;
+    int img_w = 0, img_h = 0;
+    int restart = 0;
+    int hmax = 1, vmax = 1;
+    int i;
+
+    dc_tables[0].defined = dc_tables[1].defined = 0;
+    dc_tables[2].defined = dc_tables[3].defined = 0;
+    ac_tables[0].defined = ac_tables[1].defined = 0;
+    ac_tables[2].defined = ac_tables[3].defined = 0;
+
+    if (size < 4 || p[0] != 0xFF || p[1] != 0xD8)
+        return JPEG_DC_BROKEN;
+
+    p += 2;
+
+    /* parse headers up to start of scan */
+    for (;;) {
+        int marker, len;
+
+        if (p + 4 > e || *p != 0xFF)
+            return JPEG_DC_BROKEN;
+
+        while (p < e && *p == 0xFF)
+            p++;
+
+        if (p + 3 > e)
+            return JPEG_DC_BROKEN;
+
+        marker = *p++;
+        len = (p[0] << 8) + p[1];
+
+        if (p + len > e || len < 2)
+            return JPEG_DC_BROKEN;
+
+        switch (marker) {
+            case 0xC0:
+            case 0xC1:
+                /* SOF0/SOF1 (baseline/extended huffman) */
+                if (len < 8)
+                    return JPEG_DC_BROKEN;
+
+                /* 12-bit extended */
+                if (p[2] != 8)
+                    return JPEG_DC_UNSUPPORTED;
+
+                img_h = (p[3] << 8) + p[4];
+                img_w = (p[5] << 8) + p[6];
+                nf = p[7];
+
+                if (nf < 1 || nf > 4 || len < 8 + nf * 3)
+                    return JPEG_DC_BROKEN;
+
+                for (i = 0; i < nf; i++) {
+                    comps[i].id = p[8 + i * 3];
+                    comps[i].h = p[9 + i * 3] >> 4;
+                    comps[i].v = p[9 + i * 3] & 15;
+                    comps[i].tq = p[10 + i * 3] & 3;
+                    comps[i].pred = 0;
+
+                    if (comps[i].h < 1 || comps[i].h > 4 ||
+                        comps[i].v < 1 || comps[i].v > 4)
+                        return JPEG_DC_BROKEN;
+
+                    if (comps[i].h > hmax)
+                        hmax = comps[i].h;
+                    if (comps[i].v > vmax)
+                        vmax = comps[i].v;
+                }
+
+                break;
+
+            case 0xC2:
+            case 0xC3:
+            case 0xC5:
+            case 0xC6:
+            case 0xC7:
+            case 0xC9:
+            case 0xCA:
+            case 0xCB:
+            case 0xCD:
+            case 0xCE:
+            case 0xCF:
+                /* progressive, lossless or arithmetic */
+                return JPEG_DC_UNSUPPORTED;
+
+            case 0xC4: {
+                /* DHT */
+                const uint8_t *t = p + 2;
+
+                while (t < p + len) {
+                    int tc = t[0] >> 4;
+                    int th = t[0] & 3;
+                    int count = 0;
+
+                    if (t + 17 > p + len || tc > 1)
+                        return JPEG_DC_BROKEN;
+
+                    for (i = 0; i < 16; i++)
+                        count += t[1 + i];
+
+                    if (count > 256 || t + 17 + count > p + len)
+                        return JPEG_DC_BROKEN;
+
+                    if (huff_build(tc ? &ac_tables[th] : &dc_tables[th],
+                                   t + 1, t + 17) == -1)
+                        return JPEG_DC_BROKEN;
+
+                    t += 17 + count;
+                }
+
+                break;
+            }
+
+            case 0xDB: {
+                /* DQT: only DC quantizer is needed */
+                const uint8_t *t = p + 2;
+
+                while (t < p + len) {
+                    int pq = t[0] >> 4;
+                    int tq = t[0] & 3;
+
+                    if (t + 1 + (pq ? 128 : 64) > p + len)
+                        return JPEG_DC_BROKEN;
+
+                    qdc[tq] = pq ? (t[1] << 8) + t[2] : t[1];
+                    t += 1 + (pq ? 128 : 64);
+                }
+
+                break;
+            }
+
+            case 0xDD:
+                /* DRI */
+                if (len < 4)
+                    return JPEG_DC_BROKEN;
+                restart = (p[2] << 8) + p[3];
+                break;
+
+            case 0xDA:
+                /* SOS */
+                if (nf == 0)
+                    return JPEG_DC_BROKEN;
+
+                ns = p[2];
+                if (ns < 1 || ns > nf || len < 6 + ns * 2)
+                    return JPEG_DC_BROKEN;
+
+                /* luma must be in the scan: interleaved only */
+                if (ns != nf)
+                    return JPEG_DC_UNSUPPORTED;
+
+                for (i = 0; i < ns; i++) {
+                    int id = p[3 + i * 2];
+                    int j;
+
+                    scan[i] = NULL;
+                    for (j = 0; j < nf; j++)
+                        if (comps[j].id == id)
+                            scan[i] = &comps[j];
+
+                    if (scan[i] == NULL)
+                        return JPEG_DC_BROKEN;
+
+                    scan[i]->td = p[4 + i * 2] >> 4 & 3;
+                    scan[i]->ta = p[4 + i * 2] & 3;
+                }
+
+                break;
+
+            case 0xD9:
+                return JPEG_DC_BROKEN;
+
+            default:
+                /* APPn, COM, etc */
+                break;
+        }
+
+        p += len;
+
+        if (marker == 0xDA)
+            break;
+    }
+
+    if (img_w == 0 || img_h == 0)
+        return JPEG_DC_BROKEN;
+
+    /* default huffman tables */
+    if (!dc_tables[0].defined)
+        huff_build(&dc_tables[0], dc_lum_bits, dc_vals);
+    if (!dc_tables[1].defined)
+        huff_build(&dc_tables[1], dc_chr_bits, dc_vals);
+    if (!ac_tables[0].defined)
+        huff_build(&ac_tables[0], ac_lum_bits, ac_lum_vals);
+    if (!ac_tables[1].defined)
+        huff_build(&ac_tables[1], ac_chr_bits, ac_chr_vals);
+
+    for (i = 0; i < ns; i++)
+        if (!dc_tables[scan[i]->td].defined ||
+            !ac_tables[scan[i]->ta].defined)
+            return JPEG_DC_BROKEN;
+
+    /* luma block map size */
+    {
+        int lw = (img_w * comps[0].h + hmax - 1) / hmax;
+        int lh = (img_h * comps[0].v + vmax - 1) / vmax;
+        *bw = (lw + 7) / 8;
+        *bh = (lh + 7) / 8;
+    }
+
+    if (dst == NULL)
+        return 0;
+
+    /* decode entropy-coded data */
+    {
+        struct bits b = { p, e, 0, 0, 0 };
+        int mcux, mcuy, mx, my;
+        int q = qdc[comps[0].tq];
+        int left = restart;
+
+        if (ns == 1) {
+            /* non-interleaved: one block per MCU */
+            mcux = *bw;
+            mcuy = *bh;
+            scan[0]->h = scan[0]->v = 1;
+        } else {
+            mcux = (img_w + 8 * hmax - 1) / (8 * hmax);
+            mcuy = (img_h + 8 * vmax - 1) / (8 * vmax);
+        }
+
+        for (my = 0; my < mcuy; my++) {
+            for (mx = 0; mx < mcux; mx++) {
+                int c;
+
+                if (restart) {
+                    if (left == 0) {
+                        /* expect RSTn marker */
+                        if (!b.marker)
+                            while (b.p < e && *b.p != 0xFF)
+                                b.p++;
+                        while (b.p < e && *b.p == 0xFF)
+                            b.p++;
+                        if (b.p >= e || *b.p < 0xD0 || *b.p > 0xD7)
+                            return JPEG_DC_BROKEN;
+                        b.p++;
+                        b.acc = 0;
+                        b.n = 0;
+                        b.marker = 0;
+                        for (c = 0; c < ns; c++)
+                            scan[c]->pred = 0;
+                        left = restart;
+                    }
+                    left--;
+                }
+
+                for (c = 0; c < ns; c++) {
+                    struct component *comp = scan[c];
+                    const struct huff *dc = &dc_tables[comp->td];
+                    const struct huff *ac = &ac_tables[comp->ta];
+                    int x, y;
+
+                    for (y = 0; y < comp->v; y++) {
+                        for (x = 0; x < comp->h; x++) {
+                            int32_t v = decode_block(&b, comp, dc, ac);
+                            unsigned int bx, by;
+
+                            if (v == INT32_MIN)
+                                return JPEG_DC_BROKEN;
+
+                            if (comp != &comps[0])
+                                continue;
+
+                            bx = mx * comp->h + x;
+                            by = my * comp->v + y;
+
+                            if (bx >= *bw || by >= *bh ||
+                                bx >= width || by >= height)
+                                continue;
+
+                            /* block mean: DC * Q / 8 + 128 */
+                            v = v * q / 8 + 128;
+                            dst[by * width + bx] =
+                                v < 0 ? 0 : (v > 255 ? 255 : v);
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    return 0;
+}
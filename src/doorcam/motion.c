@@ -1,38 +1,301 @@
 /*
- * gcc -msse4.2 -O3 -Wall -fPIC -shared -o libmotion.so motion.c
+ * Motion detection kernels with runtime instruction set dispatch:
+ * the best of avx512bw, avx2, sse4.2 and scalar code supported by the
+ * cpu is picked when the library is loaded
+ *
+ * gcc -O3 -Wall -fPIC -shared -o libmotion.so \
+ *     motion.c motion_sse42.c motion_avx2.c motion_avx512.c jpegdc.c
  */
-#include <xmmintrin.h>
-#include <nmmintrin.h>
+#include <stddef.h>
+#include <string.h>
 
+#include "motion.h"
+
+
+static const struct motion_kernels *all[] = {
+#if defined(__x86_64__) || defined(__i386__)
+    &motion_avx512bw,
+    &motion_avx2,
+    &motion_sse42,
+#endif
+    &motion_scalar,
+    NULL
+};
+
+static const struct motion_kernels *kernels = &motion_scalar;
+
+
+static int supported(const struct motion_kernels *k)
+{
+#if defined(__x86_64__) || defined(__i386__)
+    __builtin_cpu_init();
+
+    if (k == &motion_avx512bw)
+        return __builtin_cpu_supports("avx512f") &&
+               __builtin_cpu_supports("avx512bw") &&
+               __builtin_cpu_supports("popcnt");
+
+    if (k == &motion_avx2)
+        return __builtin_cpu_supports("avx2") &&
+               __builtin_cpu_supports("popcnt");
+
+    if (k == &motion_sse42)
+        return __builtin_cpu_supports("sse4.2") &&
+               __builtin_cpu_supports("popcnt");
+#endif
+
+    return k == &motion_scalar;
+}
+
+
+__attribute__((constructor))
+static void motion_init(void)
+{
+    int i;
+
+    for (i = 0; all[i] != NULL; i++) {
+        if (supported(all[i])) {
+            kernels = all[i];
+            return;
+        }
+    }
+}
+
+
+/*
+ * Instruction set of the kernels in use
+ */
+const char *motion_isa(void)
+{
+    return kernels->name;
+}
+
+
+/*
+ * Use kernels for given instruction set:
+ *   scalar, sse4.2, avx2, avx512bw
+ * returns 0 on success, -1 if unknown or not supported by the cpu
+ */
+int motion_set_isa(const char *name)
+{
+    int i;
+
+    for (i = 0; all[i] != NULL; i++) {
+        if (strcmp(all[i]->name, name) == 0) {
+            if (!supported(all[i]))
+                return -1;
+
+            kernels = all[i];
+            return 0;
+        }
+    }
+
+    return -1;
+}
+
+
+/*
+ * Count bytes differing by more than threshold, any length and alignment
+ * returns number of changed bytes or -1
+ */
 long count_different_bytes(
     unsigned char *arr1,
     unsigned char *arr2,
     unsigned long length,
     unsigned char threshold
 ) {
-    __m128i mthreshold = _mm_set1_epi8((char)threshold);
-    __m128i m0 = _mm_setzero_si128();
+    if (arr1 == NULL || arr2 == NULL)
+        return -1;
+
+    return kernels->count_bytes(arr1, arr2, length, threshold);
+}
+
+
+/*
+ * Count changed bytes per tile, mask bytes are 0xFF (count) or 0 (ignore)
+ *   width, height - map size (row stride is width)
+ *   tile_w - tile width, multiple of 16
+ *   counts - tiles_x * tiles_y tile counters (tiles_x = ceil(width / tile_w))
+ * returns total number of changed bytes or -1
+ */
+long count_different_tiles(
+    unsigned char *arr1,
+    unsigned char *arr2,
+    unsigned char *mask,
+    unsigned long width,
+    unsigned long height,
+    unsigned long tile_w,
+    unsigned long tile_h,
+    unsigned char threshold,
+    unsigned long *counts
+) {
+    unsigned long tiles_x, tiles_y;
     unsigned long result = 0;
-    unsigned long i;
+    unsigned long i, y;
+
+    if (arr1 == NULL || arr2 == NULL || mask == NULL || counts == NULL)
+        return -1;
+
+    if (tile_w == 0 || tile_w & 15 || tile_h == 0)
+        return -1;
+
+    tiles_x = (width + tile_w - 1) / tile_w;
+    tiles_y = (height + tile_h - 1) / tile_h;
+
+    for (i = 0; i < tiles_x * tiles_y; i++)
+        counts[i] = 0;
+
+    for (y = 0; y < height; y++)
+        kernels->count_row(arr1 + y * width, arr2 + y * width,
+                           mask + y * width, width, tile_w, threshold,
+                           counts + (y / tile_h) * tiles_x);
+
+    for (i = 0; i < tiles_x * tiles_y; i++)
+        result += counts[i];
+
+    return result;
+}
+
+
+/*
+ * Running average background model: per pixel mean and mean absolute
+ * deviation in 8.7 fixed point
+ *   changed: |frame - mean| > noise_level + 3 * dev
+ *   mean += (frame - mean) >> shift (shift + 2 for changed pixels)
+ *   dev += (|frame - mean| - dev) >> shift (unchanged pixels only)
+ * mask, counts - see count_different_tiles
+ * returns total number of changed pixels or -1
+ */
+long background_update(
+    unsigned char *frame,
+    short *mean,
+    short *dev,
+    unsigned char *mask,
+    unsigned long width,
+    unsigned long height,
+    unsigned long tile_w,
+    unsigned long tile_h,
+    unsigned char noise_level,
+    unsigned char shift,
+    unsigned long *counts
+) {
+    unsigned long tiles_x, tiles_y;
+    unsigned long result = 0;
+    unsigned long i, y;
+
+    if (frame == NULL || mean == NULL || dev == NULL || mask == NULL ||
+        counts == NULL)
+        return -1;
 
-    if ((unsigned long)arr1 & 15 || (unsigned long)arr2 & 15 || length & 15)
+    if (tile_w == 0 || tile_w & 15 || tile_h == 0 || shift > 12)
         return -1;
 
-    for (i = 0; i < length; i += 16) {
-        // load next 16 bytes from arr1 and arr2
-        __m128i m1 = _mm_loadu_si128((__m128i *) &arr1[i]);
-        __m128i m2 = _mm_loadu_si128((__m128i *) &arr2[i]);
+    tiles_x = (width + tile_w - 1) / tile_w;
+    tiles_y = (height + tile_h - 1) / tile_h;
+
+    for (i = 0; i < tiles_x * tiles_y; i++)
+        counts[i] = 0;
+
+    for (y = 0; y < height; y++)
+        kernels->background_row(frame + y * width, mask + y * width,
+                                mean + y * width, dev + y * width,
+                                width, tile_w, noise_level, shift,
+                                counts + (y / tile_h) * tiles_x);
+
+    for (i = 0; i < tiles_x * tiles_y; i++)
+        result += counts[i];
+
+    return result;
+}
 
-        // calculate absolute difference
-        __m128i absdiff = _mm_adds_epu8(_mm_subs_epu8(m1, m2),
-                                        _mm_subs_epu8(m2, m1));
 
-        // remove noise and compare to zeros
-        __m128i mres = _mm_cmpeq_epi8(_mm_subs_epu8(absdiff, mthreshold), m0);
+/*
+ * Set background mean to the frame (8.7 fixed point)
+ */
+void background_reset(
+    unsigned char *frame,
+    short *mean,
+    unsigned long length
+) {
+    unsigned long i;
 
-        // count zero bytes
-        result += _mm_popcnt_u32(_mm_movemask_epi8(mres));
+    for (i = 0; i < length; i++)
+        mean[i] = frame[i] << 7;
+}
+
+
+/*
+ * Focus measure of a grayscale image (row stride is width): mean
+ * squared 4-neighbour laplacian, motion blur and defocus lower it
+ * returns -1 if the image is too small
+ */
+double sharpness(
+    unsigned char *img,
+    unsigned long width,
+    unsigned long height
+) {
+    unsigned long long sum = 0;
+    unsigned long x, y;
+
+    if (img == NULL || width < 3 || height < 3)
+        return -1.0;
+
+    for (y = 1; y < height - 1; y++) {
+        const unsigned char *p = img + y * width;
+
+        for (x = 1; x < width - 1; x++) {
+            int l = 4 * p[x] - p[x - 1] - p[x + 1] - p[x - width] -
+                    p[x + width];
+            sum += (unsigned long long)(l * l);
+        }
     }
 
-    return length - result;
+    return (double)sum / ((width - 2) * (height - 2));
 }
+
+
+/*
+ * Scalar kernels
+ */
+static unsigned long count_bytes_scalar(
+    const uint8_t *arr1,
+    const uint8_t *arr2,
+    unsigned long length,
+    uint8_t threshold
+) {
+    return count_bytes_tail(arr1, arr2, 0, length, threshold);
+}
+
+static void count_row_scalar(
+    const uint8_t *row1,
+    const uint8_t *row2,
+    const uint8_t *rowm,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t threshold,
+    unsigned long *tiles
+) {
+    count_row_tail(row1, row2, rowm, 0, width, tile_w, threshold, tiles);
+}
+
+static void background_row_scalar(
+    const uint8_t *rowp,
+    const uint8_t *rowm,
+    int16_t *mean,
+    int16_t *dev,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t noise_level,
+    uint8_t shift,
+    unsigned long *tiles
+) {
+    background_row_tail(rowp, rowm, mean, dev, 0, width, tile_w,
+                        noise_level, shift, tiles);
+}
+
+const struct motion_kernels motion_scalar = {
+    "scalar",
+    count_bytes_scalar,
+    count_row_scalar,
+    background_row_scalar,
+};
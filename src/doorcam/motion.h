@@ -0,0 +1,146 @@
+/*
+ * Motion detection kernels, one set per instruction set
+ */
+#ifndef MOTION_H
+#define MOTION_H
+
+#include <stdint.h>
+
+struct motion_kernels {
+    const char *name;
+
+    /* number of bytes differing by more than threshold */
+    unsigned long (*count_bytes)(
+        const uint8_t *arr1,
+        const uint8_t *arr2,
+        unsigned long length,
+        uint8_t threshold
+    );
+
+    /* add changed bytes of one row to tile counters */
+    void (*count_row)(
+        const uint8_t *row1,
+        const uint8_t *row2,
+        const uint8_t *rowm,
+        unsigned long width,
+        unsigned long tile_w,
+        uint8_t threshold,
+        unsigned long *tiles
+    );
+
+    /* update background of one row, add changed pixels to tile counters */
+    void (*background_row)(
+        const uint8_t *rowp,
+        const uint8_t *rowm,
+        int16_t *mean,
+        int16_t *dev,
+        unsigned long width,
+        unsigned long tile_w,
+        uint8_t noise_level,
+        uint8_t shift,
+        unsigned long *tiles
+    );
+};
+
+extern const struct motion_kernels motion_scalar;
+extern const struct motion_kernels motion_sse42;
+extern const struct motion_kernels motion_avx2;
+extern const struct motion_kernels motion_avx512bw;
+
+
+/*
+ * Walk row tiles in 16 bytes segments (tile width is multiple of 16)
+ */
+struct tile_walk {
+    unsigned long *tile;
+    unsigned long segs;
+    unsigned long left;
+};
+
+static inline void tile_walk_init(struct tile_walk *t, unsigned long *tiles,
+                                  unsigned long tile_w)
+{
+    t->tile = tiles;
+    t->segs = tile_w / 16;
+    t->left = t->segs;
+}
+
+static inline void tile_add(struct tile_walk *t, unsigned long n)
+{
+    *t->tile += n;
+
+    if (--t->left == 0) {
+        t->tile++;
+        t->left = t->segs;
+    }
+}
+
+
+/*
+ * Scalar tails, x is the first unprocessed byte
+ */
+static inline unsigned long count_bytes_tail(
+    const uint8_t *arr1,
+    const uint8_t *arr2,
+    unsigned long x,
+    unsigned long length,
+    uint8_t threshold
+) {
+    unsigned long result = 0;
+
+    for (; x < length; x++) {
+        int d = (int)arr1[x] - (int)arr2[x];
+
+        if (d > threshold || -d > threshold)
+            result++;
+    }
+
+    return result;
+}
+
+static inline void count_row_tail(
+    const uint8_t *row1,
+    const uint8_t *row2,
+    const uint8_t *rowm,
+    unsigned long x,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t threshold,
+    unsigned long *tiles
+) {
+    for (; x < width; x++) {
+        int d = (int)row1[x] - (int)row2[x];
+
+        if (rowm[x] && (d > threshold || -d > threshold))
+            tiles[x / tile_w]++;
+    }
+}
+
+static inline void background_row_tail(
+    const uint8_t *rowp,
+    const uint8_t *rowm,
+    int16_t *mean,
+    int16_t *dev,
+    unsigned long x,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t noise_level,
+    uint8_t shift,
+    unsigned long *tiles
+) {
+    for (; x < width; x++) {
+        int diff = (rowp[x] << 7) - mean[x];
+        int ad = diff < 0 ? -diff : diff;
+        int thr = (noise_level << 7) + 3 * dev[x];
+        int changed = ad > (thr > 32767 ? 32767 : thr);
+
+        mean[x] += diff >> (changed ? shift + 2 : shift);
+        if (!changed)
+            dev[x] += (ad - dev[x]) >> shift;
+
+        if (changed && rowm[x])
+            tiles[x / tile_w]++;
+    }
+}
+
+#endif
@@ -0,0 +1,147 @@
+/*
+ * AVX2 motion kernels: 32 bytes (16 background pixels) per iteration
+ */
+#if defined(__x86_64__) || defined(__i386__)
+
+#pragma GCC target("avx2,popcnt")
+
+#include <immintrin.h>
+
+#include "motion.h"
+
+
+static unsigned long count_bytes_avx2(
+    const uint8_t *arr1,
+    const uint8_t *arr2,
+    unsigned long length,
+    uint8_t threshold
+) {
+    __m256i mthreshold = _mm256_set1_epi8((char)threshold);
+    __m256i m0 = _mm256_setzero_si256();
+    unsigned long result = 0;
+    unsigned long i;
+
+    for (i = 0; i + 32 <= length; i += 32) {
+        __m256i m1 = _mm256_loadu_si256((__m256i *) &arr1[i]);
+        __m256i m2 = _mm256_loadu_si256((__m256i *) &arr2[i]);
+
+        __m256i absdiff = _mm256_or_si256(_mm256_subs_epu8(m1, m2),
+                                          _mm256_subs_epu8(m2, m1));
+
+        // unchanged bytes are 0xFF
+        __m256i mres = _mm256_cmpeq_epi8(
+            _mm256_subs_epu8(absdiff, mthreshold), m0
+        );
+
+        result += 32 - _mm_popcnt_u32(_mm256_movemask_epi8(mres));
+    }
+
+    return result + count_bytes_tail(arr1, arr2, i, length, threshold);
+}
+
+
+static void count_row_avx2(
+    const uint8_t *row1,
+    const uint8_t *row2,
+    const uint8_t *rowm,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t threshold,
+    unsigned long *tiles
+) {
+    __m256i mthreshold = _mm256_set1_epi8((char)threshold);
+    __m256i m0 = _mm256_setzero_si256();
+    struct tile_walk t;
+    unsigned long x;
+
+    tile_walk_init(&t, tiles, tile_w);
+
+    for (x = 0; x + 32 <= width; x += 32) {
+        __m256i m1 = _mm256_loadu_si256((__m256i *) &row1[x]);
+        __m256i m2 = _mm256_loadu_si256((__m256i *) &row2[x]);
+        __m256i mm = _mm256_loadu_si256((__m256i *) &rowm[x]);
+        unsigned int bits;
+
+        __m256i absdiff = _mm256_or_si256(_mm256_subs_epu8(m1, m2),
+                                          _mm256_subs_epu8(m2, m1));
+
+        __m256i mres = _mm256_cmpeq_epi8(
+            _mm256_subs_epu8(absdiff, mthreshold), m0
+        );
+
+        // changed and not masked out, 16 bytes may belong to other tile
+        bits = _mm256_movemask_epi8(_mm256_andnot_si256(mres, mm));
+        tile_add(&t, _mm_popcnt_u32(bits & 0xFFFF));
+        tile_add(&t, _mm_popcnt_u32(bits >> 16));
+    }
+
+    count_row_tail(row1, row2, rowm, x, width, tile_w, threshold, tiles);
+}
+
+
+static void background_row_avx2(
+    const uint8_t *rowp,
+    const uint8_t *rowm,
+    int16_t *mean,
+    int16_t *dev,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t noise_level,
+    uint8_t shift,
+    unsigned long *tiles
+) {
+    __m256i noise = _mm256_set1_epi16((short)(noise_level << 7));
+    __m128i mshift = _mm_cvtsi32_si128(shift);
+    __m128i mshift_fg = _mm_cvtsi32_si128(shift + 2);
+    struct tile_walk t;
+    unsigned long x;
+
+    tile_walk_init(&t, tiles, tile_w);
+
+    for (x = 0; x + 16 <= width; x += 16) {
+        __m256i p = _mm256_slli_epi16(_mm256_cvtepu8_epi16(
+            _mm_loadu_si128((__m128i *) &rowp[x])), 7);
+        __m256i mask16 = _mm256_cvtepi8_epi16(
+            _mm_loadu_si128((__m128i *) &rowm[x]));
+        __m256i m = _mm256_loadu_si256((__m256i *) &mean[x]);
+        __m256i d = _mm256_loadu_si256((__m256i *) &dev[x]);
+
+        // distance from the background
+        __m256i diff = _mm256_sub_epi16(p, m);
+        __m256i ad = _mm256_abs_epi16(diff);
+
+        // changed: |p - mean| > noise + 3 * dev
+        __m256i thr = _mm256_adds_epi16(noise, _mm256_adds_epi16(
+            d, _mm256_adds_epi16(d, d)));
+        __m256i ch = _mm256_cmpgt_epi16(ad, thr);
+
+        // changed pixels are learned 4 times slower
+        m = _mm256_add_epi16(m, _mm256_blendv_epi8(
+            _mm256_sra_epi16(diff, mshift),
+            _mm256_sra_epi16(diff, mshift_fg), ch));
+
+        // noise estimate is learned from background pixels only
+        d = _mm256_add_epi16(d, _mm256_andnot_si256(ch, _mm256_sra_epi16(
+            _mm256_sub_epi16(ad, d), mshift)));
+
+        _mm256_storeu_si256((__m256i *) &mean[x], m);
+        _mm256_storeu_si256((__m256i *) &dev[x], d);
+
+        // two mask bits per pixel
+        ch = _mm256_and_si256(ch, mask16);
+        tile_add(&t, _mm_popcnt_u32(_mm256_movemask_epi8(ch)) / 2);
+    }
+
+    background_row_tail(rowp, rowm, mean, dev, x, width, tile_w,
+                        noise_level, shift, tiles);
+}
+
+
+const struct motion_kernels motion_avx2 = {
+    "avx2",
+    count_bytes_avx2,
+    count_row_avx2,
+    background_row_avx2,
+};
+
+#endif
@@ -0,0 +1,153 @@
+/*
+ * AVX-512BW motion kernels: 64 bytes (32 background pixels) per
+ * iteration, row tails are processed with masked loads and stores
+ */
+#if defined(__x86_64__) || defined(__i386__)
+
+#pragma GCC target("avx512f,avx512bw,popcnt")
+
+#include <immintrin.h>
+
+#include "motion.h"
+
+
+static inline __mmask64 tail64(unsigned long n)
+{
+    return n >= 64 ? ~0ULL : (1ULL << n) - 1;
+}
+
+
+static unsigned long count_bytes_avx512bw(
+    const uint8_t *arr1,
+    const uint8_t *arr2,
+    unsigned long length,
+    uint8_t threshold
+) {
+    __m512i mthreshold = _mm512_set1_epi8((char)threshold);
+    unsigned long result = 0;
+    unsigned long i;
+
+    for (i = 0; i < length; i += 64) {
+        __mmask64 k = tail64(length - i);
+        __m512i m1 = _mm512_maskz_loadu_epi8(k, &arr1[i]);
+        __m512i m2 = _mm512_maskz_loadu_epi8(k, &arr2[i]);
+
+        __m512i absdiff = _mm512_or_si512(_mm512_subs_epu8(m1, m2),
+                                          _mm512_subs_epu8(m2, m1));
+
+        result += _mm_popcnt_u64(_mm512_cmpgt_epu8_mask(absdiff, mthreshold));
+    }
+
+    return result;
+}
+
+
+static void count_row_avx512bw(
+    const uint8_t *row1,
+    const uint8_t *row2,
+    const uint8_t *rowm,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t threshold,
+    unsigned long *tiles
+) {
+    __m512i mthreshold = _mm512_set1_epi8((char)threshold);
+    struct tile_walk t;
+    unsigned long x, s;
+
+    tile_walk_init(&t, tiles, tile_w);
+
+    for (x = 0; x < width; x += 64) {
+        __mmask64 k = tail64(width - x);
+        __m512i m1 = _mm512_maskz_loadu_epi8(k, &row1[x]);
+        __m512i m2 = _mm512_maskz_loadu_epi8(k, &row2[x]);
+        __m512i mm = _mm512_maskz_loadu_epi8(k, &rowm[x]);
+        uint64_t bits;
+
+        __m512i absdiff = _mm512_or_si512(_mm512_subs_epu8(m1, m2),
+                                          _mm512_subs_epu8(m2, m1));
+
+        // changed and not masked out
+        bits = _mm512_mask_cmpgt_epu8_mask(_mm512_test_epi8_mask(mm, mm),
+                                           absdiff, mthreshold);
+
+        // every 16 bytes may belong to other tile
+        for (s = 0; s < 64 && x + s < width; s += 16)
+            tile_add(&t, _mm_popcnt_u64((bits >> s) & 0xFFFF));
+    }
+}
+
+
+static void background_row_avx512bw(
+    const uint8_t *rowp,
+    const uint8_t *rowm,
+    int16_t *mean,
+    int16_t *dev,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t noise_level,
+    uint8_t shift,
+    unsigned long *tiles
+) {
+    __m512i noise = _mm512_set1_epi16((short)(noise_level << 7));
+    __m128i mshift = _mm_cvtsi32_si128(shift);
+    __m128i mshift_fg = _mm_cvtsi32_si128(shift + 2);
+    struct tile_walk t;
+    unsigned long x;
+
+    tile_walk_init(&t, tiles, tile_w);
+
+    for (x = 0; x < width; x += 32) {
+        __mmask64 k8 = tail64(width - x) & 0xFFFFFFFFULL;
+        __mmask32 k16 = (__mmask32)k8;
+
+        __m512i p = _mm512_slli_epi16(_mm512_cvtepu8_epi16(
+            _mm512_castsi512_si256(_mm512_maskz_loadu_epi8(k8, &rowp[x]))
+        ), 7);
+        __m512i mask16 = _mm512_cvtepi8_epi16(
+            _mm512_castsi512_si256(_mm512_maskz_loadu_epi8(k8, &rowm[x]))
+        );
+        __m512i m = _mm512_maskz_loadu_epi16(k16, &mean[x]);
+        __m512i d = _mm512_maskz_loadu_epi16(k16, &dev[x]);
+        __mmask32 ch;
+        uint32_t bits;
+
+        // distance from the background
+        __m512i diff = _mm512_sub_epi16(p, m);
+        __m512i ad = _mm512_abs_epi16(diff);
+
+        // changed: |p - mean| > noise + 3 * dev
+        __m512i thr = _mm512_adds_epi16(noise, _mm512_adds_epi16(
+            d, _mm512_adds_epi16(d, d)));
+        ch = _mm512_cmpgt_epi16_mask(ad, thr);
+
+        // changed pixels are learned 4 times slower
+        m = _mm512_add_epi16(m, _mm512_mask_blend_epi16(
+            ch,
+            _mm512_sra_epi16(diff, mshift),
+            _mm512_sra_epi16(diff, mshift_fg)));
+
+        // noise estimate is learned from background pixels only
+        d = _mm512_mask_add_epi16(d, ~ch, d, _mm512_sra_epi16(
+            _mm512_sub_epi16(ad, d), mshift));
+
+        _mm512_mask_storeu_epi16(&mean[x], k16, m);
+        _mm512_mask_storeu_epi16(&dev[x], k16, d);
+
+        bits = ch & k16 & _mm512_test_epi16_mask(mask16, mask16);
+
+        tile_add(&t, _mm_popcnt_u32(bits & 0xFFFF));
+        if (x + 16 < width)
+            tile_add(&t, _mm_popcnt_u32(bits >> 16));
+    }
+}
+
+
+const struct motion_kernels motion_avx512bw = {
+    "avx512bw",
+    count_bytes_avx512bw,
+    count_row_avx512bw,
+    background_row_avx512bw,
+};
+
+#endif
@@ -0,0 +1,168 @@
+/*
+ * SSE4.2 motion kernels: 16 bytes per iteration
+ */
+#if defined(__x86_64__) || defined(__i386__)
+
+#pragma GCC target("sse4.2,popcnt")
+
+#include <nmmintrin.h>
+
+#include "motion.h"
+
+
+static unsigned long count_bytes_sse42(
+    const uint8_t *arr1,
+    const uint8_t *arr2,
+    unsigned long length,
+    uint8_t threshold
+) {
+    __m128i mthreshold = _mm_set1_epi8((char)threshold);
+    __m128i m0 = _mm_setzero_si128();
+    unsigned long result = 0;
+    unsigned long i;
+
+    for (i = 0; i + 16 <= length; i += 16) {
+        // load next 16 bytes from arr1 and arr2
+        __m128i m1 = _mm_loadu_si128((__m128i *) &arr1[i]);
+        __m128i m2 = _mm_loadu_si128((__m128i *) &arr2[i]);
+
+        // calculate absolute difference
+        __m128i absdiff = _mm_or_si128(_mm_subs_epu8(m1, m2),
+                                       _mm_subs_epu8(m2, m1));
+
+        // remove noise and compare to zeros
+        __m128i mres = _mm_cmpeq_epi8(_mm_subs_epu8(absdiff, mthreshold), m0);
+
+        // count non zero bytes
+        result += 16 - _mm_popcnt_u32(_mm_movemask_epi8(mres));
+    }
+
+    return result + count_bytes_tail(arr1, arr2, i, length, threshold);
+}
+
+
+static void count_row_sse42(
+    const uint8_t *row1,
+    const uint8_t *row2,
+    const uint8_t *rowm,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t threshold,
+    unsigned long *tiles
+) {
+    __m128i mthreshold = _mm_set1_epi8((char)threshold);
+    __m128i m0 = _mm_setzero_si128();
+    struct tile_walk t;
+    unsigned long x;
+
+    tile_walk_init(&t, tiles, tile_w);
+
+    for (x = 0; x + 16 <= width; x += 16) {
+        __m128i m1 = _mm_loadu_si128((__m128i *) &row1[x]);
+        __m128i m2 = _mm_loadu_si128((__m128i *) &row2[x]);
+        __m128i mm = _mm_loadu_si128((__m128i *) &rowm[x]);
+
+        __m128i absdiff = _mm_or_si128(_mm_subs_epu8(m1, m2),
+                                       _mm_subs_epu8(m2, m1));
+
+        // unchanged bytes are 0xFF
+        __m128i mres = _mm_cmpeq_epi8(_mm_subs_epu8(absdiff, mthreshold), m0);
+
+        // changed and not masked out
+        mres = _mm_andnot_si128(mres, mm);
+
+        tile_add(&t, _mm_popcnt_u32(_mm_movemask_epi8(mres)));
+    }
+
+    count_row_tail(row1, row2, rowm, x, width, tile_w, threshold, tiles);
+}
+
+
+/*
+ * Update background model with 8 pixels, returns changed pixels bitmask
+ */
+static inline int background8(
+    __m128i p8,
+    int16_t *mean,
+    int16_t *dev,
+    __m128i mask16,
+    __m128i noise,
+    __m128i shift,
+    __m128i shift_fg
+) {
+    __m128i p = _mm_slli_epi16(_mm_cvtepu8_epi16(p8), 7);
+    __m128i m = _mm_loadu_si128((__m128i *) mean);
+    __m128i d = _mm_loadu_si128((__m128i *) dev);
+
+    // distance from the background
+    __m128i diff = _mm_sub_epi16(p, m);
+    __m128i ad = _mm_abs_epi16(diff);
+
+    // changed: |p - mean| > noise + 3 * dev
+    __m128i thr = _mm_adds_epi16(noise, _mm_adds_epi16(
+        d, _mm_adds_epi16(d, d)));
+    __m128i ch = _mm_cmpgt_epi16(ad, thr);
+
+    // changed pixels are learned 4 times slower
+    m = _mm_add_epi16(m, _mm_blendv_epi8(_mm_sra_epi16(diff, shift),
+                                         _mm_sra_epi16(diff, shift_fg), ch));
+
+    // noise estimate is learned from background pixels only
+    d = _mm_add_epi16(d, _mm_andnot_si128(ch, _mm_sra_epi16(
+        _mm_sub_epi16(ad, d), shift)));
+
+    _mm_storeu_si128((__m128i *) mean, m);
+    _mm_storeu_si128((__m128i *) dev, d);
+
+    ch = _mm_and_si128(ch, mask16);
+
+    return _mm_movemask_epi8(_mm_packs_epi16(ch, _mm_setzero_si128())) & 0xFF;
+}
+
+
+static void background_row_sse42(
+    const uint8_t *rowp,
+    const uint8_t *rowm,
+    int16_t *mean,
+    int16_t *dev,
+    unsigned long width,
+    unsigned long tile_w,
+    uint8_t noise_level,
+    uint8_t shift,
+    unsigned long *tiles
+) {
+    __m128i noise = _mm_set1_epi16((short)(noise_level << 7));
+    __m128i mshift = _mm_cvtsi32_si128(shift);
+    __m128i mshift_fg = _mm_cvtsi32_si128(shift + 2);
+    struct tile_walk t;
+    unsigned long x;
+
+    tile_walk_init(&t, tiles, tile_w);
+
+    for (x = 0; x + 16 <= width; x += 16) {
+        __m128i p = _mm_loadu_si128((__m128i *) &rowp[x]);
+        __m128i mm = _mm_loadu_si128((__m128i *) &rowm[x]);
+        int bits;
+
+        bits = background8(p, &mean[x], &dev[x], _mm_cvtepi8_epi16(mm),
+                           noise, mshift, mshift_fg);
+        bits |= background8(_mm_srli_si128(p, 8), &mean[x + 8], &dev[x + 8],
+                            _mm_cvtepi8_epi16(_mm_srli_si128(mm, 8)),
+                            noise, mshift, mshift_fg) << 8;
+
+        tile_add(&t, _mm_popcnt_u32(bits));
+    }
+
+    background_row_tail(rowp, rowm, mean, dev, x, width, tile_w,
+                        noise_level, shift, tiles);
+}
+
+
+const struct motion_kernels motion_sse42 = {
+    "sse4.2",
+    count_bytes_sse42,
+    count_row_sse42,
+    background_row_sse42,
+};
+
+#endif
@@ -1,8 +1,14 @@
+#include <condition_variable>
 #include <iostream>
+#include <thread>
 #include <vector>
+#include <deque>
+#include <mutex>
+#include <map>
 
 #include <opencv2/core.hpp>
 #include <opencv2/core/mat.hpp>
+#include <opencv2/core/ocl.hpp>
 #include <opencv2/dnn.hpp>
 #include <opencv2/imgproc.hpp>
 #include <opencv2/calib3d.hpp>
@@ -11,24 +17,50 @@
 #include <DynamsoftCommon.h>
 
 #include "jpeg2umat.hpp"
+#include "tj2umat.hpp"
+
+
+// image pipeline backends
+enum qrscan_backend {
+    QRSCAN_BACKEND_VAAPI = 0,  // VAAPI jpeg decoder, OpenCL
+    QRSCAN_BACKEND_CPU = 1,    // libjpeg-turbo, OpenCV CPU code
+};
+
+
+// batch result: frame capture time and decoded text
+struct qrscan_result {
+    double ts;
+    const char *text;
+};
+
 
 class QRScan {
     private:
         // libav VAAPI jpeg decoder -> grayscale cv::UMat
+        // or libjpeg-turbo scaled decoder (CPU backend)
+        int backend;
         jpeg2umat *j2u;
+        tj2umat *tj;
 
         // preallocate image matrices
         cv::UMat gray;
-        cv::UMat undistorted;
+        cv::UMat crop;
         cv::UMat detect;
         cv::UMat detect32f;
 
-        // undistort matrices
+        // undistort matrices:
+        //   dmap1 & dmap2 - source image -> detector input, one pass
+        //   map1 & map2 - source image -> candidates at the source
+        //                 resolution (roi_size), remapped by boxes
         cv::Mat K;
         cv::Mat D;
+        cv::UMat dmap1;
+        cv::UMat dmap2;
         cv::UMat map1;
         cv::UMat map2;
         cv::Size scan_size;
+        cv::Size roi_size;
+        double roi_scale;
         bool maps_initialized;
 
         // detector dnn
@@ -36,13 +68,52 @@ class QRScan {
         cv::Size detect_size;
         int blob_size[4];
 
-        // dynamsoft barcode reader
+        // dynamsoft barcode reader pool, one reader per thread
         // apply license before creating QRScan object
-        dynamsoft::dbr::CBarcodeReader *dbr;
-
-        // last scan results
-        std::vector<std::string> results;
-        unsigned int curr;
+        std::vector<dynamsoft::dbr::CBarcodeReader *> readers;
+
+        // candidate to decode
+        struct candidate {
+            unsigned long batch;
+            cv::Mat image;
+        };
+
+        // candidates of one frame
+        struct batch {
+            double ts;
+            unsigned int pending;
+            std::vector<std::string> texts;
+            // detector boxes, none for a tracked frame
+            std::vector<cv::Rect> rois;
+        };
+
+        // reader pool state, protected by lock
+        std::mutex lock;
+        std::condition_variable queued;
+        std::condition_variable decoded;
+        std::deque<candidate> candidates;
+        std::map<unsigned long, batch> batches;
+        unsigned long last_batch;
+
+        // tracking: boxes of the last decoded detection are reused
+        // for track_frames frames, or until a tracked frame fails
+        unsigned int track_frames;
+        unsigned int track_left;
+        unsigned long track_batch;
+        std::vector<cv::Rect> tracked;
+        unsigned long detector_runs;
+
+        // results returned by the last get_results()
+        std::vector<std::string> texts;
+        std::vector<qrscan_result> results;
+
+        void reader_thread(dynamsoft::dbr::CBarcodeReader *dbr);
+        void track_update(unsigned long id, const batch &b);
+        int queue_batch(std::vector<candidate> &found, double ts,
+                        const std::vector<cv::Rect> &rois);
+        cv::Rect track_roi(const cv::Rect &roi) const;
+        void add_candidate(const cv::Rect &roi,
+                           std::vector<candidate> &found);
 
     public:
         // constructor
@@ -50,26 +121,43 @@ class QRScan {
                const char *detector_prototxt_path,     // detect.prototxt
                const char *detector_caffe_model_path,  // detect.caffemodel
                unsigned short scan_width = 0,          // undistorted img width
-               unsigned short scan_height = 0,         //            and height
-               const char *hwdevice = NULL);           // /dev/dri/renderD128
+               unsigned short scan_height = 0,         //  and height to detect
+               const char *hwdevice = NULL,            // /dev/dri/renderD128
+               unsigned int readers = 2,               // DBR instances
+               unsigned int track_frames = 0,          // 0 - no tracking
+               int backend = QRSCAN_BACKEND_VAAPI,     // image pipeline
+               int threads = 0);                       // OpenCV threads
 
         // destructor
         //   - do not run!
         ~QRScan();
 
-        // GPU part:
+        // GPU part (CPU backend: the same on CPU):
         //   - decode jpeg using VAAPI / convert to NV12
+        //     (CPU: decode luminance using libjpeg-turbo at the
+        //     smallest scale covering the undistorted image)
         //   - copy luminance plane to OpenCV's UMat
-        //   - undistort / scale grayscale image
+        //   - undistort and scale grayscale image to the detector
+        //     input in one pass
         //   - run WeChatCV's DNN to find QR Code objects
-        // CPU part:
+        //     (tracking: the last decoded objects, no DNN)
+        //   - undistort found objects only, at the source resolution
+        //   - download found objects
+        // CPU part, in the reader pool:
         //   - run Dynamsoft Barcode Reader to decode found objects
         //   - store results
-        int process_jpeg(void *data, size_t size);
-
-        // get result from the last process_jpeg()
-        //   - run multiple times until NULL
-        const char *get_result();
+        // returns the number of candidates queued, the GPU part of the
+        // next frame runs while they are decoded
+        int process_jpeg(void *data, size_t size, double ts);
+
+        // get results of decoded frames in one batch
+        //   - waits for every frame but the last one processed,
+        //     flush - wait for the last one too
+        //   - results are valid until the next call
+        size_t get_results(int flush, const qrscan_result **results);
+
+        // number of detector DNN runs
+        unsigned long get_detector_runs();
 };
 
 
@@ -78,10 +166,27 @@ QRScan::QRScan(const char *undistort_path,
                const char *detector_caffe_model_path,
                unsigned short scan_width,
                unsigned short scan_height,
-               const char *hwdevice)
+               const char *hwdevice,
+               unsigned int readers_count,
+               unsigned int track_frames,
+               int backend,
+               int threads)
 {
-    // init VAAPI jpeg decoder (and OpenCL context for OpenCV)
-    j2u = new jpeg2umat(0, 0, hwdevice);
+    this->backend = backend;
+    j2u = NULL;
+    tj = NULL;
+
+    if (backend == QRSCAN_BACKEND_CPU) {
+        // scaled jpeg decoder, no GPU
+        tj = new tj2umat(scan_width, scan_height);
+    } else {
+        // init VAAPI jpeg decoder (and OpenCL context for OpenCV)
+        j2u = new jpeg2umat(0, 0, hwdevice);
+    }
+
+    // OpenCV worker threads, the DNN mostly
+    if (threads > 0)
+        cv::setNumThreads(threads);
 
     // read undistort matrices from yml/xml
     cv::FileStorage undistort(undistort_path, cv::FileStorage::READ);
@@ -105,54 +210,203 @@ QRScan::QRScan(const char *undistort_path,
 
     // https://github.com/opencv/opencv/issues/22235
     detector.setPreferableBackend(cv::dnn::DNN_BACKEND_OPENCV);
-    detector.setPreferableTarget(cv::dnn::DNN_TARGET_OPENCL);
+    if (backend == QRSCAN_BACKEND_CPU)
+        detector.setPreferableTarget(cv::dnn::DNN_TARGET_CPU);
+    else
+        detector.setPreferableTarget(cv::dnn::DNN_TARGET_OPENCL);
 
     // save indistorted image size
     scan_size = cv::Size(scan_width, scan_height);
 
-    // init DynamsoftBarcodeReader
-    dbr = new dynamsoft::dbr::CBarcodeReader;
+    // init tracking
+    this->track_frames = track_frames;
+    track_left = 0;
+    track_batch = 0;
+    detector_runs = 0;
+
+    // init DynamsoftBarcodeReader pool
+    last_batch = 0;
+
+    if (readers_count == 0)
+        readers_count = 1;
+
+    for (unsigned int i = 0; i < readers_count; i++) {
+        auto dbr = new dynamsoft::dbr::CBarcodeReader;
 
-    // scan only for QR Code
-    PublicRuntimeSettings settings;
-    dbr->GetRuntimeSettings(&settings);
-    settings.barcodeFormatIds = BF_QR_CODE;
-    settings.barcodeFormatIds_2 = BF_NULL;
-    settings.minResultConfidence = 30;
-    dbr->UpdateRuntimeSettings(&settings);
+        // scan only for QR Code
+        PublicRuntimeSettings settings;
+        dbr->GetRuntimeSettings(&settings);
+        settings.barcodeFormatIds = BF_QR_CODE;
+        settings.barcodeFormatIds_2 = BF_NULL;
+        settings.minResultConfidence = 30;
+        // one thread per reader, the pool runs them in parallel
+        settings.maxAlgorithmThreadCount = 1;
+        dbr->UpdateRuntimeSettings(&settings);
+
+        readers.push_back(dbr);
+
+        // never joined, see ~QRScan()
+        std::thread(&QRScan::reader_thread, this, dbr).detach();
+    }
 }
 
 
-int QRScan::process_jpeg(void *data, size_t size)
+void QRScan::reader_thread(dynamsoft::dbr::CBarcodeReader *dbr)
 {
-    // empty results vector
-    results.clear();
-    curr = 0;
+    std::unique_lock<std::mutex> lk(lock);
+
+    for (;;) {
+        queued.wait(lk, [this] { return !candidates.empty(); });
+
+        candidate c = std::move(candidates.front());
+        candidates.pop_front();
+
+        lk.unlock();
+
+        // decode QR Code
+        std::vector<std::string> found;
+        int rc = dbr->DecodeBuffer(c.image.data,
+                                   c.image.cols,
+                                   c.image.rows,
+                                   c.image.step.p[0],
+                                   IPF_GRAYSCALED, "");
+        if (rc == DBR_OK) {
+            TextResultArray* dbrResults = NULL;
+            dbr->GetAllTextResults(&dbrResults);
+
+            if (dbrResults != NULL) {
+                for (int i = 0; i < dbrResults->resultsCount; ++i)
+                    found.push_back(dbrResults->results[i]->barcodeText);
+
+                dynamsoft::dbr::CBarcodeReader::FreeTextResults(&dbrResults);
+            }
+        }
+
+        lk.lock();
+
+        // store results
+        batch &b = batches[c.batch];
+        for (auto &text : found)
+            b.texts.push_back(std::move(text));
+
+        if (--b.pending == 0) {
+            track_update(c.batch, b);
+            decoded.notify_all();
+        }
+    }
+}
+
+
+// called with lock held when every candidate of batch id is decoded
+void QRScan::track_update(unsigned long id, const batch &b)
+{
+    // a newer frame has decided already
+    if (id < track_batch)
+        return;
+
+    track_batch = id;
+
+    if (b.rois.empty()) {
+        // tracked frame: keep tracking while codes are decoded
+        if (b.texts.empty()) {
+            tracked.clear();
+            track_left = 0;
+        }
+    } else if (!b.texts.empty()) {
+        // detected and decoded: start tracking
+        tracked = b.rois;
+        track_left = track_frames;
+    }
+}
+
+
+// tracked box grown by a half of its size to follow a moving code
+cv::Rect QRScan::track_roi(const cv::Rect &roi) const
+{
+    int x0 = std::max(roi.x - roi.width / 4, 0);
+    int y0 = std::max(roi.y - roi.height / 4, 0);
+    int x1 = std::min(roi.x + roi.width + roi.width / 4, roi_size.width);
+    int y1 = std::min(roi.y + roi.height + roi.height / 4, roi_size.height);
+
+    return cv::Rect(x0, y0, x1 - x0, y1 - y0);
+}
+
+
+// undistort box of the source resolution image and download it
+void QRScan::add_candidate(const cv::Rect &roi,
+                           std::vector<candidate> &found)
+{
+    // maps hold absolute source coordinates
+    cv::remap(gray, crop, map1(roi), map2(roi), cv::INTER_LINEAR);
+
+    candidate c;
+    crop.copyTo(c.image);
+
+    assert(c.image.isContinuous());
+
+    found.push_back(std::move(c));
+}
+
+
+int QRScan::process_jpeg(void *data, size_t size, double ts)
+{
+    std::vector<candidate> found;
 
     // decode jpeg image
-    j2u->decode2gray(data, size, gray);
+    if (backend == QRSCAN_BACKEND_CPU) {
+        // per thread setting: UMat operations on CPU
+        cv::ocl::setUseOpenCL(false);
+        tj->decode2gray(data, size, gray);
+    } else {
+        j2u->decode2gray(data, size, gray);
+    }
 
-    // calculate map1 & map2, detect_size and prepare blob size
+    // calculate maps, detect_size and prepare blob size
     if (!maps_initialized) {
         cv::Size gray_size = gray.size();
         if (scan_size.width == 0 || scan_size.height == 0)
             scan_size = gray_size;
 
-        cv::initUndistortRectifyMap(
-            K, D, cv::Mat(),
-            cv::getOptimalNewCameraMatrix(K, D, gray_size, 0,
-                                          scan_size, 0, true),
-            scan_size, CV_16SC2, map1, map2
-        );
+        // K is calibrated at the original resolution
+        cv::Mat Ks = K.clone();
+        if (tj != NULL) {
+            Ks.row(0) *= tj->scale();
+            Ks.row(1) *= tj->scale();
+        }
 
-        // preallocate undistort matrix
-        undistorted.create(scan_size.height, scan_size.width, CV_8UC1);
+        // undistorted camera matrix of scan_size image, scaled
+        // to the detector input and the source resolution below
+        cv::Mat P = cv::getOptimalNewCameraMatrix(Ks, D, gray_size, 0,
+                                                  scan_size, 0, true);
 
         float ratio = sqrt(1.0 * scan_size.width * scan_size.height /
                            (400 * 400));
         detect_size.width = static_cast<int>(scan_size.width / ratio);
         detect_size.height = static_cast<int>(scan_size.height / ratio);
 
+        cv::Mat Pd = P.clone();
+        Pd.row(0) *= 1.0 * detect_size.width / scan_size.width;
+        Pd.row(1) *= 1.0 * detect_size.height / scan_size.height;
+
+        cv::initUndistortRectifyMap(
+            Ks, D, cv::Mat(), Pd,
+            detect_size, CV_16SC2, dmap1, dmap2
+        );
+
+        // candidates are not downscaled
+        roi_scale = std::max(1.0 * gray_size.width / scan_size.width, 1.0);
+        roi_size.width = static_cast<int>(scan_size.width * roi_scale);
+        roi_size.height = static_cast<int>(scan_size.height * roi_scale);
+
+        cv::Mat Pr = P.clone();
+        Pr.row(0) *= roi_scale;
+        Pr.row(1) *= roi_scale;
+
+        cv::initUndistortRectifyMap(
+            Ks, D, cv::Mat(), Pr,
+            roi_size, CV_16SC2, map1, map2
+        );
+
         // preallocate detect matrices
         detect.create(detect_size.height, detect_size.width, CV_8UC1);
         detect32f.create(detect_size.height, detect_size.width, CV_32FC1);
@@ -167,83 +421,140 @@ int QRScan::process_jpeg(void *data, size_t size)
         maps_initialized = true;
     }
 
-    // remap image
-    cv::remap(gray, undistorted, map1, map2, cv::INTER_AREA);
+    // tracking: the same boxes, no detector
+    std::vector<cv::Rect> rois;
+
+    {
+        std::lock_guard<std::mutex> lk(lock);
+        if (track_left > 0) {
+            track_left--;
+            for (auto &roi : tracked)
+                rois.push_back(track_roi(roi));
+        }
+    }
+
+    if (!rois.empty()) {
+        for (auto &roi : rois)
+            add_candidate(roi, found);
 
-    // prepare undistorted image for detector dnn
-    cv::resize(undistorted, detect, detect_size, 0, 0, cv::INTER_AREA);
+        return queue_batch(found, ts, std::vector<cv::Rect>());
+    }
+
+    // undistort and scale image for detector dnn
+    cv::remap(gray, detect, dmap1, dmap2, cv::INTER_LINEAR);
     detect.convertTo(detect32f, CV_32F, 1.0 / 255);
 
     // run detector
     detector.setInput(detect32f.reshape(1, 4, blob_size), "data");
     auto prob = detector.forward("detection_output");
+    detector_runs++;
 
     // process results
     for (int row = 0; row < prob.size[2]; row++) {
         const float* prob_score = prob.ptr<float>(0, 0, row);
         if (prob_score[1] == 1) {
-            float x0 = prob_score[3] * undistorted.cols;
-            float y0 = prob_score[4] * undistorted.rows;
-            float x1 = prob_score[5] * undistorted.cols;
-            float y1 = prob_score[6] * undistorted.rows;
+            float x0 = prob_score[3] * roi_size.width;
+            float y0 = prob_score[4] * roi_size.height;
+            float x1 = prob_score[5] * roi_size.width;
+            float y1 = prob_score[6] * roi_size.height;
 
-            float padx = std::max(0.1 * (x1 - x0), 15.0);
-            float pady = std::max(0.1 * (y1 - y0), 15.0);
+            float padx = std::max(0.1 * (x1 - x0), 15.0 * roi_scale);
+            float pady = std::max(0.1 * (y1 - y0), 15.0 * roi_scale);
 
             int crop_x = std::max(static_cast<int>(x0 - padx), 0);
             int crop_y = std::max(static_cast<int>(y0 - pady), 0);
             int end_x = std::min(static_cast<int>(x1 + padx),
-                                 undistorted.cols - 1);
+                                 roi_size.width - 1);
             int end_y = std::min(static_cast<int>(y1 + pady),
-                                 undistorted.rows - 1);
+                                 roi_size.height - 1);
 
             cv::Rect roi(crop_x, crop_y,
                          end_x - crop_x + 1, end_y - crop_y + 1);
 
-            if (roi.width < 20 || roi.height < 20)
+            if (roi.width < 20 * roi_scale || roi.height < 20 * roi_scale)
                 continue;
 
-            // download candidate from GPU to CPU
-            cv::Mat candidate;
-            undistorted(roi).copyTo(candidate);
+            // undistort and download candidate from GPU to CPU
+            add_candidate(roi, found);
+            rois.push_back(roi);
+        }
+    }
 
-            assert(candidate.isContinuous());
+    return queue_batch(found, ts, rois);
+}
 
-            // decode QR Code
-            int rc = dbr->DecodeBuffer(candidate.data,
-                                       candidate.cols,
-                                       candidate.rows,
-                                       candidate.step.p[0],
-                                       IPF_GRAYSCALED, "");
-            if (rc != DBR_OK)
-                continue;
 
-            // store results
-            TextResultArray* dbrResults = NULL;
-            dbr->GetAllTextResults(&dbrResults);
+int QRScan::queue_batch(std::vector<candidate> &found, double ts,
+                        const std::vector<cv::Rect> &rois)
+{
+    if (found.empty())
+        return 0;
 
-            if (dbrResults != NULL && dbrResults->resultsCount > 0) {
-                for (int i = 0; i < dbrResults->resultsCount; ++i) {
-                    std::string str(dbrResults->results[i]->barcodeText);
-                    results.push_back(str);
-                }
-            }
+    // hand candidates over to the reader pool
+    std::lock_guard<std::mutex> lk(lock);
 
-            if (dbrResults != NULL)
-                dynamsoft::dbr::CBarcodeReader::FreeTextResults(&dbrResults);
+    last_batch++;
+
+    batch &b = batches[last_batch];
+    b.ts = ts;
+    b.pending = found.size();
+    b.rois = rois;
+
+    for (auto &c : found) {
+        c.batch = last_batch;
+        candidates.push_back(std::move(c));
+    }
+
+    queued.notify_all();
+
+    return found.size();
+}
+
+
+size_t QRScan::get_results(int flush, const qrscan_result **out)
+{
+    std::unique_lock<std::mutex> lk(lock);
+
+    // every frame but the last one (all with flush) must be decoded
+    decoded.wait(lk, [this, flush] {
+        for (auto &b : batches)
+            if (b.second.pending > 0 && (flush || b.first != last_batch))
+                return false;
+        return true;
+    });
+
+    texts.clear();
+    results.clear();
+
+    std::vector<double> ts;
+
+    for (auto it = batches.begin(); it != batches.end(); ) {
+        if (it->second.pending > 0) {
+            ++it;
+            continue;
         }
+
+        for (auto &text : it->second.texts) {
+            texts.push_back(std::move(text));
+            ts.push_back(it->second.ts);
+        }
+
+        it = batches.erase(it);
     }
 
+    // texts do not move any more
+    for (size_t i = 0; i < texts.size(); i++)
+        results.push_back({ts[i], texts[i].c_str()});
+
+    *out = results.data();
+
     return results.size();
 }
 
 
-const char *QRScan::get_result()
+unsigned long QRScan::get_detector_runs()
 {
-    if (curr == results.size())
-        return NULL;
-
-    return results.at(curr++).c_str();
+    return detector_runs;
 }
 
 
@@ -261,14 +572,22 @@ extern "C"
                         const char *detector_caffe_model_path,
                         unsigned short scan_width,
                         unsigned short scan_height,
-                        const char *hwdevice)
+                        const char *hwdevice,
+                        unsigned int readers,
+                        unsigned int track_frames,
+                        int backend,
+                        int threads)
     {
         return new QRScan(undistort_path,
                           detector_prototxt_path,
                           detector_caffe_model_path,
                           scan_width,
                           scan_height,
-                          hwdevice);
+                          hwdevice,
+                          readers,
+                          track_frames,
+                          backend,
+                          threads);
     }
 
     void qrscan_destroy(QRScan *qrscan)
@@ -276,13 +595,20 @@ extern "C"
         delete qrscan;
     }
 
-    int qrscan_process_jpeg(QRScan *qrscan, void *data, size_t size)
+    int qrscan_process_jpeg(QRScan *qrscan, void *data, size_t size,
+                            double ts)
+    {
+        return qrscan->process_jpeg(data, size, ts);
+    }
+
+    size_t qrscan_get_results(QRScan *qrscan, int flush,
+                              const qrscan_result **results)
     {
-        return qrscan->process_jpeg(data, size);
+        return qrscan->get_results(flush, results);
     }
 
-    const char *qrscan_get_result(QRScan *qrscan)
+    unsigned long qrscan_detector_runs(QRScan *qrscan)
     {
-        return qrscan->get_result();
+        return qrscan->get_detector_runs();
     }
 }
@@ -1,17 +1,56 @@
 #include <opencv2/opencv.hpp>
 #include <iostream>
+#include <iterator>
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+
+#include <dlfcn.h>
+#include <unistd.h>
 
 using namespace cv;
 using namespace cv::dnn;
 
-int main(int argc, char *argv[])
+
+// libqrscan.so C API
+struct qrscan_result {
+    double ts;
+    const char *text;
+};
+
+typedef void *(*qrscan_init_t)(const char *, const char *, const char *,
+                               unsigned short, unsigned short,
+                               const char *, unsigned int, unsigned int,
+                               int, int);
+typedef int (*qrscan_process_jpeg_t)(void *, void *, size_t, double);
+typedef size_t (*qrscan_get_results_t)(void *, int, const qrscan_result **);
+
+
+static void usage()
 {
-    if (argc != 2) {
-        std::cerr << "Usage: qrtest <image-file>\n";
-        return 1;
-    }
+    std::cerr << "Usage: qrtest <image-file>\n"
+                 "       qrtest -b <backend>[,<backend>...] [-n frames] "
+                 "[-t threads] [-r readers] [-L libdir] <image-file>\n"
+                 "\n"
+                 "  Without -b: run the detector once on the image to "
+                 "build OpenCL kernel cache\n"
+                 "  -b  benchmark libqrscan backends (vaapi, cpu) on the "
+                 "image, frames per second\n"
+                 "  -n  frames per backend (default: 100)\n"
+                 "  -t  OpenCV threads (default: OpenCV default)\n"
+                 "  -r  barcode readers (default: 2)\n"
+                 "  -L  directory with libqrscan.so (default: ../lib)\n";
+}
+
 
-    Mat img = imread(argv[1]);
+// build OpenCL kernel cache
+static int warmup(const char *path)
+{
+    Mat img = imread(path);
 
     Mat gray;
     cvtColor(img, gray, COLOR_BGR2GRAY);
@@ -34,3 +73,147 @@ int main(int argc, char *argv[])
 
     return 0;
 }
+
+
+// full libqrscan pipeline on the same jpeg, frames per second
+static int bench(const char *path, const std::string &backends, int frames,
+                 int threads, unsigned int readers, const std::string &libdir)
+{
+    // DBR is not in the library search path, load it first
+    std::string dbr_path = libdir + "/libDynamsoftBarcodeReader.so";
+    std::string qrscan_path = libdir + "/libqrscan.so";
+
+    if (dlopen(dbr_path.c_str(), RTLD_NOW | RTLD_GLOBAL) == NULL) {
+        std::cerr << dlerror() << "\n";
+        return 1;
+    }
+
+    void *lib = dlopen(qrscan_path.c_str(), RTLD_NOW);
+    if (lib == NULL) {
+        std::cerr << dlerror() << "\n";
+        return 1;
+    }
+
+    auto qrscan_init = (qrscan_init_t)dlsym(lib, "qrscan_init");
+    auto qrscan_process_jpeg =
+        (qrscan_process_jpeg_t)dlsym(lib, "qrscan_process_jpeg");
+    auto qrscan_get_results =
+        (qrscan_get_results_t)dlsym(lib, "qrscan_get_results");
+
+    if (!qrscan_init || !qrscan_process_jpeg || !qrscan_get_results) {
+        std::cerr << qrscan_path << ": qrscan API not found\n";
+        return 1;
+    }
+
+    std::ifstream f(path, std::ios::binary);
+    std::vector<char> jpeg((std::istreambuf_iterator<char>(f)),
+                           std::istreambuf_iterator<char>());
+    if (jpeg.empty()) {
+        std::cerr << path << ": failed to read\n";
+        return 1;
+    }
+
+    std::stringstream list(backends);
+    std::string name;
+    int rc = 0;
+
+    while (std::getline(list, name, ',')) {
+        int backend;
+
+        if (name == "vaapi") {
+            backend = 0;
+        } else if (name == "cpu") {
+            backend = 1;
+        } else {
+            std::cerr << name << ": unknown backend\n";
+            rc = 1;
+            continue;
+        }
+
+        // never destroyed, see ~QRScan()
+        void *q;
+        try {
+            q = qrscan_init("undistort.yml",
+                            "detect.prototxt",
+                            "detect.caffemodel",
+                            960, 540,
+                            "/dev/dri/renderD128",
+                            readers, 0, backend, threads);
+        } catch (std::exception &e) {
+            std::cerr << name << ": " << e.what() << "\n";
+            rc = 1;
+            continue;
+        }
+
+        const qrscan_result *results;
+        size_t decoded = 0;
+
+        // maps, kernels and DNN are set up on the first frames
+        for (int i = 0; i < 3; i++)
+            qrscan_process_jpeg(q, jpeg.data(), jpeg.size(), 0.0);
+        qrscan_get_results(q, 1, &results);
+
+        auto start = std::chrono::steady_clock::now();
+
+        for (int i = 0; i < frames; i++) {
+            qrscan_process_jpeg(q, jpeg.data(), jpeg.size(), i);
+            decoded += qrscan_get_results(q, 0, &results);
+        }
+        decoded += qrscan_get_results(q, 1, &results);
+
+        std::chrono::duration<double> elapsed =
+            std::chrono::steady_clock::now() - start;
+
+        printf("%-6s %5d frames %8.1f fps %8.1f ms/frame %5zu decoded\n",
+               name.c_str(), frames, frames / elapsed.count(),
+               elapsed.count() * 1000 / frames, decoded);
+        fflush(stdout);
+    }
+
+    // QRScan cleanup is not supported
+    _exit(rc);
+}
+
+
+int main(int argc, char *argv[])
+{
+    std::string backends;
+    std::string libdir = "../lib";
+    unsigned int readers = 2;
+    int frames = 100;
+    int threads = 0;
+    int opt;
+
+    while ((opt = getopt(argc, argv, "b:n:t:r:L:h")) != -1) {
+        switch (opt) {
+            case 'b':
+                backends = optarg;
+                break;
+            case 'n':
+                frames = atoi(optarg);
+                break;
+            case 't':
+                threads = atoi(optarg);
+                break;
+            case 'r':
+                readers = atoi(optarg);
+                break;
+            case 'L':
+                libdir = optarg;
+                break;
+            default:
+                usage();
+                return 1;
+        }
+    }
+
+    if (optind != argc - 1 || frames <= 0) {
+        usage();
+        return 1;
+    }
+
+    if (backends.empty())
+        return warmup(argv[optind]);
+
+    return bench(argv[optind], backends, frames, threads, readers, libdir);
+}
@@ -0,0 +1,81 @@
+#include "tj2umat.hpp"
+
+#include <stdexcept>
+#include <string>
+
+#include <opencv2/core.hpp>
+#include <opencv2/core/mat.hpp>
+
+
+static std::string tjerr(tjhandle handle)
+{
+    return std::string(tjGetErrorStr2(handle));
+}
+
+tj2umat::tj2umat(size_t w, size_t h)
+{
+    this->w = w;
+    this->h = h;
+    last_scale = 1.0;
+
+    handle = tjInitDecompress();
+    if (handle == NULL)
+        throw std::runtime_error("Failed to init turbojpeg decompressor");
+
+    factors = tjGetScalingFactors(&factors_count);
+    if (factors == NULL) {
+        tjDestroy(handle);
+        throw std::runtime_error("Failed to get turbojpeg scaling factors");
+    }
+}
+
+tj2umat::~tj2umat()
+{
+    tjDestroy(handle);
+}
+
+void tj2umat::decode2gray(void *jpeg, size_t size, cv::UMat &dst)
+{
+    const unsigned char *src = (const unsigned char *)jpeg;
+    int width, height, subsamp, colorspace;
+    int ret;
+
+    ret = tjDecompressHeader3(handle, src, size, &width, &height,
+                              &subsamp, &colorspace);
+    if (ret != 0)
+        throw std::runtime_error("Failed to read jpeg header: " +
+                                 tjerr(handle));
+
+    // the smallest scaled image covering w x h, the original by default
+    int sw = width;
+    int sh = height;
+
+    if (w > 0 && h > 0) {
+        for (int i = 0; i < factors_count; i++) {
+            int fw = TJSCALED(width, factors[i]);
+            int fh = TJSCALED(height, factors[i]);
+
+            if (fw >= w && fh >= h && fw < sw) {
+                sw = fw;
+                sh = fh;
+            }
+        }
+    }
+
+    // decode luminance right into dst
+    dst.create(sh, sw, CV_8UC1);
+
+    {
+        cv::Mat gray = dst.getMat(cv::ACCESS_WRITE);
+
+        ret = tjDecompress2(handle, src, size, gray.data,
+                            sw, gray.step.p[0], sh, TJPF_GRAY, 0);
+
+        // warnings: corrupt data, the image is still usable
+        if (ret != 0 && tjGetErrorCode(handle) != TJERR_WARNING)
+            throw std::runtime_error("Failed to decode jpeg: " +
+                                     tjerr(handle));
+    }
+
+    last_scale = static_cast<double>(sw) / width;
+}
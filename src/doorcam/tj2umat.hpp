@@ -0,0 +1,30 @@
+#ifndef _TJ2UMAT_HPP_
+#define _TJ2UMAT_HPP_
+
+#include <cstddef>
+
+#include <turbojpeg.h>
+#include <opencv2/core/mat.hpp>
+
+// CPU counterpart of jpeg2umat: libjpeg-turbo decodes the luminance
+// only, at the smallest DCT scaling factor covering w x h
+class tj2umat {
+    int w;
+    int h;
+
+    tjhandle handle;
+    tjscalingfactor *factors;
+    int factors_count;
+
+    double last_scale;
+
+  public:
+    tj2umat(size_t w = 0, size_t h = 0);
+    ~tj2umat();
+    void decode2gray(void *jpeg, size_t size, cv::UMat &dst);
+
+    // decoded / original image width of the last frame
+    double scale() const { return last_scale; }
+};
+
+#endif
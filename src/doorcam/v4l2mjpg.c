@@ -2,6 +2,8 @@
  * gcc -shared -fPIC -O3 -Wall -o v4l2mjpg.so v4l2mjpg.c
  */
 
+#define _GNU_SOURCE
+
 #include <sys/mman.h>
 #include <sys/ioctl.h>
 #include <sys/types.h>
@@ -22,6 +24,9 @@
 #define V4L2_PIX_FMT_MJPEG v4l2_fourcc('M', 'J', 'P', 'G')  /* Motion-JPEG */
 #endif
 
+/* default: scan the whole entropy-coded data every 300 frames */
+#define CHECK_INTERVAL 300
+
 
 struct buffer {
     void *start;
@@ -35,6 +40,12 @@ struct context {
     int                 pending_size;
     struct buffer      *buffers;
     unsigned int        count;
+    unsigned long       skipped;
+    unsigned long       dropped;
+    uint32_t            sequence;
+    int                 sequenced;
+    unsigned int        check_interval;
+    unsigned int        checked;
 };
 
 
@@ -50,8 +61,41 @@ static int xioctl(int fh, int request, void *arg)
 }
 
 
+/*
+ * Wall clock time of capture: drivers stamp buffers with
+ * CLOCK_MONOTONIC, fall back to dequeue time otherwise
+ */
+static double capture_time(const struct v4l2_buffer *buf)
+{
+    struct timespec real, mono;
+    double ts;
+
+    clock_gettime(CLOCK_REALTIME, &real);
+    ts = real.tv_sec + real.tv_nsec * 1e-9;
+
+    if ((buf->flags & V4L2_BUF_FLAG_TIMESTAMP_MASK) !=
+            V4L2_BUF_FLAG_TIMESTAMP_MONOTONIC)
+        return ts;
+
+    if (buf->timestamp.tv_sec == 0 && buf->timestamp.tv_usec == 0)
+        return ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &mono);
+
+    return ts - (mono.tv_sec + mono.tv_nsec * 1e-9) +
+           (buf->timestamp.tv_sec + buf->timestamp.tv_usec * 1e-6);
+}
+
+
+/*
+ * Validate jpeg and find its real size
+ *   full - scan entropy-coded data for the end of image marker,
+ *          otherwise parse headers only and search EOI backward
+ *          from the end of the buffer
+ */
 static int jpeg_check(const void *buffer,
                       unsigned int size,
+                      int full,
                       uint16_t *width,
                       uint16_t *height)
 {
@@ -70,7 +114,7 @@ static int jpeg_check(const void *buffer,
     /* iterate over all blocks */
     while (b < e) {
         for (; *b == 0xFF; b++)
-            if (b >= e)
+            if (b + 1 >= e)
                 return -1;
 
         switch (*b++) {
@@ -122,6 +166,33 @@ static int jpeg_check(const void *buffer,
             case 0xDA:
                 /* start of scan */
                 //printf("(FFDA) ");
+                if (!full) {
+                    uint8_t *sos;
+
+                    if (b + 2 > e || w == 0 || h == 0)
+                        return -1;
+
+                    /* entropy-coded data never contains FFD9,
+                     * the buffer may be padded after EOI */
+                    sos = b + (b[0] << 8) + b[1];
+                    if (sos >= e)
+                        return -1;
+
+                    for (b = e;;) {
+                        b = memrchr(sos, 0xD9, b - sos);
+                        if (b == NULL || b == sos)
+                            return -1;
+                        if (b[-1] == 0xFF)
+                            break;
+                    }
+
+                    *width = w;
+                    *height = h;
+
+                    /* return real jpeg size */
+                    return (b + 1 - (uint8_t *)buffer);
+                }
+
                 do {
                     uint8_t *ff = memchr(b, 0xff, e - b);
                     if (ff == NULL)
@@ -206,6 +277,11 @@ struct context *v4l2_open(const char *device,
     ctx->fd = open(device, O_RDWR /* required */ | O_NONBLOCK, 0);
     ctx->count = 0;
     ctx->buffers = NULL;
+    ctx->skipped = 0;
+    ctx->dropped = 0;
+    ctx->sequenced = 0;
+    ctx->check_interval = CHECK_INTERVAL;
+    ctx->checked = 0;
 
     if (ctx->fd == -1)
         goto err;
@@ -327,6 +403,9 @@ int v4l2_start(struct context *ctx)
 
     ctx->pending_size = -1;
 
+    /* drivers restart sequence numbers on stream on */
+    ctx->sequenced = 0;
+
     return 0;
 }
 
@@ -346,12 +425,15 @@ void *v4l2_dqbuf(struct context *ctx,
                  unsigned int timeout,
                  size_t *size,
                  unsigned int *width,
-                 unsigned int *height)
+                 unsigned int *height,
+                 double *timestamp,
+                 uint32_t *sequence)
 {
     struct v4l2_buffer buf;
     struct pollfd fd;
     uint16_t w, h;
     int framesize;
+    int full;
     int msec;
     int ret;
 
@@ -388,8 +470,24 @@ void *v4l2_dqbuf(struct context *ctx,
             return NULL;
         }
 
+        /* sequence gaps are frames lost by the driver */
+        if (ctx->sequenced && buf.sequence - ctx->sequence - 1 < 0x80000000U)
+            ctx->dropped += buf.sequence - ctx->sequence - 1;
+        ctx->sequence = buf.sequence;
+        ctx->sequenced = 1;
+
+        /* headers only, full scan periodically and on error */
+        full = ctx->check_interval == 0 ||
+               ++ctx->checked >= ctx->check_interval;
+        if (full)
+            ctx->checked = 0;
+
         framesize = jpeg_check(ctx->buffers[buf.index].start,
-                               buf.bytesused, &w, &h);
+                               buf.bytesused, full, &w, &h);
+
+        if (framesize == -1 && !full)
+            framesize = jpeg_check(ctx->buffers[buf.index].start,
+                                   buf.bytesused, 1, &w, &h);
 
         /* {
             unsigned char *b = (unsigned char *)ctx->buffers[buf.index].start;
@@ -399,6 +497,7 @@ void *v4l2_dqbuf(struct context *ctx,
 
         if (framesize == -1) {
             // skip buggy frame
+            ctx->skipped++;
             xioctl(ctx->fd, VIDIOC_QBUF, &buf);
             continue;
         }
@@ -409,6 +508,8 @@ void *v4l2_dqbuf(struct context *ctx,
         *size = (size_t) framesize;
         *width = w;
         *height = h;
+        *timestamp = capture_time(&buf);
+        *sequence = buf.sequence;
 
         return ctx->buffers[ctx->pending.index].start;
     }
@@ -433,3 +534,40 @@ int v4l2_qbuf(struct context *ctx)
 
     return 0;
 }
+
+
+unsigned long v4l2_skipped(struct context *ctx)
+{
+    return ctx->skipped;
+}
+
+
+unsigned long v4l2_dropped(struct context *ctx)
+{
+    return ctx->dropped;
+}
+
+
+/*
+ * Scan the whole entropy-coded data every interval frames
+ * (0 - every frame), only headers are parsed otherwise
+ */
+void v4l2_set_check_interval(struct context *ctx, unsigned int interval)
+{
+    ctx->check_interval = interval;
+    ctx->checked = 0;
+}
+
+
+/*
+ * jpeg_check for benchmarks and recorded frames,
+ * returns jpeg size or -1
+ */
+int v4l2_jpeg_check(const void *buffer,
+                    unsigned int size,
+                    int full,
+                    uint16_t *width,
+                    uint16_t *height)
+{
+    return jpeg_check(buffer, size, full, width, height);
+}